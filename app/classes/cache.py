@@ -0,0 +1,399 @@
+from __future__ import annotations
+import time
+import ujson
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Tuple, Type
+from cachetools import LRUCache
+from pydantic import BaseModel
+from app import metrics
+from app.objects import RD
+
+logger = logging.getLogger(__name__)
+
+CacheEntry = Tuple[ float, BaseModel ]
+
+class TieredCache:
+    # in-process LRU in front of redis, values are pydantic models
+    # every redis key lives under namespace and carries the model name, so a value
+    # of another schema is never read back as this one
+    # ttl          - seconds a value is fresh
+    # stale_ttl    - seconds after ttl a value is still served while refreshed in background
+    # push_ttl     - seconds a value is fresh while invalidations are pushed by the registry
+    # keep_ttl     - seconds redis keeps the last good value to fall back on
+    # failure_ttl  - seconds after a failed refresh before the loader is called again
+    # wait         - seconds a caller holding an expired value waits for its refresh
+    # negative_ttl - seconds an empty model is fresh when negative() takes the loader error
+    #                for a definite answer rather than a failure
+    # a failed refresh never replaces a good value: callers get the last good one,
+    # or an empty model when there is none, and Degraded() tells them so
+    # redis failing is not a failure of the cache, reads fall through to the loader
+    # and writes keep the value in the local tier only
+    # an invalidation only marks values stale, they stay the last good ones to fall back on,
+    # and a refresh that started before it is not stored
+    name:         str
+    namespace:    str
+    model:        Type[ BaseModel ]
+    ttl:          int
+    stale_ttl:    int
+    push_ttl:     int
+    keep_ttl:     int
+    failure_ttl:  int
+    wait:         float
+    negative_ttl: int
+
+    def __init__(
+        self,
+        model: Type[ BaseModel ],
+        ttl: int = 60,
+        stale_ttl: int = 3600,
+        maxsize: int = 256,
+        name: str | None = None,
+        namespace: str | None = None,
+        push_ttl: int = 3600,
+        keep_ttl: int = 86400 * 7,
+        failure_ttl: int = 10,
+        wait: float = 2,
+        negative: Callable[ [ BaseException ], bool ] | None = None,
+        negative_ttl: int = 60
+    ) -> None:
+        self.name = name or model.__name__
+        self.namespace = namespace or f'cache:{self.name}'
+        self.model = model
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.push_ttl = push_ttl
+        self.keep_ttl = keep_ttl
+        self.pushed = False
+        self.failure_ttl = failure_ttl
+        self.wait = wait
+        self.negative = negative or ( lambda e: False )
+        self.negative_ttl = negative_ttl
+        self._local: LRUCache[ str, CacheEntry ] = LRUCache( maxsize=maxsize )
+        self._inflight: Dict[ str, asyncio.Future ] = {}
+        self._failed: Dict[ str, float ] = {}
+        # invalidation times, values stored in redis before them are stale
+        self._invalidated: Dict[ str, float ] = {}
+        self._invalidated_all: float = 0
+        self._generation: int = 0
+        self._hits: int = 0
+        self._misses: int = 0
+
+
+    async def Get(
+        self,
+        key: str,
+        loader: Callable[ [], Awaitable[ BaseModel ] ]
+    ) -> BaseModel:
+        now = time.time()
+
+        tier = 'local'
+        entry = self._local.get( key )
+        if entry is None:
+            tier = 'redis'
+            entry = await self.readRemote( key )
+            if entry is not None:
+                self._local[ key ] = entry
+
+        if entry is not None:
+            fresh_until, value = entry
+            if fresh_until > now:
+                self.count( tier )
+                return value
+            if fresh_until + self.stale_ttl > now or self.Degraded( key ):
+                self.count( 'stale' )
+                if not self.Degraded( key ):
+                    self.load( key, loader )
+                return value
+            # expired: wait a moment for the refresh, then keep serving the old value
+            self.count( 'expired' )
+            try:
+                return await asyncio.wait_for( asyncio.shield( self.load( key, loader ) ), self.wait )
+            except TimeoutError:
+                return value
+
+        if self.Degraded( key ):
+            self.count( 'failed' )
+            return self.model()
+
+        self.count( 'miss' )
+        return await asyncio.shield( self.load( key, loader ) )
+
+
+    def Degraded( self, key: str | None = None ) -> bool:
+        # whether the last refresh of key (of any key by default) failed recently
+        now = time.time()
+        if key is None:
+            return any( x > now for x in self._failed.values() )
+        return self._failed.get( key, 0 ) > now
+
+
+    async def Set( self, key: str, value: BaseModel, ttl: int | None = None ) -> None:
+        ttl = ttl or ( self.push_ttl if self.pushed else self.ttl )
+        entry = ( time.time() + ttl, value )
+        self._local[ key ] = entry
+        cached = ujson.dumps( { 'schema': self.model.__name__, 'stored': time.time(), 'fresh_until': entry[0], 'data': value.model_dump( mode='json' ) } )
+        try:
+            await RD.setex( self.redisKey( key ), max( ttl + self.stale_ttl, self.keep_ttl ), cached )
+        except Exception as e:
+            metrics.CACHE_REDIS_ERRORS.labels( self.name, 'write' ).inc()
+            logger.warning( f'Cache: storing {self.redisKey( key )} in redis failed with {e!r}' )
+
+
+    async def Delete( self, key: str ) -> None:
+        self._local.pop( key, None )
+        self._failed.pop( key, None )
+        await RD.delete( self.redisKey( key ) )
+
+
+    def Invalidate( self, keys: List[ str ] | None = None ) -> None:
+        # marks the keys (every key by default) stale on this replica, every replica gets
+        # the same invalidation, so the copies in redis are left as the last good values
+        now = time.time()
+        self._generation += 1
+        # a refresh already running may carry the old data, later callers start a new one
+        if keys:
+            for key in keys:
+                self._invalidated[ key ] = now
+                self._inflight.pop( key, None )
+                self.expire( key )
+        else:
+            self._invalidated_all = now
+            self._invalidated.clear()
+            self._inflight.clear()
+            for key in list( self._local.keys() ):
+                self.expire( key )
+        # values stored before the oldest fresh one can't be fresh any more
+        horizon = now - max( self.ttl, self.push_ttl )
+        self._invalidated = { k: v for k, v in self._invalidated.items() if v > horizon }
+
+
+    def Clear( self ) -> None:
+        self._local.clear()
+        self._failed.clear()
+
+
+    def Ratio( self ) -> float | None:
+        # share of lookups answered without waiting for the loader
+        total = self._hits + self._misses
+        return self._hits / total if total else None
+
+    #
+
+    def load(
+        self,
+        key: str,
+        loader: Callable[ [], Awaitable[ BaseModel ] ]
+    ) -> asyncio.Future:
+        # single-flight: every caller of a key waits for the same fetch
+        future = self._inflight.get( key )
+        if future is None:
+            future = asyncio.ensure_future( self.fetch( key, loader ) )
+            self._inflight[ key ] = future
+            future.add_done_callback( lambda f: self.loaded( key, f ) )
+        return future
+
+
+    def loaded( self, key: str, future: asyncio.Future ) -> None:
+        if self._inflight.get( key ) is future:
+            del self._inflight[ key ]
+        if not future.cancelled() and future.exception():
+            logger.error( f'Cache: refresh of {key} failed: {future.exception()!r}' )
+
+
+    async def fetch(
+        self,
+        key: str,
+        loader: Callable[ [], Awaitable[ BaseModel ] ]
+    ) -> BaseModel:
+        generation = self._generation
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self.negative( e ):
+                # the other side answered "nothing here", that is cached like any value
+                value = self.model()
+                self._failed.pop( key, None )
+                if generation == self._generation:
+                    await self.Set( key, value, self.negative_ttl )
+                return value
+            self._failed[ key ] = time.time() + self.failure_ttl
+            metrics.CACHE_REFRESH_FAILURES.labels( self.name ).inc()
+            logger.warning( f'Cache: refresh of {key} failed with {e!r}, serving the last good value' )
+            entry = self._local.get( key ) or await self.readRemote( key )
+            return entry[1] if entry else self.model()
+        self._failed.pop( key, None )
+        if generation != self._generation:
+            # invalidated meanwhile, the value may already be outdated
+            return value
+        await self.Set( key, value )
+        return value
+
+
+    async def readRemote( self, key: str ) -> CacheEntry | None:
+        try:
+            cached = await RD.get( self.redisKey( key ) )
+        except Exception as e:
+            metrics.CACHE_REDIS_ERRORS.labels( self.name, 'read' ).inc()
+            logger.warning( f'Cache: reading {self.redisKey( key )} from redis failed with {e!r}' )
+            return None
+        if not cached:
+            return None
+        try:
+            raw = ujson.loads( cached )
+            if raw.get( 'schema' ) != self.model.__name__:
+                return None
+            fresh_until = float( raw['fresh_until'] )
+            if float( raw.get( 'stored', 0 ) ) <= max( self._invalidated_all, self._invalidated.get( key, 0 ) ):
+                fresh_until = 0
+            return ( fresh_until, self.model.model_validate( raw['data'] ) )
+        except Exception:
+            return None
+
+
+    def expire( self, key: str ) -> None:
+        entry = self._local.get( key )
+        if entry is not None:
+            self._local[ key ] = ( 0, entry[1] )
+        self._failed.pop( key, None )
+
+
+    def redisKey( self, key: str ) -> str:
+        return f'{self.namespace}:{key}' if key else self.namespace
+
+
+    def count( self, result: str ) -> None:
+        if result in [ 'miss', 'expired', 'failed' ]:
+            self._misses += 1
+        else:
+            self._hits += 1
+        metrics.CACHE_REQUESTS.labels( self.name, result ).inc()
+        metrics.CACHE_HIT_RATIO.labels( self.name ).set( self.Ratio() )
+
+
+class CacheRegistry:
+    # the cached entities of a service, each with its own namespace, model and lifetimes
+    # invalidations are pushed over a redis channel to every replica:
+    #   "*" or {}                                  - everything
+    #   {"caches": ["site_data"]}                  - whole entities
+    #   {"caches": ["site_data"], "keys": ["a.b"]} - single keys of them
+    # while subscribed values stay fresh for push_ttl instead of ttl
+    channel: str = 'cache_invalidate'
+
+    def __init__( self ) -> None:
+        self._caches: Dict[ str, TieredCache ] = {}
+        self._task: asyncio.Task | None = None
+        self._subscribed: asyncio.Event = asyncio.Event()
+
+
+    def Register( self, cache: TieredCache ) -> TieredCache:
+        for other in self._caches.values():
+            if cache.name == other.name or cache.namespace == other.namespace:
+                raise ValueError( f'Cache "{cache.name}" ({cache.namespace}) is already registered' )
+        self._caches[ cache.name ] = cache
+        return cache
+
+
+    def Caches( self, names: List[ str ] | None = None ) -> List[ TieredCache ]:
+        if not names:
+            return list( self._caches.values() )
+        return [ self._caches[ name ] for name in names if name in self._caches ]
+
+
+    async def Listen( self, channel: str = 'cache_invalidate', timeout: float = 5 ) -> None:
+        # returns once subscribed, so values read after it are not older than the subscription;
+        # redis being down delays startup by timeout at most, the task keeps resubscribing
+        if self._task:
+            return
+        self.channel = channel
+        self._task = asyncio.create_task( self.listen() )
+        try:
+            async with asyncio.timeout( timeout ):
+                await self._subscribed.wait()
+        except TimeoutError:
+            logger.warning( f'Cache: not subscribed to "{channel}" in {timeout}s, invalidations are missed until it is' )
+
+
+    async def Stop( self ) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather( self._task, return_exceptions=True )
+            self._task = None
+        self._subscribed.clear()
+        self.setPushed( False )
+
+
+    def Invalidate( self, names: List[ str ] | None = None, keys: List[ str ] | None = None ) -> None:
+        for cache in self.Caches( names ):
+            cache.Invalidate( keys )
+            logger.info( f'Cache: {cache.name} invalidated' + ( f' for {keys}' if keys else '' ) )
+
+
+    async def Publish( self, names: List[ str ] | None = None, keys: List[ str ] | None = None ) -> None:
+        # invalidates on every replica, this one included
+        message: Dict[ str, List[ str ] ] = {}
+        if names:
+            message['caches'] = names
+        if keys:
+            message['keys'] = keys
+        if not self.Listening():
+            self.Invalidate( names, keys )
+        await RD.publish( self.channel, ujson.dumps( message ) )
+
+
+    def Listening( self ) -> bool:
+        return any( cache.pushed for cache in self.Caches() )
+
+
+    def Degraded( self, names: List[ str ] | None = None ) -> bool:
+        return any( cache.Degraded() for cache in self.Caches( names ) )
+
+
+    def Ratios( self ) -> Dict[ str, float | None ]:
+        return { cache.name: cache.Ratio() for cache in self.Caches() }
+
+    #
+
+    async def listen( self ) -> None:
+        failures = 0
+        while True:
+            try:
+                async with RD.pubsub() as pubsub:
+                    await pubsub.subscribe( self.channel )
+                    # whatever was published while not subscribed is lost, start over
+                    self.Invalidate()
+                    self.setPushed( True )
+                    self._subscribed.set()
+                    failures = 0
+                    logger.info( f'Cache: listening for invalidations on "{self.channel}"' )
+                    async for message in pubsub.listen():
+                        if message.get( 'type' ) == 'message':
+                            await self.received( message.get( 'data' ) )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.setPushed( False )
+                self._subscribed.clear()
+                failures += 1
+                delay = min( 2 ** failures, 60 )
+                logger.warning( f'Cache: invalidation channel failed with {e!r}, resubscribing in {delay}s' )
+                await asyncio.sleep( delay )
+
+
+    async def received( self, data: str ) -> None:
+        try:
+            message = ujson.loads( data ) if data and data != '*' else {}
+            names = message.get( 'caches' ) or None
+            keys = message.get( 'keys' ) or None
+        except ( ValueError, AttributeError ):
+            logger.warning( f'Cache: malformed invalidation {data!r}' )
+            return
+        metrics.CACHE_INVALIDATIONS.inc()
+        self.Invalidate( names, keys )
+
+
+    def setPushed( self, pushed: bool ) -> None:
+        for cache in self.Caches():
+            cache.pushed = pushed
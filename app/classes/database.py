@@ -2,30 +2,117 @@ import traceback
 import os
 import logging
 import ujson
+import time
 import asyncio
+import functools
 from typing import List, Dict, Any
 from datetime import datetime, timedelta
 from sqlalchemy import func, select, delete, exists, or_, and_
-from sqlalchemy import create_engine
-from sqlalchemy import Engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import *
 from sqlalchemy.dialects.mysql import insert
+from redis.asyncio import Redis
 from app import variables
 from app import models
 from app import dto
+from app import metrics
+from app.classes.entity_cache import EntityCache
+from app.classes.usage import UsageCounter
+from app.classes.stats import StatsBuffer
+from app.classes.resilience import RetryPolicy
 
 logger = logging.getLogger(__name__)
 
+# server gone away, lost connection, can't connect, too many connections, lock wait timeout, deadlock
+TRANSIENT_MYSQL_ERRORS = { 1040, 1205, 1213, 2002, 2003, 2006, 2013, 2055 }
+# the subset that is raised before a statement takes effect: can't connect, too many connections,
+# lock wait timeout and deadlock roll back, a lost connection may come after the commit
+UNSENT_MYSQL_ERRORS = { 1040, 1205, 1213, 2002, 2003 }
+
+
+def transientError( e: BaseException ) -> bool:
+    # sqlalchemy TimeoutError is a pool checkout timeout
+    if isinstance( e, ( DisconnectionError, InterfaceError, TimeoutError ) ):
+        return True
+    if isinstance( e, DBAPIError ):
+        if e.connection_invalidated:
+            return True
+        if isinstance( e, OperationalError ) and e.orig is not None and e.orig.args:
+            return e.orig.args[0] in TRANSIENT_MYSQL_ERRORS
+    return False
+
+
+def unsentError( e: BaseException ) -> bool:
+    # sqlalchemy TimeoutError is a pool checkout timeout, DisconnectionError a failed checkout ping
+    if isinstance( e, ( DisconnectionError, TimeoutError ) ):
+        return True
+    if isinstance( e, OperationalError ) and e.orig is not None and e.orig.args:
+        return e.orig.args[0] in UNSENT_MYSQL_ERRORS
+    return False
+
+
+def retried( func = None, *, idempotent: bool = True ):
+    # runs a DataBase query under the shared retry policy, every attempt calls func anew with a fresh session
+    # sessions are closed under asyncio.shield, so a cancelled caller still returns its connection to the pool
+    # writes that are not idempotent are only retried after errors raised before the statement took effect
+    if func is None:
+        return functools.partial( retried, idempotent=idempotent )
+
+    @functools.wraps( func )
+    async def wrapper( self, *args, **kwargs ):
+        started = time.monotonic()
+        status = 'ok'
+        retries = self._retries if idempotent else self._write_retries
+        try:
+            return await retries.Run( functools.partial( func, self, *args, **kwargs ), name=f'db.{func.__name__}' )
+        except:
+            status = 'error'
+            raise
+        finally:
+            metrics.DB_QUERY_LATENCY.labels( func.__name__, status ).observe( time.monotonic() - started )
+    return wrapper
+
+
 class DataBase(object):
     _server:  str = ""
-    _engine:  Engine = None
-    _session: sessionmaker[Session] = None
-
+    _engine:  AsyncEngine = None
+    _session: async_sessionmaker[AsyncSession] = None
+    _redis:   Redis = None
+    # entity caches
+    _users:        EntityCache = None
+    _sites_config: EntityCache = None
+    _acl:          EntityCache = None
+    # daily usage counters
+    _usage:           UsageCounter = None
+    _usage_reconcile: asyncio.Task = None
+    usage_reconcile_interval: int = 300
+    # users_stats write-behind
+    _stats:               StatsBuffer = None
+    stats_flush_interval: float = 1.0
+    stats_flush_size:     int = 500
+    # queries retry policy, deadline stays below the 5s callers wait
+    _retries:       RetryPolicy = None
+    _write_retries: RetryPolicy = None
+    retry_attempts: int = 3
+    retry_deadline: float = 4
+
+
+    def __init__(self, redis: Redis | None = None):
+
+        if redis is not None:
+            self._redis = redis
+
+        self._users = EntityCache( 'user', models.User, self._redis, ttl=600 )
+        self._sites_config = EntityCache( 'site_config', models.SiteConfig, self._redis, ttl=600 )
+        self._acl = EntityCache( 'acl', models.ACL, self._redis, ttl=60 )
+        if self._redis is not None:
+            self._usage = UsageCounter( self._redis )
+        if self._stats is None:
+            self._stats = StatsBuffer( self.writeUserStats, retryable=unsentError )
 
-    def __init__(self):
-        
         config_file = '/app/configs/database.json'
         if not os.path.exists( config_file ):
             raise FileNotFoundError( config_file )
@@ -38,10 +125,25 @@ class DataBase(object):
 
 
         if 'server' in config:
-            self._server = config['server']
+            self._server = config['server'].replace( 'mysql+pymysql://', 'mysql+aiomysql://' )
         else:
             raise Exception('No server defined')
 
+        if 'stats_flush_interval' in config:
+            self.stats_flush_interval = float( config['stats_flush_interval'] )
+
+        if 'stats_flush_size' in config:
+            self.stats_flush_size = int( config['stats_flush_size'] )
+
+        if 'retry_attempts' in config:
+            self.retry_attempts = int( config['retry_attempts'] )
+
+        if 'retry_deadline' in config:
+            self.retry_deadline = float( config['retry_deadline'] )
+
+        self._retries = RetryPolicy( 'db', attempts=self.retry_attempts, base=0.2, cap=2, deadline=self.retry_deadline, transient=transientError )
+        self._write_retries = RetryPolicy( 'db_write', attempts=self.retry_attempts, base=0.2, cap=2, deadline=self.retry_deadline, transient=unsentError, retry_timeouts=False )
+
 
     async def Start(self) -> None:
         if self._engine:
@@ -50,20 +152,23 @@ class DataBase(object):
         while True:
             try:
                 if not self._engine:
-                    self._engine = create_engine(
+                    self._engine = create_async_engine(
                         self._server,
                         pool_size = 5,
                         max_overflow = 5,
                         pool_recycle = 60,
                         pool_pre_ping = True
                     )
-                    self._session = sessionmaker( self._engine, expire_on_commit=False )
+                    self._session = async_sessionmaker( self._engine, expire_on_commit=False )
 
                 try:
                     await self.createDB()
                 except Exception as e:
                     traceback.print_exc()
                     raise variables.UpdateDBError()
+                if self._usage and not self._usage_reconcile:
+                    self._usage_reconcile = asyncio.create_task( self.reconcileUsage() )
+                await self._stats.Start( interval=self.stats_flush_interval, size=self.stats_flush_size )
                 logger.info('DB: started')
                 return
             except variables.UpdateDBError:
@@ -74,9 +179,13 @@ class DataBase(object):
 
 
     async def Stop(self) -> None:
+        if self._usage_reconcile:
+            self._usage_reconcile.cancel()
+            self._usage_reconcile = None
         if self._engine:
+            await self._stats.Stop()
             logger.info('DB: finished')
-            self._engine.dispose()
+            await self._engine.dispose()
             self._engine = None
             self._session = None
 
@@ -84,7 +193,8 @@ class DataBase(object):
     async def createDB(self) -> None:
         if self._engine:
             logger.info('DB: validate database')
-            models.Base.metadata.create_all( bind=self._engine, checkfirst=True )
+            async with self._engine.begin() as conn:
+                await conn.run_sync( models.Base.metadata.create_all, checkfirst=True )
             logger.info('DB: validated database')
 
 
@@ -94,15 +204,27 @@ class DataBase(object):
             await self.Stop()
             await self.Start()
 
+
+    async def ResetCaches(self) -> None:
+        await self._users.Clear()
+        await self._sites_config.Clear()
+        await self._acl.Clear()
+
     #
 
+    @retried
     async def GetACL(
         self,
         user_id: int
     ) -> models.ACL|None:
+        found, acl = await self._acl.Get( user_id )
+        if found:
+            return acl
+
+        version = self._acl.Version()
         session = self._session()
         try:
-            query = session.execute(
+            query = await session.execute(
                 select(
                     models.ACL
                 )
@@ -111,23 +233,20 @@ class DataBase(object):
                 )
             )
             result = query.scalar_one_or_none()
-            session.close()
+            await self._acl.Fill( user_id, result, version )
             if not result:
                 return None
             return result
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.GetACL( user_id=user_id )
         except Exception as e:
             raise e
         finally:
-            session.close()
+            await asyncio.shield( session.close() )
 
 
     #
 
 
+    @retried( idempotent=False )
     async def SaveUser(
         self,
         user: models.User
@@ -135,27 +254,28 @@ class DataBase(object):
         session = self._session()
         try:
             session.add( user )
-            session.commit()
-            session.flush()
-            session.close()
+            await session.commit()
+            await self._users.Set( user.id, user )
             return user
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.SaveUser( user=user )
         except Exception as e:
             raise e
         finally:
-            session.close()
+            await asyncio.shield( session.close() )
 
 
+    @retried
     async def GetUser(
         self,
         user_id: int
     ) -> models.User|None:
+        found, user = await self._users.Get( user_id )
+        if found:
+            return user
+
+        version = self._users.Version()
         session = self._session()
         try:
-            query = session.execute(
+            query = await session.execute(
                 select(
                     models.User
                 )
@@ -164,111 +284,51 @@ class DataBase(object):
                 )
             )
             result = query.scalar_one_or_none()
-            session.close()
+            await self._users.Fill( user_id, result, version )
             if not result:
                 return None
             return result
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.GetUser( user_id=user_id )
         except Exception as e:
             raise e
         finally:
-            session.close()
+            await asyncio.shield( session.close() )
 
 
     async def GetUserSetuped(
         self,
         user_id: int
     ) -> int:
-        session = self._session()
-        try:
-            query = session.execute(
-                select(
-                    models.User.setuped
-                )
-                .where(
-                    models.User.id == user_id
-                )
-            )
-            result = query.scalar_one_or_none()
-            session.close()
-            return result == 1
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.GetUserSetuped( user_id=user_id )
-        except Exception as e:
-            raise e
-        finally:
-            session.close()
+        user = await self.GetUser( user_id=user_id )
+        return user is not None and user.setuped == 1
 
 
     async def GetUserInteractMode(
         self,
         user_id: int
     ) -> int:
-        session = self._session()
-        try:
-            query = session.execute(
-                select(
-                    models.User.interact_mode
-                )
-                .where(
-                    models.User.id == user_id
-                )
-            )
-            result = query.scalar_one_or_none()
-            session.close()
-            return result == 1
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.GetUserInteractMode( user_id=user_id )
-        except Exception as e:
-            raise e
-        finally:
-            session.close()
+        user = await self.GetUser( user_id=user_id )
+        return user is not None and user.interact_mode == 1
 
 
     async def GetUserHashtags(
         self,
         user_id: int
     ) -> str:
-        session = self._session()
-        try:
-            query = session.execute(
-                select(
-                    models.User.hashtags
-                )
-                .where(
-                    models.User.id == user_id
-                )
-            )
-            result = query.scalar_one_or_none()
-            session.close()
-            return result
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.GetUserInteractMode( user_id=user_id )
-        except Exception as e:
-            raise e
-        finally:
-            session.close()
+        user = await self.GetUser( user_id=user_id )
+        return user.hashtags if user else None
 
 
     #
 
 
+    @retried
     async def GetUserAuthedSites(
         self,
         user_id: int
     ) -> List[ models.UserAuth ]:
         session = self._session()
         try:
-            query = session.execute(
+            query = await session.execute(
                 select(
                     models.UserAuth.site
                 )
@@ -278,18 +338,14 @@ class DataBase(object):
                 )
             )
             result = query.scalars().all()
-            session.close()
             return result
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.GetUserAuthedSites( user_id=user_id )
         except Exception as e:
             raise e
         finally:
-            session.close()
+            await asyncio.shield( session.close() )
 
 
+    @retried
     async def GetUserAuthsForSite(
         self,
         user_id: int,
@@ -297,7 +353,7 @@ class DataBase(object):
     ) -> List[ models.UserAuth ]:
         session = self._session()
         try:
-            query = session.execute(
+            query = await session.execute(
                 select(
                     models.UserAuth
                 )
@@ -307,18 +363,14 @@ class DataBase(object):
                 )
             )
             result = query.scalars().all()
-            session.close()
             return result
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.GetUserAuthsForSite( user_id=user_id, site=site )
         except Exception as e:
             raise e
         finally:
-            session.close()
+            await asyncio.shield( session.close() )
 
 
+    @retried( idempotent=False )
     async def SaveUserAuth(
         self,
         user_id: int,
@@ -334,20 +386,15 @@ class DataBase(object):
             auth.login = login
             auth.password = password
             session.add( auth )
-            session.commit()
-            session.flush()
-            session.close()
+            await session.commit()
             return auth
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.SaveUserAuth( user_id=user_id, site=site, login=login, password=password )
         except Exception as e:
             raise e
         finally:
-            session.close()
+            await asyncio.shield( session.close() )
 
 
+    @retried
     async def GetUserAuth(
         self,
         user_id: int,
@@ -355,7 +402,7 @@ class DataBase(object):
     ) -> models.UserAuth:
         session = self._session()
         try:
-            query = session.execute(
+            query = await session.execute(
                 select(
                     models.UserAuth
                 )
@@ -365,18 +412,14 @@ class DataBase(object):
                 )
             )
             result = query.scalar_one_or_none()
-            session.close()
             return result
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.GetUserAuth( user_id=user_id, auth_id=auth_id )
         except Exception as e:
             raise e
         finally:
-            session.close()
+            await asyncio.shield( session.close() )
 
 
+    @retried
     async def DeleteUserAuth(
         self,
         user_id: int,
@@ -384,7 +427,7 @@ class DataBase(object):
     ) -> None:
         session = self._session()
         try:
-            session.execute(
+            await session.execute(
                 delete(
                     models.UserAuth
                 )
@@ -393,17 +436,11 @@ class DataBase(object):
                     models.UserAuth.id == auth_id
                 )
             )
-            session.commit()
-            session.flush()
-            session.close()
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.DeleteUserAuth( user_id=user_id, auth_id=auth_id )
+            await session.commit()
         except Exception as e:
             raise e
         finally:
-            session.close()
+            await asyncio.shield( session.close() )
 
 
     #
@@ -412,10 +449,26 @@ class DataBase(object):
     async def GetUserUsage(
         self,
         user_id: int
+    ) -> int:
+        if self._usage:
+            usage = await self._usage.Get( user_id )
+            if usage is not None:
+                return usage
+            usage = await self.getUserUsageFromDB( user_id=user_id )
+            usage += self._stats.Pending( user_id, UsageCounter.today() )
+            await self._usage.Seed( user_id, usage )
+            return usage
+        return await self.getUserUsageFromDB( user_id=user_id ) + self._stats.Pending( user_id, datetime.today().date() )
+
+
+    @retried
+    async def getUserUsageFromDB(
+        self,
+        user_id: int
     ) -> int:
         session = self._session()
         try:
-            query = session.execute(
+            query = await session.execute(
                 select(
                     func.sum( models.UserStat.success ),
                     func.sum( models.UserStat.failure )
@@ -427,7 +480,6 @@ class DataBase(object):
             )
             result = query.fetchone()
             result = list( result )
-            session.close()
             if not result:
                 return 0
             if result[0] == None:
@@ -436,14 +488,48 @@ class DataBase(object):
                 result[1] = 0
             result = result[0] + result[1]
             return result
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.GetUserUsage( user_id=user_id )
         except Exception as e:
             raise e
         finally:
-            session.close()
+            await asyncio.shield( session.close() )
+
+
+    @retried
+    async def GetUsersUsage(
+        self,
+        day: datetime
+    ) -> Dict[ int, int ]:
+        session = self._session()
+        try:
+            query = await session.execute(
+                select(
+                    models.UserStat.user_id,
+                    func.sum( models.UserStat.success ) + func.sum( models.UserStat.failure )
+                )
+                .where(
+                    models.UserStat.day == day
+                )
+                .group_by(
+                    models.UserStat.user_id
+                )
+            )
+            return { user_id: int( total or 0 ) for user_id, total in query.all() }
+        except Exception as e:
+            raise e
+        finally:
+            await asyncio.shield( session.close() )
+
+
+    async def reconcileUsage(self) -> None:
+        while True:
+            await asyncio.sleep( self.usage_reconcile_interval )
+            try:
+                totals = await self.GetUsersUsage( day=UsageCounter.today() )
+                await self._usage.Reconcile( totals )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
 
     #
 
@@ -458,44 +544,46 @@ class DataBase(object):
         success = 1 if result.status == variables.DownloaderStep.DONE else 0
         failure = 1 if result.status == variables.DownloaderStep.ERROR else 0
 
+        self._stats.Add(
+            user_id =   result.user_id,
+            site =      result.site,
+            day =       datetime.today().date(),
+            success =   success,
+            failure =   failure,
+            orig_size = result.orig_size,
+            oper_size = result.oper_size,
+        )
+        if self._usage:
+            await self._usage.Incr( result.user_id, success + failure )
+
+
+    @retried( idempotent=False )
+    async def writeUserStats(
+        self,
+        rows: List[ Dict[ str, Any ] ]
+    ) -> None:
         session = self._session()
         try:
-            ss = {
-                'user_id':   result.user_id,
-                'site':      result.site,
-                'day':       datetime.today(),
-                'success':   success,
-                'failure':   failure,
-                'orig_size': result.orig_size,
-                'oper_size': result.oper_size,
-            }
-            session.execute(
-                insert(
-                    models.UserStat
-                )
-                .values( **ss )
-                .on_duplicate_key_update(
-                    success   = models.UserStat.success + success,
-                    failure   = models.UserStat.failure + failure,
-                    orig_size = models.UserStat.orig_size + result.orig_size,
-                    oper_size = models.UserStat.oper_size + result.oper_size,
+            stmt = insert( models.UserStat ).values( rows )
+            await session.execute(
+                stmt.on_duplicate_key_update(
+                    success   = models.UserStat.success + stmt.inserted.success,
+                    failure   = models.UserStat.failure + stmt.inserted.failure,
+                    orig_size = models.UserStat.orig_size + stmt.inserted.orig_size,
+                    oper_size = models.UserStat.oper_size + stmt.inserted.oper_size,
                 )
             )
-            session.commit()
-            session.close()
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.UpdateUserStat( result=result )
+            await session.commit()
         except Exception as e:
             raise e
         finally:
-            session.close()
+            await asyncio.shield( session.close() )
 
 
     #
 
 
+    @retried( idempotent=False )
     async def SaveInlineDownloadRequest(
         self,
         request: models.InlineDownloadRequest
@@ -503,20 +591,15 @@ class DataBase(object):
         session = self._session()
         try:
             session.add(request)
-            session.commit()
-            session.flush()
-            session.close()
+            await session.commit()
             return request
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.SaveInlineDownloadRequest( request=request )
         except Exception as e:
             raise e
         finally:
-            session.close()
+            await asyncio.shield( session.close() )
 
 
+    @retried
     async def GetInlineDownloadRequest(
         self,
         user_id: int,
@@ -525,7 +608,7 @@ class DataBase(object):
     ) -> models.InlineDownloadRequest | None:
         session = self._session()
         try:
-            query = session.execute(
+            query = await session.execute(
                 select(
                     models.InlineDownloadRequest
                     )
@@ -536,21 +619,17 @@ class DataBase(object):
                 )
             )
             result = query.scalar_one_or_none()
-            session.close()
             if not result:
                 return None
             return result
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.GetInlineDownloadRequest( user_id=user_id, chat_id=chat_id, message_id=message_id )
         except Exception as e:
             raise e
         finally:
-            session.close()
+            await asyncio.shield( session.close() )
 
     #
 
+    @retried
     async def DeleteInlineDownloadRequest(
         self,
         user_id: int,
@@ -559,7 +638,7 @@ class DataBase(object):
     ) -> None:
         session = self._session()
         try:
-            session.execute(
+            await session.execute(
                 delete(
                     models.InlineDownloadRequest
                 )
@@ -569,27 +648,22 @@ class DataBase(object):
                     models.InlineDownloadRequest.message_id == message_id
                 )
             )
-            session.commit()
-            session.flush()
-            session.close()
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.DeleteInlineDownloadRequest( user_id=user_id, chat_id=chat_id, message_id=message_id )
+            await session.commit()
         except Exception as e:
             raise e
         finally:
-            session.close()
+            await asyncio.shield( session.close() )
 
     #
 
+    @retried
     async def GetAbandonedInlineDownloadRequests(
         self
     ) -> List[ models.InlineDownloadRequest ]:
         session = self._session()
         abandoned_time = datetime.now() - timedelta( days=1 )
         try:
-            query = session.execute(
+            query = await session.execute(
                 select(
                     models.InlineDownloadRequest
                 )
@@ -598,21 +672,17 @@ class DataBase(object):
                 )
             )
             result = query.scalars().all()
-            session.close()
             if not result:
                 return None
             return result
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.GetAbandonedInlineDownloadRequests()
         except Exception as e:
             raise e
         finally:
-            session.close()
+            await asyncio.shield( session.close() )
     
     ###
 
+    @retried( idempotent=False )
     async def SaveSiteConfig(
         self,
         config: models.SiteConfig
@@ -620,19 +690,15 @@ class DataBase(object):
         session = self._session()
         try:
             session.add( config )
-            session.commit()
-            session.flush()
-            session.close()
+            await session.commit()
+            await self._sites_config.Set( ( config.user_id, config.site ), config )
             return config
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.SaveSiteConfig( config=config )
         except Exception as e:
             raise e
         finally:
-            session.close()
+            await asyncio.shield( session.close() )
 
+    @retried
     async def DeleteSiteConfig(
         self,
         user_id: int,
@@ -640,7 +706,7 @@ class DataBase(object):
     ) -> None:
         session = self._session()
         try:
-            session.execute(
+            await session.execute(
                 delete(
                     models.SiteConfig
                 )
@@ -649,26 +715,27 @@ class DataBase(object):
                     models.SiteConfig.site == site
                 )
             )
-            session.commit()
-            session.flush()
-            session.close()
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.DeleteSiteConfig( user_id=user_id, site=site )
+            await session.commit()
+            await self._sites_config.Delete( ( user_id, site ) )
         except Exception as e:
             raise e
         finally:
-            session.close()
+            await asyncio.shield( session.close() )
 
+    @retried
     async def GetSiteConfig(
         self,
         user_id: int,
         site: str
     ) -> models.SiteConfig:
+        found, config = await self._sites_config.Get( ( user_id, site ) )
+        if found:
+            return config
+
+        version = self._sites_config.Version()
         session = self._session()
         try:
-            query = session.execute(
+            query = await session.execute(
                 select(
                     models.SiteConfig
                 )
@@ -678,13 +745,9 @@ class DataBase(object):
                 )
             )
             result = query.scalar_one_or_none()
-            session.close()
+            await self._sites_config.Fill( ( user_id, site ), result, version )
             return result
-        except OperationalError as e:
-            await asyncio.sleep(1)
-            traceback.print_exc()
-            return await self.GetSiteConfig( user_id=user_id, site=site )
         except Exception as e:
             raise e
         finally:
-            session.close()
\ No newline at end of file
+            await asyncio.shield( session.close() )
\ No newline at end of file
@@ -0,0 +1,89 @@
+from __future__ import annotations
+import time
+import asyncio
+import logging
+import traceback
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Tuple
+from cachetools import TTLCache
+from app import dto
+from app import metrics
+from app import variables
+
+logger = logging.getLogger(__name__)
+
+StatusKey = Tuple[ int, int ]
+
+TERMINAL_STEPS = { variables.DownloaderStep.DONE, variables.DownloaderStep.ERROR, variables.DownloaderStep.CANCELLED }
+
+
+@dataclass
+class StatusSlot:
+    pending: dto.DownloadStatus | None = None
+    sent_at: float = 0
+    timer:   asyncio.Task | None = None
+    lock:    asyncio.Lock = field( default_factory=asyncio.Lock )
+
+
+class StatusDebouncer:
+    # keeps one progress message per (chat_id, message_id) edited at most once per interval
+    # intermediate statuses replace each other while waiting, terminal ones go out at once
+    # and anything arriving for the message after its terminal status is dropped
+    interval: float
+
+    def __init__(
+        self,
+        deliver: Callable[ [ dto.DownloadStatus ], Awaitable[ bool ] ],
+        interval: float = 2
+    ) -> None:
+        self.deliver = deliver
+        self.interval = interval
+        self._slots: TTLCache[ StatusKey, StatusSlot ] = TTLCache( maxsize=10000, ttl=3600 )
+        self._finished: TTLCache[ StatusKey, bool ] = TTLCache( maxsize=10000, ttl=600 )
+
+
+    async def Push( self, status: dto.DownloadStatus ) -> bool:
+        key = ( status.chat_id, status.message_id )
+        if key in self._finished:
+            metrics.STATUS_DROPPED.inc()
+            return True
+
+        slot = self._slots.get( key )
+        if slot is None:
+            slot = StatusSlot()
+            self._slots[ key ] = slot
+
+        if status.status in TERMINAL_STEPS:
+            # a waiting flush wakes up to nothing, one already sending is waited for
+            slot.pending = None
+            self._finished[ key ] = True
+            self._slots.pop( key, None )
+            async with slot.lock:
+                return await self.deliver( status )
+
+        if slot.timer is None and not slot.lock.locked() and time.monotonic() - slot.sent_at >= self.interval:
+            async with slot.lock:
+                slot.sent_at = time.monotonic()
+                return await self.deliver( status )
+
+        if slot.pending is not None:
+            metrics.STATUS_COALESCED.inc()
+        slot.pending = status
+        if slot.timer is None:
+            slot.timer = asyncio.create_task( self.flush( slot ) )
+        return True
+
+    #
+
+    async def flush( self, slot: StatusSlot ) -> None:
+        await asyncio.sleep( max( slot.sent_at + self.interval - time.monotonic(), 0 ) )
+        async with slot.lock:
+            slot.timer = None
+            status, slot.pending = slot.pending, None
+            if status is None:
+                return
+            slot.sent_at = time.monotonic()
+            try:
+                await self.deliver( status )
+            except Exception:
+                traceback.print_exc()
@@ -0,0 +1,165 @@
+from __future__ import annotations
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List
+from cachetools import LRUCache
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import TelegramMethod
+from aiogram.types import FSInputFile
+from app import metrics
+from app.classes.file_ids import FileIdCache
+
+logger = logging.getLogger(__name__)
+
+MEDIA_GROUP_LIMIT = 10
+
+class Delivery(BaseRequestMiddleware):
+    # request middleware on the bot session for the uploads of finished downloads,
+    # DownloadsController sends the files itself, so they are handled where every upload passes
+    # - files go out as FSInputFile, streamed from disk in chunks and never read into memory whole
+    # - uploads run concurrently up to uploads in total and chat_uploads per chat
+    # - a media group over telegram's ten media goes out as consecutive groups, in order
+    # - files uploaded before are resent by their telegram file_id, a rejected id is forgotten
+    #   and the file uploaded again
+    # - every upload is measured: in flight, files, bytes, duration and throughput
+    uploads:      int = 8
+    chat_uploads: int = 2
+
+    UPLOADS = ( 'SendDocument', 'SendMediaGroup' )
+
+    def __init__( self, file_ids: FileIdCache | None = None, uploads: int = 8, chat_uploads: int = 2 ) -> None:
+        self.file_ids = file_ids
+        self.uploads = uploads
+        self.chat_uploads = chat_uploads
+        self._uploads: asyncio.Semaphore = asyncio.Semaphore( uploads )
+        self._chats: LRUCache[ Any, asyncio.Semaphore ] = LRUCache( maxsize=10000 )
+
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod
+    ) -> Any:
+        if type( method ).__name__ not in self.UPLOADS or not self.files( method ):
+            return await make_request( bot, method )
+        if type( method ).__name__ == 'SendMediaGroup' and len( method.media ) > MEDIA_GROUP_LIMIT:
+            messages = []
+            for i in range( 0, len( method.media ), MEDIA_GROUP_LIMIT ):
+                group = method.model_copy( update={ 'media': method.media[ i:i+MEDIA_GROUP_LIMIT ] } )
+                messages += await self( make_request, bot, group )
+            return messages
+        if not self.file_ids:
+            return await self.upload( make_request, bot, method )
+
+        keys = [ await self.key( holder ) for holder in self.documents( method ) ]
+        cached = await self.file_ids.Get( keys )
+        try:
+            result = await self.upload( make_request, bot, self.reuse( method, keys, cached ) )
+        except TelegramBadRequest:
+            if not cached:
+                raise
+            await self.file_ids.Forget( list( cached ) )
+            cached = {}
+            result = await self.upload( make_request, bot, method )
+
+        messages = result if isinstance( result, list ) else [ result ]
+        for key, message in zip( keys, messages ):
+            document = getattr( message, 'document', None )
+            if key is not None and key not in cached and document:
+                await self.file_ids.Set( key, document.file_id )
+        return result
+
+    #
+
+    async def upload(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod
+    ) -> Any:
+        files = self.files( method )
+        if not files:
+            return await make_request( bot, method )
+
+        size = sum( [ os.path.getsize( file ) for file in files if os.path.isfile( file ) ] )
+        chat_id = getattr( method, 'chat_id', None )
+        async with self.chatSlot( chat_id ), self._uploads:
+            started = time.monotonic()
+            metrics.DELIVERY_IN_FLIGHT.inc()
+            try:
+                result = await make_request( bot, method )
+            finally:
+                metrics.DELIVERY_IN_FLIGHT.dec()
+
+        elapsed = time.monotonic() - started
+        metrics.DELIVERY_FILES.inc( len( files ) )
+        metrics.DELIVERY_BYTES.inc( size )
+        metrics.DELIVERY_SECONDS.observe( elapsed )
+        if size and elapsed > 0:
+            metrics.DELIVERY_THROUGHPUT.observe( size / elapsed )
+        logger.info(f'Delivery: {len( files )} files, {size} bytes uploaded to {chat_id} in {elapsed:.2f}s')
+        return result
+
+
+    def chatSlot( self, chat_id: Any ) -> asyncio.Semaphore:
+        slot = self._chats.get( chat_id )
+        if slot is None:
+            slot = asyncio.Semaphore( self.chat_uploads )
+            self._chats[ chat_id ] = slot
+        return slot
+
+
+    async def key( self, holder: Any ) -> str | None:
+        # only documents are cached, a photo or video of a media group is uploaded as is
+        document = self.document( holder ) if type( holder ).__name__ in [ 'SendDocument', 'InputMediaDocument' ] else None
+        if not isinstance( document, FSInputFile ) or not os.path.isfile( document.path ):
+            return None
+        thumbnail = getattr( holder, 'thumbnail', None )
+        thumb = str( thumbnail.path ) if isinstance( thumbnail, FSInputFile ) and os.path.isfile( thumbnail.path ) else None
+        return await self.file_ids.Key( str( document.path ), thumb )
+
+
+    def reuse( self, method: TelegramMethod, keys: List[ str | None ], cached: Dict[ str, str ] ) -> TelegramMethod:
+        # a copy of the method with the cached documents replaced by their file_id,
+        # telegram keeps the thumbnail of the first upload
+        if not cached:
+            return method
+        holders = []
+        for holder, key in zip( self.documents( method ), keys ):
+            if key in cached:
+                field = 'document' if type( holder ).__name__ == 'SendDocument' else 'media'
+                holder = holder.model_copy( update={ field: cached[ key ], 'thumbnail': None } )
+            holders.append( holder )
+        if type( method ).__name__ == 'SendMediaGroup':
+            return method.model_copy( update={ 'media': holders } )
+        return holders[0]
+
+
+    @staticmethod
+    def documents( method: TelegramMethod ) -> List[ Any ]:
+        # the objects carrying the files of an upload, the method itself or each of its media,
+        # in the order of the messages telegram answers with
+        if type( method ).__name__ == 'SendMediaGroup':
+            return list( method.media )
+        return [ method ]
+
+
+    @staticmethod
+    def files( method: TelegramMethod ) -> List[ str ]:
+        # local files uploaded by the method, ids and urls are not uploads
+        paths = []
+        for holder in Delivery.documents( method ):
+            document = Delivery.document( holder )
+            if isinstance( document, FSInputFile ):
+                paths.append( str( document.path ) )
+        return paths
+
+
+    @staticmethod
+    def document( holder: Any ) -> Any:
+        return getattr( holder, 'document', None ) or getattr( holder, 'media', None )
@@ -0,0 +1,153 @@
+from __future__ import annotations
+import ujson
+import logging
+from datetime import date, datetime
+from typing import Any, Dict, Tuple, Type
+from cachetools import TTLCache
+from redis.asyncio import Redis
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from app import metrics
+from app import models
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class EntityCache:
+    # read-through cache of single ORM rows by primary/natural key
+    # short-lived in-process tier for bursts of one user, redis tier shared by all replicas
+    # rows are stored as column snapshots and handed out as fresh detached instances,
+    # so callers may mutate and save them without touching the cache
+    name: str
+    ttl:  int
+
+    def __init__(
+        self,
+        name: str,
+        model: Type[ models.Base ],
+        redis: Redis | None = None,
+        ttl: int = 300,
+        local_ttl: int = 5,
+        maxsize: int = 10000
+    ) -> None:
+        self.name = name
+        self.model = model
+        self.redis = redis
+        self.ttl = ttl
+        self._local: TTLCache = TTLCache( maxsize=maxsize, ttl=local_ttl )
+        self._version: int = 0
+        self._dates: Dict[ str, type ] = {}
+        for attr in inspect( model ).column_attrs:
+            try:
+                python_type = attr.columns[0].type.python_type
+            except NotImplementedError:
+                continue
+            if python_type in ( datetime, date ):
+                self._dates[ attr.key ] = python_type
+
+
+    def Version( self ) -> int:
+        return self._version
+
+
+    async def Get( self, key: Any ) -> Tuple[ bool, models.Base | None ]:
+        columns = self._local.get( key, _MISSING )
+        if columns is not _MISSING:
+            metrics.DB_CACHE_HITS.labels( self.name, 'local' ).inc()
+            return True, self.restore( columns )
+
+        if self.redis is not None:
+            try:
+                cached = await self.redis.get( self.redisKey( key ) )
+            except Exception as e:
+                logger.warning( f'EntityCache[{self.name}]: redis get failed: {e!r}' )
+                cached = None
+            if cached is not None:
+                columns = self.loads( cached )
+                self._local[ key ] = columns
+                metrics.DB_CACHE_HITS.labels( self.name, 'redis' ).inc()
+                return True, self.restore( columns )
+
+        metrics.DB_CACHE_MISSES.labels( self.name ).inc()
+        return False, None
+
+
+    async def Fill( self, key: Any, entity: models.Base | None, version: int ) -> None:
+        # store a row read from the database, unless a write happened while it was being read
+        if version != self._version:
+            return
+        await self.store( key, entity )
+
+
+    async def Set( self, key: Any, entity: models.Base | None ) -> None:
+        self._version += 1
+        await self.store( key, entity )
+
+
+    async def Delete( self, key: Any ) -> None:
+        self._version += 1
+        self._local.pop( key, None )
+        if self.redis is not None:
+            try:
+                await self.redis.delete( self.redisKey( key ) )
+            except Exception as e:
+                logger.warning( f'EntityCache[{self.name}]: redis delete failed: {e!r}' )
+
+
+    async def Clear( self ) -> None:
+        self._version += 1
+        self._local.clear()
+        if self.redis is not None:
+            try:
+                async for redis_key in self.redis.scan_iter( match=f'cache_{self.name}_*' ):
+                    await self.redis.delete( redis_key )
+            except Exception as e:
+                logger.warning( f'EntityCache[{self.name}]: redis clear failed: {e!r}' )
+
+    #
+
+    async def store( self, key: Any, entity: models.Base | None ) -> None:
+        columns = self.snapshot( entity )
+        self._local[ key ] = columns
+        if self.redis is not None:
+            try:
+                await self.redis.setex( self.redisKey( key ), self.ttl, self.dumps( columns ) )
+            except Exception as e:
+                logger.warning( f'EntityCache[{self.name}]: redis set failed: {e!r}' )
+
+
+    def redisKey( self, key: Any ) -> str:
+        if isinstance( key, tuple ):
+            key = '_'.join( [ str( x ) for x in key ] )
+        return f'cache_{self.name}_{key}'
+
+
+    def snapshot( self, entity: models.Base | None ) -> Dict[ str, Any ] | None:
+        if entity is None:
+            return None
+        return { attr.key: getattr( entity, attr.key ) for attr in inspect( self.model ).column_attrs }
+
+
+    def restore( self, columns: Dict[ str, Any ] | None ) -> models.Base | None:
+        if columns is None:
+            return None
+        entity = self.model( **columns )
+        make_transient_to_detached( entity )
+        return entity
+
+
+    def dumps( self, columns: Dict[ str, Any ] | None ) -> str:
+        if columns is None:
+            return 'null'
+        return ujson.dumps( { k: ( v.isoformat() if isinstance( v, ( datetime, date ) ) else v ) for k, v in columns.items() } )
+
+
+    def loads( self, cached: str ) -> Dict[ str, Any ] | None:
+        columns = ujson.loads( cached )
+        if columns is None:
+            return None
+        for k, python_type in self._dates.items():
+            if columns.get( k ):
+                columns[ k ] = python_type.fromisoformat( columns[ k ] )
+        return columns
@@ -0,0 +1,93 @@
+from __future__ import annotations
+import os
+import asyncio
+import hashlib
+import logging
+from typing import Dict, List
+from cachetools import TTLCache
+from redis.asyncio import Redis
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+class FileIdCache:
+    # telegram file_id of an already uploaded file, keyed by the sha256 of its content,
+    # the name it is shown under and its thumbnail, so a differently named or differently
+    # built file never reuses another upload
+    # - files under min_size are cheap to upload and not cached
+    # - the local tier is bounded by the bytes its entries take, redis keeps ids for ttl
+    ttl:      int = 86400 * 30
+    min_size: int = 256 * 1024
+
+    def __init__(
+        self,
+        redis: Redis,
+        ttl: int = 86400 * 30,
+        min_size: int = 256 * 1024,
+        local_bytes: int = 4 * 1024 * 1024
+    ) -> None:
+        self.redis = redis
+        self.ttl = ttl
+        self.min_size = min_size
+        self._local: TTLCache[ str, str ] = TTLCache( maxsize=local_bytes, ttl=3600, getsizeof=len )
+
+
+    async def Key( self, path: str, thumb: str | None = None ) -> str | None:
+        if os.path.getsize( path ) < self.min_size:
+            return None
+        digest = await asyncio.to_thread( self.digest, path )
+        if thumb:
+            digest += '_' + await asyncio.to_thread( self.digest, thumb )
+        name = hashlib.sha256( os.path.basename( path ).encode( 'utf-8' ) ).hexdigest()[:16]
+        return f'file_id_{digest}_{name}'
+
+
+    async def Get( self, keys: List[ str | None ] ) -> Dict[ str, str ]:
+        found: Dict[ str, str ] = {}
+        missing = []
+        for key in keys:
+            if key is None:
+                continue
+            file_id = self._local.get( key )
+            if file_id is not None:
+                found[ key ] = file_id
+            else:
+                missing.append( key )
+
+        if missing:
+            try:
+                for key, file_id in zip( missing, await self.redis.mget( missing ) ):
+                    if file_id is not None:
+                        found[ key ] = file_id
+                        self._local[ key ] = file_id
+            except Exception as e:
+                logger.warning( f'FileIdCache: redis get failed: {e!r}' )
+
+        metrics.FILE_ID_LOOKUPS.labels( 'hit' ).inc( len( found ) )
+        metrics.FILE_ID_LOOKUPS.labels( 'miss' ).inc( len( [ key for key in keys if key is not None ] ) - len( found ) )
+        return found
+
+
+    async def Set( self, key: str, file_id: str ) -> None:
+        self._local[ key ] = file_id
+        try:
+            await self.redis.setex( key, self.ttl, file_id )
+        except Exception as e:
+            logger.warning( f'FileIdCache: redis set failed: {e!r}' )
+
+
+    async def Forget( self, keys: List[ str ] ) -> None:
+        for key in keys:
+            self._local.pop( key, None )
+        try:
+            if keys:
+                await self.redis.delete( *keys )
+        except Exception as e:
+            logger.warning( f'FileIdCache: redis delete failed: {e!r}' )
+
+    #
+
+    @staticmethod
+    def digest( path: str ) -> str:
+        with open( path, 'rb' ) as f:
+            return hashlib.file_digest( f, 'sha256' ).hexdigest()
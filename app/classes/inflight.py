@@ -0,0 +1,241 @@
+from __future__ import annotations
+import time
+import ujson
+import asyncio
+import hashlib
+import logging
+import urllib.parse
+from typing import Any, Awaitable, Callable, Dict, List
+from redis.asyncio import Redis
+from app import dto
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+Target = Dict[ str, Any ]
+
+CLAIMED = '0'
+
+
+class InFlightDownloads:
+    # identical download requests attach to the queue task already running for them
+    # - the request key covers the normalized url, site, range, format and output options,
+    #   requests made with a personal auth or proxy are never shared
+    # - the first requester owns the task, later ones are subscribers that get their own copy
+    #   of every status and of the result
+    # - a subscriber (or the owner) cancelling is only detached while anyone else still waits,
+    #   a cancel that doesn't name its message never stops a task others wait for
+    ttl:  int = 6 * 3600
+    wait: float = 30
+
+    def __init__( self, redis: Redis, ttl: int = 6 * 3600, wait: float = 30 ) -> None:
+        self.redis = redis
+        self.ttl = ttl
+        self.wait = wait
+
+
+    async def Init(
+        self,
+        request: dto.DownloadRequest,
+        init: Callable[ [ dto.DownloadRequest ], Awaitable[ int | str ] ]
+    ) -> int | str:
+        key = self.Key( request )
+        if key is None:
+            return await init( request )
+
+        deadline = time.monotonic() + self.wait
+        while True:
+            try:
+                claimed = await self.redis.set( key, CLAIMED, ex=int( self.wait ) + 30, nx=True )
+                owner = None if claimed else await self.redis.get( key )
+            except Exception as e:
+                logger.warning( f'InFlightDownloads: redis failed: {e!r}' )
+                return await init( request )
+
+            if claimed:
+                return await self.start( key, request, init )
+
+            if owner and owner != CLAIMED:
+                if await self.subscribe( int( owner ), self.target( request ) ):
+                    metrics.DOWNLOADS_DEDUPLICATED.inc()
+                    logger.info( f'InFlightDownloads: {request.chat_id}:{request.message_id} attached to task {owner}' )
+                    return int( owner )
+                continue
+
+            # the first requester is still waiting for its task_id, don't hold this one forever
+            if time.monotonic() > deadline:
+                return await init( request )
+            await asyncio.sleep( 0.5 )
+
+
+    async def Statuses( self, status: dto.DownloadStatus ) -> List[ dto.DownloadStatus ]:
+        targets = await self.targets( status.task_id, self.target( status ), finish=False )
+        return [ status.model_copy( update=target ) for target in targets ]
+
+
+    async def Results( self, result: dto.DownloadResult ) -> List[ dto.DownloadResult ]:
+        targets = await self.targets( result.task_id, self.target( result ), finish=True )
+        return [ result.model_copy( update=target ) for target in targets ]
+
+
+    async def Recipients( self, task_id: int ) -> int:
+        # how many messages still wait for the task, 0 when it is not shared or unknown
+        try:
+            task = await self.redis.get( f'inflight_task_{task_id}' )
+            if not task:
+                return 0
+            async with self.redis.pipeline( transaction=True ) as pipe:
+                pipe.llen( f'inflight_subscribers_{task_id}' )
+                pipe.scard( f'inflight_detached_{task_id}' )
+                subscribers, detached = await pipe.execute()
+        except Exception as e:
+            logger.warning( f'InFlightDownloads: redis failed: {e!r}' )
+            return 0
+        return 1 + subscribers - detached
+
+
+    async def Forget( self, task_id: int ) -> None:
+        # the task was cancelled in the queue, identical requests start a new one
+        try:
+            task = await self.redis.get( f'inflight_task_{task_id}' )
+            if task:
+                await self.redis.delete(
+                    ujson.loads( task )['key'],
+                    f'inflight_task_{task_id}',
+                    f'inflight_subscribers_{task_id}',
+                    f'inflight_detached_{task_id}'
+                )
+        except Exception as e:
+            logger.warning( f'InFlightDownloads: redis failed: {e!r}' )
+
+
+    async def Detach( self, task_id: int, chat_id: int, message_id: int ) -> dto.DownloadCancelResponse | None:
+        # returns who was detached when somebody else still waits for the task,
+        # None when the task has to be cancelled in the queue
+        try:
+            task = await self.redis.get( f'inflight_task_{task_id}' )
+            if not task:
+                return None
+            task = ujson.loads( task )
+            subscribers = [ ujson.loads( x ) for x in await self.redis.lrange( f'inflight_subscribers_{task_id}', 0, -1 ) ]
+            detached = await self.redis.smembers( f'inflight_detached_{task_id}' )
+        except Exception as e:
+            logger.warning( f'InFlightDownloads: redis failed: {e!r}' )
+            return None
+
+        recipients = [ x for x in [ task['owner'] ] + subscribers if self.targetId( x ) not in detached ]
+        leaving = [ x for x in recipients if x['chat_id'] == chat_id and x['message_id'] == message_id ]
+        if not leaving or len( recipients ) == 1:
+            return None
+
+        async with self.redis.pipeline( transaction=True ) as pipe:
+            pipe.sadd( f'inflight_detached_{task_id}', self.targetId( leaving[0] ) )
+            pipe.expire( f'inflight_detached_{task_id}', self.ttl )
+            await pipe.execute()
+        return dto.DownloadCancelResponse.model_validate( leaving[0] )
+
+    #
+
+    async def start(
+        self,
+        key: str,
+        request: dto.DownloadRequest,
+        init: Callable[ [ dto.DownloadRequest ], Awaitable[ int | str ] ]
+    ) -> int | str:
+        try:
+            task_id = await init( request )
+        except BaseException:
+            await self.redis.delete( key )
+            raise
+
+        try:
+            if isinstance( task_id, int ):
+                task = ujson.dumps( { 'key': key, 'owner': self.target( request ) } )
+                async with self.redis.pipeline( transaction=True ) as pipe:
+                    pipe.setex( f'inflight_task_{task_id}', self.ttl, task )
+                    pipe.setex( key, self.ttl, task_id )
+                    await pipe.execute()
+            else:
+                await self.redis.delete( key )
+        except Exception as e:
+            logger.warning( f'InFlightDownloads: redis failed: {e!r}' )
+        return task_id
+
+
+    async def subscribe( self, task_id: int, target: Target ) -> bool:
+        entry = ujson.dumps( target )
+        key = f'inflight_subscribers_{task_id}'
+        await self.redis.rpush( key, entry )
+        await self.redis.expire( key, self.ttl )
+        if await self.redis.exists( f'inflight_task_{task_id}' ):
+            return True
+        # the task finished meanwhile: if the subscription was not picked up, start anew
+        return not await self.redis.lrem( key, 1, entry )
+
+
+    async def targets( self, task_id: int, owner: Target, finish: bool ) -> List[ Target ]:
+        subscribers = []
+        detached = set()
+        try:
+            task = await self.redis.get( f'inflight_task_{task_id}' )
+            if task:
+                if finish:
+                    # no one attaches from now on, then everyone attached so far is taken
+                    key = ujson.loads( task )['key']
+                    async with self.redis.pipeline( transaction=True ) as pipe:
+                        pipe.delete( f'inflight_task_{task_id}' )
+                        pipe.delete( key )
+                        await pipe.execute()
+                async with self.redis.pipeline( transaction=True ) as pipe:
+                    pipe.lrange( f'inflight_subscribers_{task_id}', 0, -1 )
+                    pipe.smembers( f'inflight_detached_{task_id}' )
+                    if finish:
+                        pipe.delete( f'inflight_subscribers_{task_id}', f'inflight_detached_{task_id}' )
+                    entries, detached, *_ = await pipe.execute()
+                subscribers = [ ujson.loads( x ) for x in entries ]
+        except Exception as e:
+            logger.warning( f'InFlightDownloads: redis failed: {e!r}' )
+
+        return [ x for x in [ owner ] + subscribers if self.targetId( x ) not in detached ]
+
+
+    @staticmethod
+    def Key( request: dto.DownloadRequest ) -> str | None:
+        if request.login and request.login != 'anon':
+            return None
+        if request.proxy:
+            return None
+        parts = [
+            request.site,
+            InFlightDownloads.normalizeUrl( request.url ),
+            request.start or 0,
+            request.end or 0,
+            request.format,
+            bool( request.images ),
+            bool( request.cover ),
+            bool( request.thumb ),
+            request.hashtags,
+            request.filename,
+        ]
+        return 'inflight_download_' + hashlib.sha256( ujson.dumps( parts ).encode( 'utf-8' ) ).hexdigest()
+
+
+    @staticmethod
+    def normalizeUrl( url: str ) -> str:
+        parsed = urllib.parse.urlsplit( url.strip() )
+        host = parsed.netloc.lower()
+        if host.startswith( 'www.' ):
+            host = host[4:]
+        path = parsed.path.rstrip( '/' ) or '/'
+        query = sorted( [ x for x in urllib.parse.parse_qsl( parsed.query ) if not x[0].startswith( 'utm_' ) ] )
+        return urllib.parse.urlunsplit( ( parsed.scheme.lower() or 'https', host, path, urllib.parse.urlencode( query ), '' ) )
+
+
+    @staticmethod
+    def target( x: dto.DownloadRequest | dto.DownloadStatus | dto.DownloadResult ) -> Target:
+        return { 'user_id': x.user_id, 'web_id': x.web_id, 'chat_id': x.chat_id, 'message_id': x.message_id }
+
+
+    @staticmethod
+    def targetId( target: Target ) -> str:
+        return f'{target["chat_id"]}:{target["message_id"]}'
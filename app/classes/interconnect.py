@@ -1,136 +1,239 @@
 from __future__ import annotations
+import time
 import asyncio
 import aiohttp
+import re
 import ujson
 import traceback
 import logging
 import urllib.parse
 import hashlib
+import functools
+from contextlib import asynccontextmanager
 from aiohttp.client_exceptions import ClientError
-from typing import List, Dict, Any
+from typing import AsyncIterator, List, Dict, Any, Tuple
 from app import variables
 from app import dto
+from app import metrics
 from app.configs import GC
 from app.objects import RD
+from app.classes.cache import CacheRegistry, TieredCache
+from app.classes.inflight import InFlightDownloads
+from app.classes.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
 
 logger = logging.getLogger(__name__)
 
+
+class InterconnectResponseError(Exception):
+    def __init__( self, status: int, data: Any ) -> None:
+        super().__init__( f'Queue responded with {status}' )
+        self.status = status
+        self.data = data
+
+
+def transientError( e: BaseException ) -> bool:
+    if isinstance( e, InterconnectResponseError ):
+        return e.status >= 500 or e.status == 429
+    return isinstance( e, ( ClientError, OSError ) )
+
+
+def negativeAnswer( e: BaseException ) -> bool:
+    # a 4xx is the queue service saying no, not failing
+    return isinstance( e, InterconnectResponseError ) and not transientError( e )
+
+
 class Interconnect:
+    _session:            aiohttp.ClientSession | None = None
+    # keep-alive pool towards GC.queue_host
+    pool_limit:          int = 100
+    pool_limit_per_host: int = 50
+    keepalive_timeout:   int = 60
+    # site metadata, served stale while refreshed in background
+    caches:              CacheRegistry = CacheRegistry()
+    active_sites_cache:  TieredCache = caches.Register( TieredCache( dto.SitesListResponse, ttl=60, stale_ttl=3600, name='active_sites' ) )
+    auth_sites_cache:    TieredCache = caches.Register( TieredCache( dto.SitesListResponse, ttl=60, stale_ttl=3600, name='auth_sites' ) )
+    grouped_sites_cache: TieredCache = caches.Register( TieredCache( dto.GroupedSitesResponse, ttl=60, stale_ttl=3600, name='grouped_sites' ) )
+    site_data_cache:     TieredCache = caches.Register( TieredCache( dto.SiteCheckResponse, ttl=60, stale_ttl=3600, name='site_data', negative=negativeAnswer ) )
+    # queue service calls, a circuit and a retry policy per endpoint
+    circuits:            Dict[ str, Tuple[ RetryPolicy, CircuitBreaker ] ] = {}
+    retry_attempts:      int = 5
+    retry_deadline:      float = 15
+    breaker_threshold:   int = 5
+    breaker_reset:       float = 30
+    # identical downloads share one queue task, its files are kept until every copy is sent
+    inflight:            InFlightDownloads = InFlightDownloads( RD )
+    _held_files:         Dict[ int, dto.DownloadClearRequest | None ] = {}
+    # link permission checks, cached per work
+    link_positive_ttl:   int = 86400
+    link_negative_ttl:   int = 3600
+    link_error_ttl:      int = 60
+    link_concurrency:    int = 4
+    link_attempts:       int = 3
+    link_timeout:        float = 15
+    link_backoff:        RetryPolicy = RetryPolicy( 'check_link', base=0.5, cap=3 )
+    _link_slots:         Dict[ str, asyncio.Semaphore ] = {}
+    _link_checks:        Dict[ str, asyncio.Future ] = {}
+
 
     @staticmethod
-    async def GetSitesActive() -> List[ str ]:
-        cache_key = variables.ACTIVE_SITES_CACHE_KEY
-        model = dto.SitesListResponse()
-        cached = await RD.get( cache_key )
+    async def Start() -> None:
+        await Interconnect.caches.Listen( GC.cache_channel )
+        if Interconnect._session and not Interconnect._session.closed:
+            return
+        Interconnect._session = Interconnect.createSession()
+        logger.info('Interconnect: started')
 
-        if not cached:
-            _attempts = 0
-            while _attempts < 5:
-                try:
-                    async with aiohttp.ClientSession( json_serialize=ujson.dumps ) as session:
-                        async with session.post( GC.queue_host + 'sites/active', verify_ssl=False ) as response:
-                            if response.status == 200:
-                                data = await response.json( loads=ujson.loads )
-                                model = model.model_validate( data )
-                                _attempts = 5
-                except:
-                    traceback.print_exc()
-                    _attempts+=1
-                    await asyncio.sleep(5)
-
-            cached = model.model_dump_json()
-            await RD.setex( cache_key, 60, cached )
-        else:
-            model = model.model_validate_json( cached )
 
-        return model.sites
+    @staticmethod
+    async def Stop() -> None:
+        await Interconnect.caches.Stop()
+        if Interconnect._session:
+            logger.info('Interconnect: finished')
+            await Interconnect._session.close()
+            Interconnect._session = None
+
 
     @staticmethod
-    async def GetSitesActiveGrouped() -> Dict[ str, List[ str ] ]:
-        cache_key = variables.ACTIVE_SITES_CACHE_KEY
-        model = dto.GroupedSitesResponse()
-        cached = await RD.get( cache_key )
+    def getSession() -> aiohttp.ClientSession:
+        if not Interconnect._session or Interconnect._session.closed:
+            Interconnect._session = Interconnect.createSession()
+        return Interconnect._session
 
-        if not cached:
-            _attempts = 0
-            while _attempts < 5:
+
+    @staticmethod
+    def createSession() -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit = Interconnect.pool_limit,
+            limit_per_host = Interconnect.pool_limit_per_host,
+            keepalive_timeout = Interconnect.keepalive_timeout,
+            ttl_dns_cache = 300
+        )
+        return aiohttp.ClientSession( connector=connector, json_serialize=ujson.dumps )
+
+
+    @staticmethod
+    def circuit( endpoint: str ) -> Tuple[ RetryPolicy, CircuitBreaker ]:
+        if endpoint not in Interconnect.circuits:
+            Interconnect.circuits[ endpoint ] = (
+                RetryPolicy( endpoint, attempts=Interconnect.retry_attempts, deadline=Interconnect.retry_deadline, transient=transientError ),
+                CircuitBreaker( endpoint, failure_threshold=Interconnect.breaker_threshold, reset_timeout=Interconnect.breaker_reset )
+            )
+        return Interconnect.circuits[ endpoint ]
+
+
+    @staticmethod
+    async def request(
+        method: str,
+        endpoint: str,
+        payload: Dict[ str, Any ] | None = None,
+        parse: bool = True,
+        attempts: int | None = None,
+        deadline: float | None = None
+    ) -> Any:
+        retries, breaker = Interconnect.circuit( endpoint )
+
+        async def call() -> Any:
+            session = Interconnect.getSession()
+            async with session.request( method, GC.queue_host + endpoint, json=payload, verify_ssl=False ) as response:
+                if response.status == 200:
+                    return await response.json( loads=ujson.loads ) if parse else None
                 try:
-                    async with aiohttp.ClientSession( json_serialize=ujson.dumps ) as session:
-                        async with session.post( GC.queue_host + 'sites/active_grouped', verify_ssl=False ) as response:
-                            if response.status == 200:
-                                data = await response.json( loads=ujson.loads )
-                                model = model.model_validate( data )
-                                _attempts = 5
-                except:
-                    traceback.print_exc()
-                    _attempts+=1
-                    await asyncio.sleep(5)
-
-            cached = model.model_dump_json()
-            await RD.setex( cache_key, 60, cached )
-        else:
-            model = model.model_validate_json( cached )
+                    data = await response.json( loads=ujson.loads, content_type=None )
+                except ValueError:
+                    data = await response.text()
+                raise InterconnectResponseError( response.status, data )
 
+        started = time.monotonic()
+        status = 'ok'
+        try:
+            return await retries.Run( call, breaker=breaker, attempts=attempts, deadline=deadline )
+        except:
+            status = 'error'
+            raise
+        finally:
+            metrics.INTERCONNECT_LATENCY.labels( endpoint, status ).observe( time.monotonic() - started )
+
+    ###
+
+    @staticmethod
+    async def GetSitesActive() -> List[ str ]:
+        model = await Interconnect.active_sites_cache.Get( '', Interconnect.fetchSitesActive )
+        return model.sites
+
+    @staticmethod
+    async def GetSitesActiveGrouped() -> Dict[ str, List[ str ] ]:
+        model = await Interconnect.grouped_sites_cache.Get( '', Interconnect.fetchSitesActiveGrouped )
         return model.groups
 
     @staticmethod
     async def GetSitesWithAuth() -> List[ str ]:
-        cache_key = variables.AUTH_SITES_CACHE_KEY
-        model = dto.SitesListResponse()
-        cached = await RD.get( cache_key )
+        model = await Interconnect.auth_sites_cache.Get( '', Interconnect.fetchSitesWithAuth )
+        return model.sites
 
-        if not cached:
-            _attempts = 0
-            while _attempts < 5:
-                try:
-                    async with aiohttp.ClientSession( json_serialize=ujson.dumps ) as session:
-                        async with session.post( GC.queue_host + 'sites/auths', verify_ssl=False ) as response:
-                            if response.status == 200:
-                                data = await response.json( loads=ujson.loads )
-                                logger.info( str(data) )
-                                model = model.model_validate( data )
-                                _attempts = 5
-                except:
-                    traceback.print_exc()
-                    _attempts+=1
-                    await asyncio.sleep(5)
-
-            cached = model.model_dump_json()
-            await RD.setex( cache_key, 60, cached )
+    @staticmethod
+    async def GetSiteData( site_name: str ) -> dto.SiteCheckResponse:
+        return await Interconnect.site_data_cache.Get( site_name, functools.partial( Interconnect.fetchSiteData, site_name ) )
+
+    @staticmethod
+    async def WarmUp( concurrency: int = 8 ) -> float:
+        # fills the site caches before the first user asks, returns the seconds it took
+        started = time.monotonic()
+        sites, *_ = await asyncio.gather(
+            Interconnect.GetSitesActive(),
+            Interconnect.GetSitesActiveGrouped(),
+            Interconnect.GetSitesWithAuth()
+        )
+        # the getters answer with an empty list rather than fail, a failed refresh shows as degraded
+        if Interconnect.SitesDegraded():
+            raise RuntimeError( 'site lists are unavailable' )
+        slots = asyncio.Semaphore( concurrency )
+
+        async def warm( site: str ) -> None:
+            async with slots:
+                await Interconnect.GetSiteData( site )
+
+        await asyncio.gather( *[ warm( site ) for site in sites ] )
+        failed = [ site for site in sites if Interconnect.site_data_cache.Degraded( site ) ]
+        if sites and len( failed ) == len( sites ):
+            raise RuntimeError( f'data of all {len( sites )} sites is unavailable' )
+        elapsed = time.monotonic() - started
+        metrics.WARMUP_SECONDS.set( elapsed )
+        if failed:
+            logger.warning(f'Interconnect: warmed up {len( sites ) - len( failed )} of {len( sites )} sites in {elapsed:.2f}s, no data for {failed}')
         else:
-            model = model.model_validate_json( cached )
+            logger.info(f'Interconnect: warmed up {len( sites )} sites in {elapsed:.2f}s')
+        return elapsed
 
-        return model.sites
+    @staticmethod
+    def SitesDegraded() -> bool:
+        # site lists currently come from the last good copy, the queue service is not answering
+        return Interconnect.caches.Degraded( [ 'active_sites', 'auth_sites', 'grouped_sites' ] )
+
+    #
 
     @staticmethod
-    async def GetSiteData( site_name: str ) -> dto.SiteCheckResponse:
-        cache_key = f"cache_sites_data_{site_name}"
-        model = dto.SiteCheckResponse()
-        cached = await RD.get( cache_key )
+    async def fetchSitesActive() -> dto.SitesListResponse:
+        data = await Interconnect.request( 'POST', 'sites/active', deadline=10 )
+        return dto.SitesListResponse.model_validate( data )
 
-        payload = dto.SiteCheckRequest( site=site_name ).model_dump( mode='json' )
+    @staticmethod
+    async def fetchSitesActiveGrouped() -> dto.GroupedSitesResponse:
+        data = await Interconnect.request( 'POST', 'sites/active_grouped', deadline=10 )
+        return dto.GroupedSitesResponse.model_validate( data )
 
-        if not cached:
-            _attempts = 0
-            while _attempts < 5:
-                try:
-                    async with aiohttp.ClientSession( json_serialize=ujson.dumps ) as session:
-                        async with session.post( GC.queue_host + 'sites/check', json=payload, verify_ssl=False ) as response:
-                            if response.status == 200:
-                                data = await response.json( loads=ujson.loads )
-                                model = model.model_validate( data )
-                                _attempts = 5
-                except:
-                    traceback.print_exc()
-                    _attempts+=1
-                    await asyncio.sleep(5)
-
-            cached = model.model_dump_json()
-            await RD.setex( cache_key, 60, cached )
-        else:
-            model = model.model_validate_json( cached )
+    @staticmethod
+    async def fetchSitesWithAuth() -> dto.SitesListResponse:
+        data = await Interconnect.request( 'POST', 'sites/auths', deadline=10 )
+        logger.info( str(data) )
+        return dto.SitesListResponse.model_validate( data )
 
-        return model
+    @staticmethod
+    async def fetchSiteData( site_name: str ) -> dto.SiteCheckResponse:
+        payload = dto.SiteCheckRequest( site=site_name ).model_dump( mode='json' )
+        data = await Interconnect.request( 'POST', 'sites/check', payload, deadline=10 )
+        return dto.SiteCheckResponse.model_validate( data )
+
+    ###
 
     @staticmethod
     async def GetUsage( use_cache: bool = True ) -> Dict[ str, Any ]:
@@ -141,22 +244,16 @@ class Interconnect:
             cached = None
 
         if not cached:
-            stats = {}
-            _attempts = 0
-            while _attempts < 5:
-                try:
-                    async with aiohttp.ClientSession( json_serialize=ujson.dumps ) as session:
-                        async with session.get( GC.queue_host + 'export/queue', verify_ssl=False ) as response:
-                            if response.status == 200:
-                                _attempts = 5
-                                stats = await response.json( loads=ujson.loads )
-                except:
-                    _attempts+=1
-                    await asyncio.sleep(1)
-            
+            metrics.CACHE_REQUESTS.labels( 'queue_usage', 'miss' ).inc()
+            try:
+                stats = await Interconnect.request( 'GET', 'export/queue', deadline=5 )
+            except:
+                stats = {}
+
             cached = ujson.dumps( stats )
             await RD.setex( cache_key, 5, cached )
         else:
+            metrics.CACHE_REQUESTS.labels( 'queue_usage', 'redis' ).inc()
             stats = ujson.loads( cached )
 
         return stats
@@ -167,22 +264,16 @@ class Interconnect:
         cached = await RD.get( cache_key )
 
         if not cached:
-            stats = {}
-            _attempts = 0
-            while _attempts < 5:
-                try:
-                    async with aiohttp.ClientSession( json_serialize=ujson.dumps ) as session:
-                        async with session.get( GC.queue_host + 'export/stats', verify_ssl=False ) as response:
-                            if response.status == 200:
-                                _attempts = 5
-                                stats = await response.json( loads=ujson.loads )
-                except:
-                    _attempts+=1
-                    await asyncio.sleep(1)
-            
+            metrics.CACHE_REQUESTS.labels( 'queue_stats', 'miss' ).inc()
+            try:
+                stats = await Interconnect.request( 'GET', 'export/stats', deadline=5 )
+            except:
+                stats = {}
+
             cached = ujson.dumps( stats )
             await RD.setex( cache_key, 5, cached )
         else:
+            metrics.CACHE_REQUESTS.labels( 'queue_stats', 'redis' ).inc()
             stats = ujson.loads( cached )
 
         return stats
@@ -193,16 +284,18 @@ class Interconnect:
 
     @staticmethod
     async def InitDownload( request: dto.DownloadRequest ) -> int | str:
+        return await Interconnect.inflight.Init( request, Interconnect.initDownload )
+
+
+    @staticmethod
+    async def initDownload( request: dto.DownloadRequest ) -> int | str:
+        # not idempotent, so a single attempt
         try:
-            async with aiohttp.ClientSession( json_serialize=ujson.dumps ) as session:
-                async with session.post( GC.queue_host + 'download/new', json=request.model_dump( mode='json' ), verify_ssl=False ) as response:
-                    if response.status == 200:
-                        task_id = int( await response.json( loads=ujson.loads ) )
-                        return task_id
-                    else:
-                        message = await response.json( loads=ujson.loads )
-                        return message
-        except ClientError as e:
+            task_id = await Interconnect.request( 'POST', 'download/new', request.model_dump( mode='json' ), attempts=1, deadline=30 )
+            return int( task_id )
+        except InterconnectResponseError as e:
+            return e.data
+        except ( ClientError, CircuitOpenError, TimeoutError ) as e:
             return "Ошибка соединения с сервером загрузки"
         except Exception as e:
             return str(e)
@@ -210,19 +303,25 @@ class Interconnect:
 
     @staticmethod
     async def CancelDownload( request: dto.DownloadCancelRequest ) -> dto.DownloadCancelResponse | str:
+        # a shared task keeps running for the others, only the cancelling message is detached;
+        # without the message nobody can be detached, so only a forced cancel stops it
+        if not request.force:
+            if request.chat_id and request.message_id:
+                detached = await Interconnect.inflight.Detach( request.task_id, request.chat_id, request.message_id )
+                if detached:
+                    return detached
+            elif await Interconnect.inflight.Recipients( request.task_id ) > 1:
+                return 'Эту загрузку ждут и другие пользователи, отменить её нельзя'
         try:
-            async with aiohttp.ClientSession( json_serialize=ujson.dumps ) as session:
-                async with session.post( GC.queue_host + 'download/cancel', json=request.model_dump( mode='json' ), verify_ssl=False ) as response:
-                    if response.status == 200:
-                        try:
-                            data = await response.json( loads=ujson.loads )
-                            return dto.DownloadCancelResponse.model_validate( data )
-                        except:
-                            return 'Загрузка не найдена'
-                    else:
-                        message = await response.json( loads=ujson.loads )
-                        return message
-        except ClientError as e:
+            data = await Interconnect.request( 'POST', 'download/cancel', request.model_dump( mode='json', include={ 'task_id' } ), attempts=1, deadline=30 )
+            await Interconnect.inflight.Forget( request.task_id )
+            try:
+                return dto.DownloadCancelResponse.model_validate( data )
+            except:
+                return 'Загрузка не найдена'
+        except InterconnectResponseError as e:
+            return e.data
+        except ( ClientError, CircuitOpenError, TimeoutError ) as e:
             return "Ошибка соединения с сервером загрузки"
         except Exception as e:
             return str(e)
@@ -230,146 +329,69 @@ class Interconnect:
 
     @staticmethod
     async def ClearDownloadFiles( request: dto.DownloadClearRequest ) -> None:
-        _attempts = 0
-        while _attempts < 5:
-            try:
-                async with aiohttp.ClientSession( json_serialize=ujson.dumps ) as session:
-                    async with session.post( GC.queue_host + 'download/clear', json=request.model_dump( mode='json' ), verify_ssl=False ) as response:
-                        if response.status == 200:
-                            _attempts = 5
-                        else:
-                            _attempts+=1
-                            await asyncio.sleep(5)
-            except:
-                traceback.print_exc()
-                _attempts+=1
-                await asyncio.sleep(5)
+        if request.task_id in Interconnect._held_files:
+            Interconnect._held_files[ request.task_id ] = request
+            return
+        try:
+            await Interconnect.request( 'POST', 'download/clear', request.model_dump( mode='json' ), parse=False )
+        except:
+            traceback.print_exc()
+
+
+    @staticmethod
+    @asynccontextmanager
+    async def HoldDownloadFiles( task_id: int ) -> AsyncIterator[ None ]:
+        # clearing requested while the results of a shared task are sent happens once afterwards
+        Interconnect._held_files[ task_id ] = None
+        try:
+            yield
+        finally:
+            request = Interconnect._held_files.pop( task_id, None )
+            if request:
+                await Interconnect.ClearDownloadFiles( request )
 
 
     @staticmethod
     async def ReloadConfig() -> None:
-        _attempts = 0
-        while _attempts < 5:
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get( GC.queue_host + 'update_config', verify_ssl=False ) as response:
-                        if response.status == 200:
-                            _attempts = 5
-                        else:
-                            _attempts+=1
-                            await asyncio.sleep(5)
-            except:
-                traceback.print_exc()
-                _attempts+=1
-                await asyncio.sleep(5)
+        await Interconnect.command( 'GET', 'update_config' )
 
 
     @staticmethod
     async def AdminStopTasks() -> None:
-        _attempts = 0
-        while _attempts < 5:
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post( GC.queue_host + 'queue/stop/tasks', verify_ssl=False ) as response:
-                        if response.status == 200:
-                            _attempts = 5
-                        else:
-                            _attempts+=1
-                            await asyncio.sleep(5)
-            except:
-                traceback.print_exc()
-                _attempts+=1
-                await asyncio.sleep(5)
+        await Interconnect.command( 'POST', 'queue/stop/tasks' )
 
 
     @staticmethod
     async def AdminStartTasks() -> None:
-        _attempts = 0
-        while _attempts < 5:
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post( GC.queue_host + 'queue/start/tasks', verify_ssl=False ) as response:
-                        if response.status == 200:
-                            _attempts = 5
-                        else:
-                            _attempts+=1
-                            await asyncio.sleep(5)
-            except:
-                traceback.print_exc()
-                _attempts+=1
-                await asyncio.sleep(5)
+        await Interconnect.command( 'POST', 'queue/start/tasks' )
 
 
     @staticmethod
     async def AdminStopResults() -> None:
-        _attempts = 0
-        while _attempts < 5:
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post( GC.queue_host + 'queue/stop/results', verify_ssl=False ) as response:
-                        if response.status == 200:
-                            _attempts = 5
-                        else:
-                            _attempts+=1
-                            await asyncio.sleep(5)
-            except:
-                traceback.print_exc()
-                _attempts+=1
-                await asyncio.sleep(5)
+        await Interconnect.command( 'POST', 'queue/stop/results' )
 
 
     @staticmethod
     async def AdminStartResults() -> None:
-        _attempts = 0
-        while _attempts < 5:
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post( GC.queue_host + 'queue/start/results', verify_ssl=False ) as response:
-                        if response.status == 200:
-                            _attempts = 5
-                        else:
-                            _attempts+=1
-                            await asyncio.sleep(5)
-            except:
-                traceback.print_exc()
-                _attempts+=1
-                await asyncio.sleep(5)
+        await Interconnect.command( 'POST', 'queue/start/results' )
 
 
     @staticmethod
     async def AdminStopQueue() -> None:
-        _attempts = 0
-        while _attempts < 5:
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post( GC.queue_host + 'queue/stop', verify_ssl=False ) as response:
-                        if response.status == 200:
-                            _attempts = 5
-                        else:
-                            _attempts+=1
-                            await asyncio.sleep(5)
-            except:
-                traceback.print_exc()
-                _attempts+=1
-                await asyncio.sleep(5)
+        await Interconnect.command( 'POST', 'queue/stop' )
 
 
     @staticmethod
     async def AdminStartQueue() -> None:
-        _attempts = 0
-        while _attempts < 5:
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post( GC.queue_host + 'queue/start', verify_ssl=False ) as response:
-                        if response.status == 200:
-                            _attempts = 5
-                        else:
-                            _attempts+=1
-                            await asyncio.sleep(5)
-            except:
-                traceback.print_exc()
-                _attempts+=1
-                await asyncio.sleep(5)
+        await Interconnect.command( 'POST', 'queue/start' )
+
+
+    @staticmethod
+    async def command( method: str, endpoint: str ) -> None:
+        try:
+            await Interconnect.request( method, endpoint, parse=False )
+        except:
+            traceback.print_exc()
 
 
     ###
@@ -377,32 +399,109 @@ class Interconnect:
 
     @staticmethod
     async def CheckLink( link: str ) -> int:
-        cache_key = "check_link_" + str( hashlib.md5( link.encode( 'utf-8' ) ).hexdigest() )
-        allowed = await RD.get( cache_key )
+        return ( await Interconnect.CheckLinks( [ link ] ) )[ link ]
 
-        if allowed == None:
-            allowed = variables.SiteAllowed.NO
 
-            if 'lib.me/' in link:
-                allowed = await Interconnect.checkLibMeSite( link )
+    @staticmethod
+    async def CheckLinks( links: List[ str ] ) -> Dict[ str, int ]:
+        # every link of a work shares one cache entry, a message with many links costs
+        # one redis round trip and concurrent checks of the works not cached yet
+        works = { link: Interconnect.parseLink( link ) for link in links }
+        keys = list( dict.fromkeys( [ work[0] for work in works.values() if work ] ) )
+        allowed: Dict[ str, int ] = {}
+
+        if keys:
+            cached = await RD.mget( [ f'check_link_{key}' for key in keys ] )
+            for key, value in zip( keys, cached ):
+                if value is not None:
+                    metrics.CACHE_REQUESTS.labels( 'check_link', 'redis' ).inc()
+                    allowed[ key ] = int( value )
+
+            missing = [ work for work in dict.fromkeys( works.values() ) if work and work[0] not in allowed ]
+            if missing:
+                metrics.CACHE_REQUESTS.labels( 'check_link', 'miss' ).inc( len( missing ) )
+                checked = await asyncio.gather( *[ asyncio.shield( Interconnect.checkWork( *work ) ) for work in missing ] )
+                for work, value in zip( missing, checked ):
+                    allowed[ work[0] ] = value
+
+        return { link: allowed[ work[0] ] if work else variables.SiteAllowed.NO for link, work in works.items() }
 
-            if 'tl.rulate.ru/' in link:
-                allowed = await Interconnect.checkRulateSite( link )
 
-            await RD.setex( cache_key, 86400, allowed )
-        else:
-            allowed = int( allowed )
+    @staticmethod
+    def parseLink( link: str ) -> Tuple[ str, str, str ] | None:
+        # ( cache key, domain, work ) of a supported link, None for everything else
+        link = link.strip()
+        # links are often pasted without the scheme
+        parsed = urllib.parse.urlsplit( link if '//' in link else '//' + link )
+        domain = parsed.netloc.lower().split( ':' )[0]
+        for prefix in [ 'www.', 'm.' ]:
+            if domain.startswith( prefix ):
+                domain = domain[ len( prefix ): ]
+        path = [ x for x in parsed.path.split( '/' ) if x ]
+
+        if domain.endswith( 'lib.me' ):
+            # /ru/manga/7965--chainsaw-man/read/v1/c1 and the like, keyed by the numeric id
+            works = [ x for x in path if re.match( r'^\d+(--|$)', x ) ]
+            work = works[0] if works else ( path[2] if len( path ) > 2 else None )
+            if not work:
+                return None
+            return ( f'{domain}_{work.split( "--" )[0]}', domain, work )
+
+        if domain == 'tl.rulate.ru':
+            if len( path ) > 1 and path[0] == 'book':
+                return ( f'{domain}_{path[1]}', domain, path[1] )
+            # every rulate link is allowed, the other pages are keyed by their path
+            page = '/'.join( path )
+            return ( f'{domain}_{hashlib.md5( page.encode( "utf-8" ) ).hexdigest()}', domain, page )
+
+        return None
+
+
+    @staticmethod
+    def checkWork( key: str, domain: str, work: str ) -> asyncio.Future:
+        # single-flight: concurrent checks of a work wait for the same request
+        future = Interconnect._link_checks.get( key )
+        if future is None:
+            future = asyncio.ensure_future( Interconnect.fetchWork( key, domain, work ) )
+            Interconnect._link_checks[ key ] = future
+            future.add_done_callback( lambda f: Interconnect._link_checks.pop( key, None ) )
+        return future
+
+
+    @staticmethod
+    async def fetchWork( key: str, domain: str, work: str ) -> int:
+        # all the lib.me sites are checked through the same api
+        remote = 'lib.me' if domain.endswith( 'lib.me' ) else domain
+        if remote not in Interconnect._link_slots:
+            Interconnect._link_slots[ remote ] = asyncio.Semaphore( Interconnect.link_concurrency )
+
+        try:
+            async with Interconnect._link_slots[ remote ]:
+                if domain == 'tl.rulate.ru':
+                    allowed = await Interconnect.checkRulateSite( work )
+                else:
+                    allowed = await Interconnect.checkLibMeSite( domain, work )
+            ttl = Interconnect.link_positive_ttl if allowed != variables.SiteAllowed.NO else Interconnect.link_negative_ttl
+        except Exception:
+            # the site could not be asked, answer no for now and ask again soon
+            traceback.print_exc()
+            allowed = variables.SiteAllowed.NO
+            ttl = Interconnect.link_error_ttl
 
+        try:
+            await RD.setex( f'check_link_{key}', ttl, allowed )
+        except Exception:
+            traceback.print_exc()
         return allowed
 
 
     @staticmethod
-    async def checkRulateSite( link: str ) -> int:
-        return 1
+    async def checkRulateSite( work: str ) -> int:
+        return variables.SiteAllowed.YES
 
 
     @staticmethod
-    async def checkLibMeSite( link: str ) -> int:
+    async def checkLibMeSite( domain: str, work: str ) -> int:
 
         async def checkWithoutAuth( session: aiohttp.ClientSession, work: str, proxy ) -> bool:
             headers = {
@@ -438,34 +537,30 @@ class Interconnect:
                     return True
         
         #
-        
-        allowed = variables.SiteAllowed.NO
 
-        _data = link.split('/')
-
-        domain = _data.pop( 2 )
-        work = _data.pop( 4 )
-        work = work.split( '?' ).pop( 0 )
+        session = Interconnect.getSession()
+        failed = []
         proxy = await GC.proxies.GetInstance( domain )
-
-        async with aiohttp.ClientSession() as session:
-            _attempts = 0
-            while _attempts < 5:
-                try:
-                    allowed_without_auth = await checkWithoutAuth( session, work, proxy )
-                    if allowed_without_auth:
+        attempt = 0
+        while True:
+            attempt += 1
+            started = time.monotonic()
+            try:
+                async with asyncio.timeout( Interconnect.link_timeout ):
+                    if await checkWithoutAuth( session, work, proxy ):
                         allowed = variables.SiteAllowed.YES
+                    elif await checkWithAuth( session, work, proxy ):
+                        allowed = variables.SiteAllowed.AUTHED
                     else:
-                        allowed_with_auth = await checkWithAuth( session, work, proxy )
-                        if allowed_with_auth:
-                            allowed = variables.SiteAllowed.AUTHED
-                        else:
-                            allowed = variables.SiteAllowed.NO
-                    _attempts = 5
-                except:
-                    traceback.print_exc()
-                    _attempts+=1
-                    await asyncio.sleep(5)
-            await session.close()
-        
-        return allowed
\ No newline at end of file
+                        allowed = variables.SiteAllowed.NO
+                await GC.proxies.Report( domain, proxy, True, time.monotonic() - started )
+                return allowed
+            except ( ClientError, TimeoutError ) as e:
+                await GC.proxies.Report( domain, proxy, False )
+                if attempt >= Interconnect.link_attempts:
+                    raise
+                logger.warning( f'Interconnect: check of {domain}/{work} failed with {e!r}, attempt {attempt}' )
+                # next attempt through another proxy while there is one left
+                failed.append( proxy )
+                proxy = await GC.proxies.GetInstance( domain, failed ) or await GC.proxies.GetInstance( domain )
+                await asyncio.sleep( Interconnect.link_backoff.Delay( attempt ) )
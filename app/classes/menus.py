@@ -0,0 +1,34 @@
+from __future__ import annotations
+import logging
+from typing import Any, Callable, Hashable, Tuple, TypeVar
+from cachetools import LRUCache
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar( 'T' )
+
+_MISSING = object()
+
+
+class MenuCache:
+    # built markups and texts of menus that look the same for everyone, keyed by the menu
+    # and the inputs it is built from, so a changed site list is simply a new entry
+    # entries are shared between calls and must not be modified after building
+    def __init__( self, maxsize: int = 256 ) -> None:
+        self._menus: LRUCache[ Tuple[ str, Hashable ], Any ] = LRUCache( maxsize=maxsize )
+
+
+    def Get( self, menu: str, inputs: Hashable, build: Callable[ [], T ] ) -> T:
+        key = ( menu, inputs )
+        value = self._menus.get( key, _MISSING )
+        if value is _MISSING:
+            metrics.MENU_BUILDS.labels( menu ).inc()
+            value = build()
+            self._menus[ key ] = value
+        return value
+
+
+    def Clear( self ) -> None:
+        # config based menus (texts, group names) are built anew after a reload
+        self._menus.clear()
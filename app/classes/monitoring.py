@@ -0,0 +1,166 @@
+from __future__ import annotations
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# router callback each task is running, read by the watchdog thread to name a blocked handler
+_running_handlers: Dict[ asyncio.Task, str ] = {}
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # inner middleware, times every matched router callback under its qualified name
+    async def __call__(
+        self,
+        handler: Callable[ [ TelegramObject, Dict[ str, Any ] ], Awaitable[ Any ] ],
+        event: TelegramObject,
+        data: Dict[ str, Any ]
+    ) -> Any:
+        handler_object = data.get( 'handler' )
+        callback = getattr( handler_object, 'callback', None )
+        name = getattr( callback, '__qualname__', 'unknown' )
+
+        task = asyncio.current_task()
+        _running_handlers[ task ] = name
+        started = time.monotonic()
+        status = 'ok'
+        try:
+            return await handler( event, data )
+        except:
+            status = 'error'
+            raise
+        finally:
+            _running_handlers.pop( task, None )
+            metrics.HANDLER_LATENCY.labels( name, status ).observe( time.monotonic() - started )
+
+
+class LoopMonitor:
+    # samples event loop lag from a task on the loop for as long as the bot runs, and from
+    # a watchdog thread that can be switched on and off reports any callback that holds
+    # the loop longer than threshold with the stack of the loop thread
+    interval:  float = 0.1
+    threshold: float = 0.25
+    window:    int = 600
+
+    def __init__( self ) -> None:
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stop: threading.Event = threading.Event()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread: int | None = None
+        self._heartbeat: float = 0
+        self._samples: Deque[ float ] = deque( maxlen=self.window )
+
+
+    async def Start( self, interval: float | None = None, threshold: float | None = None, watchdog: bool = True ) -> None:
+        if self._task:
+            return
+        self.interval = interval or self.interval
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task( self.loop() )
+        logger.info('LoopMonitor: started, sampling event loop lag')
+        if watchdog:
+            self.StartWatchdog( threshold )
+
+
+    async def Stop( self ) -> None:
+        self.StopWatchdog()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather( self._task, return_exceptions=True )
+            self._task = None
+            logger.info('LoopMonitor: finished')
+
+
+    def StartWatchdog( self, threshold: float | None = None ) -> None:
+        # the watchdog tells stalls by the heartbeat of the sampling task, it needs Start first
+        self.threshold = threshold or self.threshold
+        if self._thread or not self._task:
+            return
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread( target=self.watch, name='loop-watchdog', daemon=True )
+        self._thread.start()
+        metrics.LOOP_WATCHDOG_ENABLED.set( 1 )
+        logger.info(f'LoopMonitor: reporting callbacks blocking the loop over {self.threshold}s')
+
+
+    def StopWatchdog( self ) -> None:
+        if self._thread:
+            self._stop.set()
+            self._thread.join( self.interval * 2 )
+            self._thread = None
+            metrics.LOOP_WATCHDOG_ENABLED.set( 0 )
+            logger.info('LoopMonitor: watchdog stopped')
+
+
+    def Enabled( self ) -> bool:
+        return self._thread is not None
+
+
+    def Percentiles( self ) -> Dict[ str, float ]:
+        samples = sorted( self._samples )
+        if not samples:
+            return {}
+        percentiles = {}
+        for quantile in ( '0.5', '0.9', '0.99' ):
+            percentiles[ quantile ] = samples[ min( int( len( samples ) * float( quantile ) ), len( samples ) - 1 ) ]
+        percentiles[ '1' ] = samples[-1]
+        return percentiles
+
+    #
+
+    async def loop( self ) -> None:
+        published = time.monotonic()
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep( self.interval )
+            now = time.monotonic()
+            self._heartbeat = now
+
+            lag = max( now - started - self.interval, 0 )
+            self._samples.append( lag )
+            metrics.LOOP_LAG.set( lag )
+            metrics.LOOP_LAG_SECONDS.observe( lag )
+
+            if now - published >= 5:
+                published = now
+                for quantile, value in self.Percentiles().items():
+                    metrics.LOOP_LAG_QUANTILE.labels( quantile ).set( value )
+
+
+    def watch( self ) -> None:
+        # own thread, a blocked loop can't report on itself
+        reported = 0.0
+        while not self._stop.wait( self.interval ):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or heartbeat == reported:
+                continue
+            reported = heartbeat
+
+            task = asyncio.current_task( self._loop )
+            # the label is the handler or the coroutine function, task names are unique per task
+            # and would grow the label set without bound
+            handler = _running_handlers.get( task ) or ( self.coroutineName( task ) if task else 'callback' )
+            frame = sys._current_frames().get( self._loop_thread )
+            stack = ''.join( traceback.format_stack( frame ) ) if frame else ''
+
+            metrics.LOOP_STALLS.labels( handler ).inc()
+            logger.warning(f'LoopMonitor: event loop blocked for over {blocked:.3f}s by {handler}\n{stack}')
+
+
+    @staticmethod
+    def coroutineName( task: asyncio.Task ) -> str:
+        return getattr( task.get_coro(), '__qualname__', None ) or 'unknown'
@@ -0,0 +1,199 @@
+from __future__ import annotations
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Tuple
+from cachetools import LRUCache
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# sends made inside bulk() yield to interactive replies
+_bulk: ContextVar[ bool ] = ContextVar( 'outbound_bulk', default=False )
+
+
+@contextmanager
+def bulk() -> Iterator[ None ]:
+    token = _bulk.set( True )
+    try:
+        yield
+    finally:
+        _bulk.reset( token )
+
+
+class TokenBucket:
+    rate:     float
+    capacity: float
+
+    def __init__( self, rate: float, capacity: float ) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens: float = capacity
+        self._updated: float = time.monotonic()
+        self._paused_until: float = 0
+
+
+    def Wait( self, reserve: float = 0 ) -> float:
+        # seconds until a token above reserve is available, 0 if one is available now
+        now = time.monotonic()
+        self._tokens = min( self.capacity, self._tokens + ( now - self._updated ) * self.rate )
+        self._updated = now
+        paused = max( self._paused_until - now, 0 )
+        if self._tokens - reserve >= 1:
+            return paused
+        return max( paused, ( 1 + reserve - self._tokens ) / self.rate )
+
+
+    def Take( self ) -> None:
+        self._tokens -= 1
+
+
+    def Pause( self, seconds: float ) -> None:
+        self._paused_until = max( self._paused_until, time.monotonic() + seconds )
+
+
+@dataclass
+class PendingEdit:
+    method: TelegramMethod
+    future: asyncio.Future
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    # request middleware on the bot session, every api call passes through it
+    # - global and per-chat token buckets for methods that post into a chat
+    # - bulk sends keep reserve tokens of the global bucket free for interactive replies
+    # - on RetryAfter the chat (or everything) is paused for retry_after and the call repeated
+    # - an edit waiting for its turn is replaced by a newer edit of the same message,
+    #   edits of one message go out one at a time and in order
+    global_rate:  float = 30
+    chat_rate:    float = 1
+    chat_burst:   float = 3
+    group_rate:   float = 20 / 60
+    group_burst:  float = 5
+    reserve:      float = 10
+    retries:      int = 3
+
+    LIMITED = ( 'Send', 'Edit', 'Delete', 'Forward', 'Copy', 'Pin', 'Unpin' )
+
+    def __init__( self ) -> None:
+        self._global: TokenBucket = TokenBucket( self.global_rate, self.global_rate )
+        self._chats: LRUCache[ Any, TokenBucket ] = LRUCache( maxsize=10000 )
+        self._edits: Dict[ Tuple[ Any, ... ], PendingEdit ] = {}
+        self._sending: Dict[ Tuple[ Any, ... ], PendingEdit ] = {}
+
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod
+    ) -> Any:
+        name = type( method ).__name__
+        chat_id = getattr( method, 'chat_id', None )
+        if not name.startswith( self.LIMITED ) or name == 'SendChatAction':
+            return await self.send( make_request, bot, method, None )
+
+        message_id = getattr( method, 'message_id', None ) or getattr( method, 'inline_message_id', None )
+        if not name.startswith( 'Edit' ) or message_id is None:
+            await self.acquire( chat_id )
+            return await self.send( make_request, bot, method, chat_id )
+
+        key = ( name, chat_id, message_id )
+        pending = self._edits.get( key )
+        if pending is not None:
+            # the newest content wins, callers of superseded edits get its result
+            pending.method = method
+            metrics.OUTBOUND_COALESCED.inc()
+            return await asyncio.shield( pending.future )
+
+        pending = PendingEdit( method, asyncio.get_running_loop().create_future() )
+        self._edits[ key ] = pending
+        try:
+            try:
+                await self.acquire( chat_id )
+                # the previous edit of the message still on the wire goes first
+                previous = self._sending.get( key )
+                if previous is not None:
+                    await asyncio.wait( [ previous.future ] )
+            finally:
+                # only edits still waiting are coalesced, once this one goes on the wire
+                # a newer edit starts its own entry and is sent after it
+                if self._edits.get( key ) is pending:
+                    del self._edits[ key ]
+            self._sending[ key ] = pending
+            result = await self.send( make_request, bot, pending.method, chat_id )
+        except asyncio.CancelledError:
+            pending.future.cancel()
+            raise
+        except Exception as e:
+            pending.future.set_exception( e )
+            # mark as retrieved, there may be no superseded callers waiting on it
+            pending.future.exception()
+            raise
+        finally:
+            if self._sending.get( key ) is pending:
+                del self._sending[ key ]
+        pending.future.set_result( result )
+        return result
+
+    #
+
+    async def acquire( self, chat_id: Any ) -> None:
+        interactive = not _bulk.get()
+        reserve = 0 if interactive else self.reserve
+        chat = self.chatBucket( chat_id )
+        started = time.monotonic()
+        while True:
+            wait = self._global.Wait( reserve )
+            if chat is not None:
+                wait = max( wait, chat.Wait() )
+            if wait <= 0:
+                break
+            await asyncio.sleep( wait )
+        self._global.Take()
+        if chat is not None:
+            chat.Take()
+        metrics.OUTBOUND_WAIT.labels( 'interactive' if interactive else 'bulk' ).observe( time.monotonic() - started )
+
+
+    async def send( self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod, chat_id: Any ) -> Any:
+        attempt = 0
+        while True:
+            try:
+                return await make_request( bot, method )
+            except TelegramRetryAfter as e:
+                attempt += 1
+                metrics.OUTBOUND_RETRY_AFTER.inc()
+                chat = self.chatBucket( chat_id )
+                if chat is not None:
+                    chat.Pause( e.retry_after )
+                else:
+                    self._global.Pause( e.retry_after )
+                if attempt > self.retries:
+                    raise
+                logger.warning(f'Outbound: {type( method ).__name__} to {chat_id} flood limited for {e.retry_after}s')
+                if chat_id is not None:
+                    await self.acquire( chat_id )
+                else:
+                    await asyncio.sleep( e.retry_after )
+
+
+    def chatBucket( self, chat_id: Any ) -> TokenBucket | None:
+        if chat_id is None:
+            return None
+        bucket = self._chats.get( chat_id )
+        if bucket is None:
+            # groups and channels have negative ids and much lower limits
+            if isinstance( chat_id, int ) and chat_id > 0:
+                bucket = TokenBucket( self.chat_rate, self.chat_burst )
+            else:
+                bucket = TokenBucket( self.group_rate, self.group_burst )
+            self._chats[ chat_id ] = bucket
+        return bucket
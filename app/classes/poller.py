@@ -0,0 +1,94 @@
+from __future__ import annotations
+import asyncio
+import logging
+import traceback
+from typing import List
+from aiogram import Bot, Dispatcher, types
+from app import metrics
+from app.classes.updates import UpdatesPipeline
+from app.classes.resilience import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+class Poller:
+    # long polling for deployments without a public url
+    # one getUpdates loop feeds the updates pipeline, which processes chats concurrently;
+    # telegram allows a single getUpdates at a time, so fetching is not parallelised
+    timeout: int = 30
+    limit:   int = 100
+
+    def __init__( self, dispatcher: Dispatcher, bot: Bot, updates: UpdatesPipeline ) -> None:
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.updates = updates
+        self.offset: int | None = None
+        self._task: asyncio.Task | None = None
+        self._backoff: RetryPolicy = RetryPolicy( 'polling', base=1, cap=30 )
+
+
+    async def Start( self, timeout: int = 30, limit: int = 100 ) -> None:
+        if self._task:
+            return
+        self.timeout = timeout
+        self.limit = limit
+        await self.bot.delete_webhook( drop_pending_updates=False )
+        self._task = asyncio.create_task( self.loop() )
+        logger.info('Poller: started')
+
+
+    async def Stop( self ) -> None:
+        if not self._task:
+            return
+        self._task.cancel()
+        await asyncio.gather( self._task, return_exceptions=True )
+        self._task = None
+
+        # updates already taken from telegram are processed before their offset is confirmed,
+        # when the drain times out only the updates before the oldest unprocessed one are
+        # confirmed, the rest is redelivered on the next start (some of it a second time)
+        await self.updates.Stop()
+        unfinished = self.updates.Unfinished()
+        if unfinished:
+            self.offset = unfinished[0] if self.offset is None else min( self.offset, unfinished[0] )
+        if self.offset is not None:
+            try:
+                await self.bot.get_updates( offset=self.offset, limit=1, timeout=0 )
+            except Exception:
+                traceback.print_exc()
+        logger.info('Poller: finished')
+
+    #
+
+    async def loop( self ) -> None:
+        allowed_updates = self.dispatcher.resolve_used_update_types()
+        failures = 0
+        pending: List[ types.Update ] = []
+        while True:
+            if not pending:
+                try:
+                    pending = await self.bot.get_updates(
+                        offset = self.offset,
+                        limit = self.limit,
+                        timeout = self.timeout,
+                        allowed_updates = allowed_updates,
+                        request_timeout = self.timeout + 10
+                    )
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    failures += 1
+                    metrics.POLLING_ERRORS.inc()
+                    delay = self._backoff.Delay( failures )
+                    logger.warning(f'Poller: getUpdates failed with {e!r}, next in {delay:.2f}s')
+                    await asyncio.sleep( delay )
+                    continue
+                failures = 0
+                metrics.POLLING_BATCH.observe( len( pending ) )
+
+            # hand updates over in order, waiting instead of dropping while the pipeline is full
+            while pending and self.updates.Depth() < self.updates.queue_size:
+                if not self.updates.Put( pending[0] ):
+                    break
+                self.offset = pending.pop( 0 ).update_id + 1
+            if pending:
+                await asyncio.sleep( 0.1 )
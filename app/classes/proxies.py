@@ -0,0 +1,175 @@
+from __future__ import annotations
+import time
+import random
+import asyncio
+import aiohttp
+import hashlib
+import logging
+import traceback
+from typing import Callable, Dict, List, Tuple
+from redis.asyncio import Redis
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ProxyPool:
+    # health of the configured proxies, kept in redis so all replicas choose alike
+    # - successes, failures and latency are counted per proxy, globally and per site,
+    #   in two window buckets so old results fade out
+    # - failures in a row put a proxy into quarantine for the site (or everywhere when
+    #   a probe fails), each new quarantine lasts twice as long up to quarantine_cap
+    # - candidates are drawn at random weighted by success rate and latency, so load
+    #   spreads over healthy proxies and slow ones still get occasional traffic
+    # - one replica at a time probes every proxy against probe_url in background
+    window:           int = 600
+    failures:         int = 3
+    quarantine_base:  float = 30
+    quarantine_cap:   float = 1800
+    probe_timeout:    float = 10
+
+    def __init__( self, redis: Redis ) -> None:
+        self.redis = redis
+        self._task: asyncio.Task | None = None
+
+
+    async def Start( self, instances: Callable[ [], List[ str ] ], probe_url: str, interval: float = 60 ) -> None:
+        if self._task or not probe_url:
+            return
+        self._task = asyncio.create_task( self.loop( instances, probe_url, interval ) )
+        logger.info('ProxyPool: started')
+
+
+    async def Stop( self ) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather( self._task, return_exceptions=True )
+            self._task = None
+            logger.info('ProxyPool: finished')
+
+
+    async def Pick( self, site: str, instances: List[ str ], exclude: List[ str ] = [] ) -> str:
+        candidates = [ x for x in dict.fromkeys( instances ) if x not in exclude ]
+        if len( candidates ) < 2:
+            return candidates[0] if candidates else ''
+
+        try:
+            quarantined, stats = await self.read( site, candidates )
+        except Exception as e:
+            logger.warning( f'ProxyPool: redis failed: {e!r}' )
+            return random.choice( candidates )
+
+        healthy = [ x for x in candidates if x not in quarantined ]
+        if not healthy:
+            # better a proxy that may have recovered than none at all
+            healthy = candidates
+        weights = [ self.weight( *stats[ x ] ) for x in healthy ]
+        return random.choices( healthy, weights=weights )[0]
+
+
+    async def Report( self, site: str, proxy: str, ok: bool, latency: float = 0 ) -> None:
+        if not proxy:
+            return
+        metrics.PROXY_REQUESTS.labels( 'ok' if ok else 'error' ).inc()
+        pid = self.proxyId( proxy )
+        bucket = self.bucket()
+        try:
+            async with self.redis.pipeline( transaction=False ) as pipe:
+                for scope in dict.fromkeys( [ '', site ] ):
+                    key = f'proxy_stats_{scope}_{pid}_{bucket}'
+                    pipe.hincrby( key, 'ok' if ok else 'fail', 1 )
+                    if ok:
+                        pipe.hincrbyfloat( key, 'latency', latency )
+                    pipe.expire( key, self.window * 2 )
+                await pipe.execute()
+
+            if ok:
+                await self.redis.delete( f'proxy_failures_{site}_{pid}' )
+                return
+
+            failures = await self.redis.incr( f'proxy_failures_{site}_{pid}' )
+            await self.redis.expire( f'proxy_failures_{site}_{pid}', self.window )
+            if failures >= self.failures:
+                await self.quarantine( site, pid )
+        except Exception as e:
+            logger.warning( f'ProxyPool: redis failed: {e!r}' )
+
+    #
+
+    async def read( self, site: str, candidates: List[ str ] ) -> Tuple[ set, Dict[ str, Tuple[ int, int, float ] ] ]:
+        pids = [ self.proxyId( x ) for x in candidates ]
+        buckets = [ self.bucket(), self.bucket() - 1 ]
+        async with self.redis.pipeline( transaction=False ) as pipe:
+            pipe.mget( [ f'proxy_quarantine_{scope}_{pid}' for pid in pids for scope in [ '', site ] ] )
+            for pid in pids:
+                for scope in [ '', site ]:
+                    for bucket in buckets:
+                        pipe.hgetall( f'proxy_stats_{scope}_{pid}_{bucket}' )
+            quarantine, *rows = await pipe.execute()
+
+        quarantined = { x for i, x in enumerate( candidates ) if quarantine[ i*2 ] or quarantine[ i*2+1 ] }
+        stats = {}
+        for i, x in enumerate( candidates ):
+            # results on this site weigh more than results elsewhere
+            ok = fail = 0
+            latency = 0.0
+            for j, row in enumerate( rows[ i*4:i*4+4 ] ):
+                factor = 1 if j < 2 else 3
+                ok += int( row.get( 'ok', 0 ) ) * factor
+                fail += int( row.get( 'fail', 0 ) ) * factor
+                latency += float( row.get( 'latency', 0 ) ) * factor
+            stats[ x ] = ( ok, fail, latency )
+        return quarantined, stats
+
+
+    async def quarantine( self, site: str, pid: str ) -> None:
+        strikes = await self.redis.incr( f'proxy_strikes_{site}_{pid}' )
+        await self.redis.expire( f'proxy_strikes_{site}_{pid}', int( self.quarantine_cap * 2 ) )
+        seconds = min( self.quarantine_base * 2 ** ( strikes - 1 ), self.quarantine_cap )
+        await self.redis.setex( f'proxy_quarantine_{site}_{pid}', int( seconds ), 1 )
+        await self.redis.delete( f'proxy_failures_{site}_{pid}' )
+        metrics.PROXY_QUARANTINED.inc()
+        logger.warning( f'ProxyPool: proxy {pid} quarantined for {seconds:.0f}s on "{site or "all sites"}"' )
+
+
+    async def loop( self, instances: Callable[ [], List[ str ] ], probe_url: str, interval: float ) -> None:
+        while True:
+            try:
+                if await self.redis.set( 'proxy_probe_lock', 1, ex=max( int( interval ) - 1, 1 ), nx=True ):
+                    await asyncio.gather( *[ self.probe( x, probe_url ) for x in dict.fromkeys( instances() ) ] )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep( interval )
+
+
+    async def probe( self, proxy: str, probe_url: str ) -> None:
+        started = time.monotonic()
+        try:
+            async with aiohttp.ClientSession( timeout=aiohttp.ClientTimeout( total=self.probe_timeout ) ) as session:
+                async with session.get( probe_url, proxy=proxy, verify_ssl=False ) as response:
+                    ok = response.status < 500
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            ok = False
+        await self.Report( '', proxy, ok, time.monotonic() - started )
+
+
+    def bucket( self ) -> int:
+        return int( time.time() // self.window )
+
+
+    @staticmethod
+    def weight( ok: int, fail: int, latency: float ) -> float:
+        # unknown proxies start at a 50% success rate and one second
+        rate = ( ok + 1 ) / ( ok + fail + 2 )
+        average = ( latency + 1 ) / ( ok + 1 )
+        return rate ** 2 / max( average, 0.05 )
+
+
+    @staticmethod
+    def proxyId( proxy: str ) -> str:
+        # proxy urls may carry credentials, keys and logs only see a digest
+        return hashlib.sha256( proxy.encode( 'utf-8' ) ).hexdigest()[:16]
@@ -0,0 +1,167 @@
+from __future__ import annotations
+import time
+import random
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    def __init__( self, name: str ) -> None:
+        super().__init__( f'Circuit "{name}" is open' )
+        self.name = name
+
+
+class CircuitBreaker:
+    # closed    - calls pass, consecutive failures are counted
+    # open      - calls fail fast for reset_timeout seconds after failure_threshold failures
+    # half-open - a single probe call is let through, its result closes or reopens the circuit
+    CLOSED:    int = 0
+    OPEN:      int = 1
+    HALF_OPEN: int = 2
+
+    name:              str
+    failure_threshold: int
+    reset_timeout:     float
+
+    def __init__( self, name: str, failure_threshold: int = 5, reset_timeout: float = 30 ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state: int = self.CLOSED
+        self._failures: int = 0
+        self._opened_at: float = 0
+        self._probe_at: float = 0
+        metrics.BREAKER_STATE.labels( name ).set( self.CLOSED )
+
+
+    def State( self ) -> int:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.setState( self.HALF_OPEN )
+        return self._state
+
+
+    def Allow( self ) -> bool:
+        state = self.State()
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN:
+            # one probe at a time, a probe that never reported back is replaced after reset_timeout
+            now = time.monotonic()
+            if now - self._probe_at >= self.reset_timeout:
+                self._probe_at = now
+                return True
+        metrics.BREAKER_REJECTED.labels( self.name ).inc()
+        return False
+
+
+    def Success( self ) -> None:
+        self._failures = 0
+        self._probe_at = 0
+        if self._state != self.CLOSED:
+            self.setState( self.CLOSED )
+
+
+    def Failure( self ) -> None:
+        self._failures += 1
+        self._probe_at = 0
+        if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            if self._state != self.OPEN:
+                self.setState( self.OPEN )
+
+    #
+
+    def setState( self, state: int ) -> None:
+        self._state = state
+        metrics.BREAKER_STATE.labels( self.name ).set( state )
+        metrics.BREAKER_TRANSITIONS.labels( self.name, ( 'closed', 'open', 'half_open' )[ state ] ).inc()
+        logger.info(f'Circuit "{self.name}": {("closed", "open", "half-open")[ state ]}')
+
+
+class RetryPolicy:
+    # bounded retries with exponential backoff and full jitter under an overall deadline
+    # transient decides which errors are worth another attempt, the rest are raised at once
+    # timeouts are transient too unless retry_timeouts is off, a call that timed out may
+    # still have taken effect
+    name:     str
+    attempts: int
+    base:     float
+    cap:      float
+    deadline: float | None
+
+    def __init__(
+        self,
+        name: str,
+        attempts: int = 5,
+        base: float = 0.5,
+        cap: float = 5,
+        deadline: float | None = None,
+        transient: Callable[ [ BaseException ], bool ] | None = None,
+        retry_timeouts: bool = True
+    ) -> None:
+        self.name = name
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.deadline = deadline
+        self.transient = transient or ( lambda e: True )
+        self.retry_timeouts = retry_timeouts
+
+
+    def Delay( self, attempt: int ) -> float:
+        return random.uniform( 0, min( self.cap, self.base * ( 2 ** attempt ) ) )
+
+
+    async def Run(
+        self,
+        call: Callable[ [], Awaitable[ Any ] ],
+        breaker: CircuitBreaker | None = None,
+        attempts: int | None = None,
+        deadline: float | None = None,
+        name: str | None = None
+    ) -> Any:
+        name = name or self.name
+        attempts = attempts or self.attempts
+        deadline = deadline or self.deadline
+        expires = time.monotonic() + deadline if deadline else None
+
+        attempt = 0
+        while True:
+            if breaker is not None and not breaker.Allow():
+                raise CircuitOpenError( breaker.name )
+
+            try:
+                if expires is None:
+                    result = await call()
+                else:
+                    async with asyncio.timeout( max( expires - time.monotonic(), 0 ) ):
+                        result = await call()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                transient = ( self.retry_timeouts and isinstance( e, TimeoutError ) ) or self.transient( e )
+                if breaker is not None:
+                    if transient:
+                        breaker.Failure()
+                    else:
+                        # a non transient error is still an answer, the other side is alive
+                        breaker.Success()
+                attempt += 1
+                if not transient:
+                    raise
+                delay = self.Delay( attempt )
+                if attempt >= attempts or ( expires is not None and time.monotonic() + delay >= expires ):
+                    metrics.RETRY_EXHAUSTED.labels( name ).inc()
+                    raise
+                metrics.RETRY_ATTEMPTS.labels( name ).inc()
+                logger.warning(f'Retry "{name}": attempt {attempt} failed with {e!r}, next in {delay:.2f}s')
+                await asyncio.sleep( delay )
+                continue
+
+            if breaker is not None:
+                breaker.Success()
+            return result
@@ -0,0 +1,132 @@
+from __future__ import annotations
+import time
+import asyncio
+import logging
+import traceback
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+StatKey = Tuple[ int, str, date ]
+StatsWriter = Callable[ [ List[ Dict[ str, Any ] ] ], Awaitable[ None ] ]
+StatsRetryable = Callable[ [ BaseException ], bool ]
+
+STAT_FIELDS = ( 'success', 'failure', 'orig_size', 'oper_size' )
+
+class StatsBuffer:
+    # write-behind buffer for users_stats, deltas are merged per (user_id, site, day)
+    # and handed to the writer as one batch every interval seconds or once size rows are pending
+    # a batch that failed before reaching the database (retryable) is merged back and written
+    # on the next flush, any other failure may have been committed and the batch is dropped,
+    # the deltas are additive and writing them twice would count them twice
+    interval: float = 1.0
+    size:     int = 500
+
+    def __init__( self, writer: StatsWriter, retryable: StatsRetryable | None = None ) -> None:
+        self.writer = writer
+        self.retryable = retryable or ( lambda e: True )
+        self._pending: Dict[ StatKey, Dict[ str, int ] ] = {}
+        self._flushing: Dict[ StatKey, Dict[ str, int ] ] = {}
+        self._full: asyncio.Event = asyncio.Event()
+        self._lock: asyncio.Lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+
+    async def Start( self, interval: float = 1.0, size: int = 500 ) -> None:
+        if self._task:
+            return
+        self.interval = interval
+        self.size = size
+        self._task = asyncio.create_task( self.loop() )
+        logger.info(f'Stats: flushing every {interval}s or {size} rows')
+
+
+    async def Stop( self ) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather( self._task, return_exceptions=True )
+            self._task = None
+        await self.Flush()
+        if self._pending:
+            logger.warning(f'Stats: {len(self._pending)} rows left unwritten on shutdown')
+
+
+    def Add(
+        self,
+        user_id: int,
+        site: str,
+        day: date,
+        success: int = 0,
+        failure: int = 0,
+        orig_size: int = 0,
+        oper_size: int = 0
+    ) -> None:
+        self.merge( self._pending, ( user_id, site, day ), {
+            'success':   success,
+            'failure':   failure,
+            'orig_size': orig_size,
+            'oper_size': oper_size,
+        } )
+        metrics.STATS_PENDING.set( len( self._pending ) )
+        if len( self._pending ) >= self.size:
+            self._full.set()
+
+
+    def Pending( self, user_id: int, day: date ) -> int:
+        # downloads of a user that are buffered or being written, not yet visible in the database
+        total = 0
+        for rows in ( self._pending, self._flushing ):
+            for ( _user_id, _, _day ), deltas in rows.items():
+                if _user_id == user_id and _day == day:
+                    total += deltas['success'] + deltas['failure']
+        return total
+
+
+    async def Flush( self ) -> None:
+        async with self._lock:
+            if not self._pending:
+                return
+            self._flushing, self._pending = self._pending, {}
+            metrics.STATS_PENDING.set( 0 )
+
+            rows = [ { 'user_id': user_id, 'site': site, 'day': day, **deltas } for ( user_id, site, day ), deltas in self._flushing.items() ]
+            started = time.monotonic()
+            try:
+                await self.writer( rows )
+                metrics.STATS_FLUSH_BATCH.observe( len( rows ) )
+                metrics.STATS_FLUSH_LATENCY.observe( time.monotonic() - started )
+            except Exception as e:
+                traceback.print_exc()
+                if not self.retryable( e ):
+                    metrics.STATS_FLUSH_DROPPED.inc( len( rows ) )
+                    logger.error(f'Stats: {len(rows)} rows dropped, the failed flush may have been written')
+                    return
+                metrics.STATS_FLUSH_FAILED.inc()
+                for key, deltas in self._flushing.items():
+                    self.merge( self._pending, key, deltas )
+                metrics.STATS_PENDING.set( len( self._pending ) )
+            finally:
+                self._flushing = {}
+
+    #
+
+    async def loop( self ) -> None:
+        while True:
+            try:
+                await asyncio.wait_for( self._full.wait(), self.interval )
+            except TimeoutError:
+                pass
+            self._full.clear()
+            await self.Flush()
+
+
+    @staticmethod
+    def merge( rows: Dict[ StatKey, Dict[ str, int ] ], key: StatKey, deltas: Dict[ str, int ] ) -> None:
+        current = rows.get( key )
+        if current is None:
+            rows[ key ] = dict( deltas )
+            return
+        for field in STAT_FIELDS:
+            current[ field ] += deltas[ field ]
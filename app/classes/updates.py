@@ -0,0 +1,155 @@
+from __future__ import annotations
+import time
+import asyncio
+import logging
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Set, Tuple
+from aiogram import Bot, Dispatcher, types
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# raw webhook payloads or updates already parsed by getUpdates
+IncomingUpdate = Dict[ str, Any ] | types.Update
+QueuedUpdate = Tuple[ float, IncomingUpdate ]
+
+class UpdatesPipeline:
+    # bounded ingestion stage between telegram and the dispatcher
+    # updates of one chat are processed strictly in order, different chats run in parallel
+    queue_size: int = 1000
+    overload:   str = 'retry'
+
+    def __init__( self, dispatcher: Dispatcher, bot: Bot ) -> None:
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self._size: int = 0
+        self._closing: bool = False
+        self._pending: Dict[ Any, Deque[ QueuedUpdate ] ] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._workers: List[ asyncio.Task ] = []
+        # ids of updates taken in but not processed yet, queued or in flight
+        self._unfinished: Set[ int ] = set()
+
+
+    async def Start( self, workers: int = 16, queue_size: int = 1000, overload: str = 'retry' ) -> None:
+        if self._workers:
+            return
+        self.queue_size = queue_size
+        self.overload = overload
+        self._closing = False
+        self._unfinished.clear()
+        self._workers = [ asyncio.create_task( self.worker() ) for _ in range( workers ) ]
+        logger.info(f'Updates: started {workers} workers, queue {queue_size}, overload policy "{overload}"')
+
+
+    async def Stop( self, timeout: float = 10 ) -> None:
+        if not self._workers:
+            return
+        self._closing = True
+        try:
+            await asyncio.wait_for( self._ready.join(), timeout )
+        except TimeoutError:
+            logger.warning(f'Updates: {len( self._unfinished )} updates left unprocessed on shutdown')
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather( *self._workers, return_exceptions=True )
+        self._workers = []
+        logger.info('Updates: finished')
+
+
+    def Put( self, update: IncomingUpdate ) -> bool:
+        if self._closing or self._size >= self.queue_size:
+            metrics.UPDATES_REJECTED.labels( self.overload ).inc()
+            return False
+
+        key = self.chatKey( update )
+        chat_queue = self._pending.get( key )
+        if chat_queue is None:
+            chat_queue = deque()
+            self._pending[ key ] = chat_queue
+            self._ready.put_nowait( key )
+        chat_queue.append( ( time.monotonic(), update ) )
+        self._unfinished.add( self.updateId( update ) )
+
+        self._size += 1
+        metrics.UPDATES_QUEUE_DEPTH.set( self._size )
+        return True
+
+
+    def Depth( self ) -> int:
+        return self._size
+
+
+    def Unfinished( self ) -> List[ int ]:
+        return sorted( self._unfinished )
+
+    #
+
+    async def worker( self ) -> None:
+        while True:
+            key = await self._ready.get()
+            chat_queue = self._pending[ key ]
+            queued_at, update = chat_queue.popleft()
+
+            self._size -= 1
+            metrics.UPDATES_QUEUE_DEPTH.set( self._size )
+            metrics.UPDATES_WAIT.observe( time.monotonic() - queued_at )
+
+            metrics.UPDATES_IN_FLIGHT.inc()
+            started = time.monotonic()
+            try:
+                if isinstance( update, types.Update ):
+                    await self.dispatcher.feed_update( bot=self.bot, update=update )
+                else:
+                    await self.dispatcher.feed_raw_update( bot=self.bot, update=update )
+                self._unfinished.discard( self.updateId( update ) )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # a failed update was still handled, it is not delivered again
+                self._unfinished.discard( self.updateId( update ) )
+                metrics.UPDATES_FAILED.inc()
+                traceback.print_exc()
+            finally:
+                metrics.UPDATES_IN_FLIGHT.dec()
+                metrics.UPDATES_LATENCY.observe( time.monotonic() - started )
+                # the chat is handed back only after its update is done, so its next update waits
+                if chat_queue:
+                    self._ready.put_nowait( key )
+                else:
+                    del self._pending[ key ]
+                self._ready.task_done()
+
+
+    @staticmethod
+    def updateId( update: IncomingUpdate ) -> int:
+        if isinstance( update, types.Update ):
+            return update.update_id
+        return update.get( 'update_id', 0 )
+
+
+    @staticmethod
+    def chatKey( update: IncomingUpdate ) -> Any:
+        if isinstance( update, types.Update ):
+            try:
+                event = update.event
+            except LookupError:
+                return update.update_id
+            chat = getattr( event, 'chat', None ) or getattr( getattr( event, 'message', None ), 'chat', None )
+            if chat:
+                return chat.id
+            user = getattr( event, 'from_user', None ) or getattr( event, 'user', None )
+            if user:
+                return user.id
+            return update.update_id
+        for name, event in update.items():
+            if name == 'update_id' or not isinstance( event, dict ):
+                continue
+            chat = event.get( 'chat' ) or ( event.get( 'message' ) or {} ).get( 'chat' )
+            if chat and 'id' in chat:
+                return chat['id']
+            user = event.get( 'from' ) or event.get( 'user' )
+            if user and 'id' in user:
+                return user['id']
+        return update.get( 'update_id' )
@@ -0,0 +1,87 @@
+from __future__ import annotations
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Dict
+from redis.asyncio import Redis
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# counters only grow during a day, so increments never create a key (the first read seeds it
+# from the database) and reconciliation only ever raises a counter
+INCR_IF_EXISTS = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCRBY', KEYS[1], ARGV[1])
+end
+return nil
+"""
+
+SET_IF_GREATER = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '-1')
+if tonumber(ARGV[1]) > current then
+    redis.call('SET', KEYS[1], ARGV[1], 'EXAT', ARGV[2])
+end
+return nil
+"""
+
+class UsageCounter:
+    # per-user daily downloads counter in redis, expires the day after
+    redis: Redis
+
+    def __init__( self, redis: Redis ) -> None:
+        self.redis = redis
+        self._incr = redis.register_script( INCR_IF_EXISTS )
+        self._raise = redis.register_script( SET_IF_GREATER )
+
+
+    async def Get( self, user_id: int ) -> int | None:
+        try:
+            cached = await self.redis.get( self.key( user_id ) )
+        except Exception as e:
+            logger.warning( f'Usage: redis get failed: {e!r}' )
+            cached = None
+        if cached is None:
+            metrics.USAGE_LOOKUPS.labels( 'miss' ).inc()
+            return None
+        metrics.USAGE_LOOKUPS.labels( 'hit' ).inc()
+        return int( cached )
+
+
+    async def Seed( self, user_id: int, value: int ) -> None:
+        try:
+            await self.redis.set( self.key( user_id ), value, nx=True, exat=self.expireAt() )
+        except Exception as e:
+            logger.warning( f'Usage: redis seed failed: {e!r}' )
+
+
+    async def Incr( self, user_id: int, amount: int = 1 ) -> None:
+        if amount <= 0:
+            return
+        try:
+            await self._incr( keys=[ self.key( user_id ) ], args=[ amount ] )
+        except Exception as e:
+            logger.warning( f'Usage: redis incr failed: {e!r}' )
+
+
+    async def Reconcile( self, totals: Dict[ int, int ], batch: int = 500 ) -> None:
+        expire_at = self.expireAt()
+        users = list( totals.items() )
+        for i in range( 0, len( users ), batch ):
+            async with self.redis.pipeline( transaction=False ) as pipe:
+                for user_id, total in users[ i:i+batch ]:
+                    await self._raise( keys=[ self.key( user_id ) ], args=[ total, expire_at ], client=pipe )
+                await pipe.execute()
+
+    #
+
+    @staticmethod
+    def today() -> date:
+        return datetime.today().date()
+
+
+    def key( self, user_id: int ) -> str:
+        return f'usage_{self.today().isoformat()}_{user_id}'
+
+
+    def expireAt( self ) -> int:
+        return int( datetime.combine( self.today() + timedelta( days=1 ), time( hour=1 ) ).timestamp() )
@@ -57,6 +57,9 @@ class DownloadRequest(BaseModel):
 
 class DownloadCancelRequest(BaseModel):
     task_id:    int
+    chat_id:    int | None = None
+    message_id: int | None = None
+    force:      bool = False
 
 class DownloadClearRequest(BaseModel):
     task_id:    int
@@ -6,7 +6,8 @@ from aiogram import Router, F, types
 from aiogram.filters import Command, StateFilter
 from cryptography.fernet import Fernet
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from starlette.staticfiles import StaticFiles
 from starlette.templating import Jinja2Templates
 
@@ -24,11 +25,14 @@ from .misc import MiscController
 
 from app import tools
 from app import dto
+from app import metrics
 from app import tools
 from app import variables
 from app.configs import GC
-from app.objects import BOT, DP
+from app.objects import BOT, DP, UP, PL
 from app.classes.interconnect import Interconnect
+from app.classes.monitoring import HandlerMetricsMiddleware
+from app.classes.debounce import StatusDebouncer
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +48,8 @@ async def register_bot_handlers() -> None:
     await AdminController.SetBotMenu()
 
     router = Router()
+    router.message.middleware( HandlerMetricsMiddleware() )
+    router.callback_query.middleware( HandlerMetricsMiddleware() )
 
 
     # Global settings
@@ -121,6 +127,8 @@ async def register_bot_handlers() -> None:
     router.message.register(        AdminController.CancelTasks, Command( 'admin_cancel_batch' ) )
     router.message.register(        AdminController.ReloadDownloadCenter, Command( 'admin_reload_dc' ) )
     router.message.register(        AdminController.ReloadBot, Command( 'admin_reload_bot' ) )
+    router.message.register(        AdminController.ToggleWatchdog, Command( 'admin_watchdog' ) )
+    router.message.register(        AdminController.CacheStats, Command( 'admin_caches' ) )
     router.message.register(        AdminController.StopTasks, Command( 'admin_stop_tasks' ) )
     router.message.register(        AdminController.StartTasks, Command( 'admin_start_tasks' ) )
     router.message.register(        AdminController.StopResults, Command( 'admin_stop_results' ) )
@@ -225,8 +233,12 @@ async def register_web_part( app: FastAPI ) -> None:
 
     @app.post('/')
     async def bot_handle( update: dict ) -> None:
-        asyncio.create_task( DP.feed_raw_update( bot=BOT, update=update ) )
-        await asyncio.sleep( 0 )
+        if not UP.Put( update ) and UP.overload == 'retry':
+            return JSONResponse(
+                status_code = 503,
+                content = None,
+                headers = { 'Retry-After': '1' }
+            )
         return ''
 
 
@@ -258,21 +270,45 @@ async def register_api_handlers( app: FastAPI ) -> None:
             }
         )
 
+    @app.get('/metrics')
+    async def render_metrics() -> Response:
+        return Response(
+            content = generate_latest(),
+            media_type = CONTENT_TYPE_LATEST
+        )
+
+    status_debouncer = StatusDebouncer( DownloadsController.DownloadStatus, interval=GC.status_interval )
+    GC.Subscribe( lambda snapshot: setattr( status_debouncer, 'interval', snapshot.status_interval ) )
+
     @app.post('/download/status')
     async def download_status( status: dto.DownloadStatus ) -> bool:
+        statuses = await Interconnect.inflight.Statuses( status )
+        done = await asyncio.gather( *[ status_debouncer.Push( x ) for x in statuses ], return_exceptions=True )
+        metrics.DOWNLOADS_FANNED_OUT.labels( 'status' ).inc( max( len( statuses ) - 1, 0 ) )
         return JSONResponse(
-            status_code = 200 if await DownloadsController.DownloadStatus( status=status ) else 500,
+            status_code = 200 if not done or any( x is True for x in done ) else 500,
             content = None
         )
 
     @app.post('/download/done')
     async def download_done( result: dto.DownloadResult ) -> bool:
+        results = await Interconnect.inflight.Results( result )
+        if len( results ) <= 1:
+            ok = await DownloadsController.DownloadDone( result=results[0] ) if results else True
+        else:
+            # the first copy uploads the files, the uploads of the others are replaced
+            # by the file_ids it left on the bot session (Delivery)
+            async with Interconnect.HoldDownloadFiles( result.task_id ):
+                first = await DownloadsController.DownloadDone( result=results[0] )
+                done = await asyncio.gather( *[ DownloadsController.DownloadDone( result=x ) for x in results[1:] ], return_exceptions=True )
+            metrics.DOWNLOADS_FANNED_OUT.labels( 'result' ).inc( len( results ) - 1 )
+            ok = first is True or any( x is True for x in done )
         return JSONResponse(
-            status_code = 200 if await DownloadsController.DownloadDone( result=result ) else 500,
+            status_code = 200 if ok else 500,
             content = None
         )
 
 
 async def register_poller_part() -> None:
     logger.info('Running in polling mode')
-    await DP.start_polling( BOT, polling_timeout=5, handle_signals=False )
\ No newline at end of file
+    await PL.Start()
\ No newline at end of file
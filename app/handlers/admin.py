@@ -7,8 +7,9 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.exceptions import TelegramRetryAfter, TelegramMigrateToChat, TelegramBadRequest, TelegramNotFound, TelegramConflictError, TelegramUnauthorizedError, TelegramForbiddenError, TelegramServerError, RestartingTelegram, TelegramAPIError, TelegramEntityTooLarge, ClientDecodeError
 from app import dto, variables
 from app.configs import GC
-from app.objects import BOT, RD
+from app.objects import DB, BOT, RD, LM, KB
 from app.classes.interconnect import Interconnect
+from app.classes.outbound import bulk
 
 logger = logging.getLogger( __name__ )
 
@@ -31,6 +32,8 @@ class AdminController:
 
         commands.append( types.BotCommand( command='admin_reload_dc', description='Перезагрузка конфигурации DC' ) )
         commands.append( types.BotCommand( command='admin_reload_bot', description='Перезагрузка конфигурации бота' ) )
+        commands.append( types.BotCommand( command='admin_watchdog', description='Вкл/выкл контроль задержек' ) )
+        commands.append( types.BotCommand( command='admin_caches', description='Попадания в кэш' ) )
         commands.append( types.BotCommand( command='admin_queue', description='Очередь' ) )
         commands.append( types.BotCommand( command='admin_stop_tasks', description='Стоп очереди тасков' ) )
         commands.append( types.BotCommand( command='admin_start_tasks', description='Старт очереди тасков' ) )
@@ -58,7 +61,8 @@ class AdminController:
             return
 
         request = dto.DownloadCancelRequest(
-            task_id = task_id
+            task_id = task_id,
+            force = True
         )
 
         result = await Interconnect.CancelDownload( request )
@@ -85,22 +89,24 @@ class AdminController:
         if not tasks_ids:
             return
 
-        for task_id in tasks_ids:
-            request = dto.DownloadCancelRequest(
-                task_id = int( task_id )
-            )
-
-            result = await Interconnect.CancelDownload( request )
-            if type(result) == str:
-                try:
-                    await BOT.send_message( chat_id=message.chat.id, text=str(result) )
-                except:
-                    pass
-            else:
-                try:
-                    await BOT.delete_message( chat_id=result.chat_id, message_id=result.message_id )
-                except:
-                    pass
+        with bulk():
+            for task_id in tasks_ids:
+                request = dto.DownloadCancelRequest(
+                    task_id = int( task_id ),
+                    force = True
+                )
+
+                result = await Interconnect.CancelDownload( request )
+                if type(result) == str:
+                    try:
+                        await BOT.send_message( chat_id=message.chat.id, text=str(result) )
+                    except:
+                        pass
+                else:
+                    try:
+                        await BOT.delete_message( chat_id=result.chat_id, message_id=result.message_id )
+                    except:
+                        pass
         try:
             await BOT.delete_message( chat_id=message.chat.id, message_id=message.message_id )
         except:
@@ -117,8 +123,8 @@ class AdminController:
 
         await AdminController.SetBotMenu()
 
-        await RD.delete(variables.ACTIVE_SITES_CACHE_KEY)
-        await RD.delete(variables.AUTH_SITES_CACHE_KEY)
+        await Interconnect.caches.Publish()
+        KB.Clear()
 
 
     @staticmethod
@@ -127,12 +133,47 @@ class AdminController:
         if message.from_user.id not in GC.admins:
             return await BOT.send_message( chat_id=message.chat.id, text="Недостаточно прав" )
 
-        await RD.delete(variables.ACTIVE_SITES_CACHE_KEY)
-        await RD.delete(variables.AUTH_SITES_CACHE_KEY)
+        await Interconnect.caches.Publish()
+        await DB.ResetCaches()
+        KB.Clear()
 
         await AdminController.SetBotMenu()
 
 
+    @staticmethod
+    async def CacheStats( message: types.Message ) -> None:
+
+        if message.from_user.id not in GC.admins:
+            return await BOT.send_message( chat_id=message.chat.id, text="Недостаточно прав" )
+
+        lines = []
+        for name, ratio in Interconnect.caches.Ratios().items():
+            lines.append( f'{name}: ' + ( f'{ratio*100:.1f}%' if ratio is not None else 'нет запросов' ) )
+        if Interconnect.caches.Degraded():
+            lines.append( 'Сервер загрузки недоступен, отдаются последние данные' )
+
+        await BOT.send_message( chat_id=message.chat.id, text='Попадания в кэш:\n' + '\n'.join( lines ) )
+
+
+    @staticmethod
+    async def ToggleWatchdog( message: types.Message ) -> None:
+
+        if message.from_user.id not in GC.admins:
+            return await BOT.send_message( chat_id=message.chat.id, text="Недостаточно прав" )
+
+        if LM.Enabled():
+            LM.StopWatchdog()
+            text = 'Контроль задержек выключен'
+        else:
+            LM.StartWatchdog( GC.watchdog_threshold )
+            text = f'Контроль задержек включен, порог {GC.watchdog_threshold} с'
+        percentiles = LM.Percentiles()
+        if percentiles:
+            text += '\n' + '\n'.join( [ f'p{float(q)*100:g}: {v*1000:.1f} мс' for q, v in percentiles.items() ] )
+
+        await BOT.send_message( chat_id=message.chat.id, text=text )
+
+
     @staticmethod
     async def LeaveChat( message: types.Message ) -> None:
 
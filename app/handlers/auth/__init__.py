@@ -1,11 +1,10 @@
-import idna
 import logging
 from aiogram import types
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from app import variables
 from app.configs import GC
-from app.objects import DB, RD, BOT
+from app.objects import DB, RD, BOT, KB
 from app.tools import stateChecker, punyDecode
 from app.classes.interconnect import Interconnect
 from app.handlers.auth.inline import InlineAuthController
@@ -30,14 +29,15 @@ class AuthController:
         sites_with_auth = await Interconnect.GetSitesWithAuth()
 
         if len( sites_with_auth ) > 0:
-            builder = InlineKeyboardBuilder()
 
-            for site in sites_with_auth:
-                builder.button( text=punyDecode( site ), callback_data=f"auth:{site}" )
+            def build() -> types.InlineKeyboardMarkup:
+                builder = InlineKeyboardBuilder()
+                for site in sites_with_auth:
+                    builder.button( text=punyDecode( site ), callback_data=f"auth:{site}" )
+                builder.adjust( 1, repeat=True )
+                return builder.as_markup()
 
-            builder.adjust( 1, repeat=True )
-
-            msg = await BOT.send_message( chat_id=message.chat.id, text="Выберите сайт", reply_markup=builder.as_markup() )
+            msg = await BOT.send_message( chat_id=message.chat.id, text="Выберите сайт", reply_markup=KB.Get( 'auth', tuple( sites_with_auth ), build ) )
             await state.update_data( base_message=msg.message_id )
         else:
             await state.clear()
@@ -1,5 +1,4 @@
 import logging
-import idna
 from typing import Any
 from aiogram import Dispatcher, Router, F, types
 from aiogram.filters import Command
@@ -8,6 +7,7 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from app import variables, dto, models
 from app.configs import GC
 from app.objects import DB, RD, BOT
+from app.tools import idnaDecode
 
 logger = logging.getLogger( __name__ )
 
@@ -32,7 +32,7 @@ class ExistentAuthController:
             builder = InlineKeyboardBuilder()
 
             for site in sites:
-                builder.button( text=idna.decode(site), callback_data=f"eac:{site}" )
+                builder.button( text=idnaDecode(site), callback_data=f"eac:{site}" )
 
             builder.adjust( 1, repeat=True )
 
@@ -84,7 +84,7 @@ class ExistentAuthController:
             builder = InlineKeyboardBuilder()
 
             for site in sites:
-                builder.button( text=idna.decode(site), callback_data=f"eac:{site}" )
+                builder.button( text=idnaDecode(site), callback_data=f"eac:{site}" )
 
             builder.adjust( 1, repeat=True )
 
@@ -1,4 +1,3 @@
-import idna
 import ujson
 import aiohttp
 import logging
@@ -8,8 +7,9 @@ from aiogram import Dispatcher, Router, F, types
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from app import models, variables, dto
+from app.tools import idnaDecode
 from app.configs import GC
-from app.objects import DB, RD, BOT
+from app.objects import DB, RD, BOT, KB
 from app.classes.interconnect import Interconnect
 
 logger = logging.getLogger( __name__ )
@@ -20,13 +20,25 @@ class MiscController:
     async def ShowAllowedSites( message: types.Message ) -> None:
         try:
             groups = await Interconnect.GetSitesActiveGrouped()
+            degraded = Interconnect.grouped_sites_cache.Degraded( '' )
 
-            text = 'Список поддерживаемых сайтов:'
+            if not groups and degraded:
+                await BOT.send_message( chat_id=message.chat.id, text="Сервер загрузки временно недоступен, попробуйте позже", reply_markup=None )
+                return
 
-            for group, sites_list in groups.items():
-                name = GC.groups[ group ] if group in GC.groups else group
-                sites = '\n'.join( [ idna.decode(x) for x in sites_list ] )
-                text += f'\n\n<b>{name}</b>:\n\n{sites}'
+            def build() -> str:
+                text = 'Список поддерживаемых сайтов:'
+                if degraded:
+                    text += '\n<i>Сервер загрузки сейчас недоступен, список может быть устаревшим</i>'
+
+                for group, sites_list in groups.items():
+                    name = GC.groups[ group ] if group in GC.groups else group
+                    sites = '\n'.join( [ idnaDecode(x) for x in sites_list ] )
+                    text += f'\n\n<b>{name}</b>:\n\n{sites}'
+                return text
+
+            inputs = ( tuple( ( group, tuple( sites_list ) ) for group, sites_list in groups.items() ), degraded )
+            text = KB.Get( 'sites', inputs, build )
 
             await BOT.send_message( chat_id=message.chat.id, text=text, parse_mode="HTML", reply_markup=None )
         except ClientError as e:
@@ -7,7 +7,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from app import models, variables
 from app.configs import GC
-from app.objects import DB, RD, BOT
+from app.objects import DB, RD, BOT, KB
 from app.tools import cleanFilename
 
 logger = logging.getLogger( __name__ )
@@ -67,17 +67,19 @@ class AccountSetupController:
 
         text = "Что настроим?"
 
-        builder = InlineKeyboardBuilder()
-        builder.button( text="Режим взаимодействия", callback_data="setup_global:mode" )
-        builder.button( text="Формат", callback_data="setup_global:format" )
-        builder.button( text="Обложка", callback_data="setup_global:cover" )
-        builder.button( text="Превью", callback_data="setup_global:thumb" )
-        builder.button( text="Изображения", callback_data="setup_global:images" )
-        builder.button( text="Хэштэги", callback_data="setup_global:hashtags" )
-        builder.button( text="Название файла", callback_data="setup_global:filename" )
-        builder.adjust(1, repeat=True)
-
-        await BOT.send_message( chat_id=message.chat.id, text=text, reply_markup=builder.as_markup() )
+        def build() -> types.InlineKeyboardMarkup:
+            builder = InlineKeyboardBuilder()
+            builder.button( text="Режим взаимодействия", callback_data="setup_global:mode" )
+            builder.button( text="Формат", callback_data="setup_global:format" )
+            builder.button( text="Обложка", callback_data="setup_global:cover" )
+            builder.button( text="Превью", callback_data="setup_global:thumb" )
+            builder.button( text="Изображения", callback_data="setup_global:images" )
+            builder.button( text="Хэштэги", callback_data="setup_global:hashtags" )
+            builder.button( text="Название файла", callback_data="setup_global:filename" )
+            builder.adjust(1, repeat=True)
+            return builder.as_markup()
+
+        await BOT.send_message( chat_id=message.chat.id, text=text, reply_markup=KB.Get( 'setup_global', None, build ) )
 
 
     # callbacks
@@ -1,4 +1,3 @@
-import idna
 import logging
 import asyncio
 from aiogram import types
@@ -6,8 +5,8 @@ from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from app import models, variables
 from app.configs import GC
-from app.objects import DB, RD, BOT
-from app.tools import yesOrNo
+from app.objects import DB, RD, BOT, KB
+from app.tools import yesOrNo, idnaDecode
 from app.tools import cleanFilename
 from app.classes.interconnect import Interconnect
 
@@ -20,14 +19,14 @@ class SitesSetupController:
         
         sites_list = await Interconnect.GetSitesActive()
 
-        builder = InlineKeyboardBuilder()
-
-        for site in sites_list:
-            builder.button( text=idna.decode(site), callback_data=f"setup_sites:select_site:{site}" )
-
-        builder.adjust( 1, repeat=True )
+        def build() -> types.InlineKeyboardMarkup:
+            builder = InlineKeyboardBuilder()
+            for site in sites_list:
+                builder.button( text=idnaDecode(site), callback_data=f"setup_sites:select_site:{site}" )
+            builder.adjust( 1, repeat=True )
+            return builder.as_markup()
 
-        await BOT.send_message( chat_id=message.chat.id, text="Выберите сайт", reply_markup=builder.as_markup() )
+        await BOT.send_message( chat_id=message.chat.id, text="Выберите сайт", reply_markup=KB.Get( 'setup_sites', tuple( sites_list ), build ) )
 
 
     @staticmethod
@@ -56,7 +55,7 @@ class SitesSetupController:
         site = callback_query.data.split('setup_sites:reset:')[1]
 
         try:
-            await asyncio.wait_for( DB.deleteSiteConfig( callback_query.from_user.id, site ), 5 )
+            await asyncio.wait_for( DB.DeleteSiteConfig( callback_query.from_user.id, site ), 5 )
         except TimeoutError as e:
             return await BOT.send_message( chat_id=callback_query.message.chat.id, text="Ошибка соединения с БД. Попробуйте позднее" )
 
@@ -10,7 +10,9 @@ if not os.environ.get("BOT_TOKEN"):
     raise Exception('provide BOT_TOKEN in env')
 
 from app.configs import GC
-from app.objects import DB, BOT
+from app.variables import GlobalConfigSnapshot
+from app.objects import DB, BOT, UP, PL, LM, PX, KB
+from app.classes.interconnect import Interconnect
 from app.handlers import register_bot_handlers, register_api_handlers, register_web_part, register_poller_part
 
 
@@ -48,12 +50,68 @@ async def read_config():
     await GC.UpdateConfig()
     await DB.UpdateConfig()
 
+def config_reloaded( snapshot: GlobalConfigSnapshot ) -> None:
+    # menus built from global.json are rebuilt and the settings running services read
+    # are applied, those marked (restart) in GlobalConfigSnapshot wait for a restart
+    KB.Clear()
+    UP.queue_size = snapshot.updates_queue
+    UP.overload = snapshot.updates_overload
+    LM.threshold = snapshot.watchdog_threshold
+
+async def config_start() -> None:
+    GC.Subscribe( config_reloaded )
+    await GC.Watch()
+
+async def config_stop() -> None:
+    await GC.Unwatch()
+
+async def monitoring_start() -> None:
+    # loop lag is always sampled for /metrics, watchdog_enabled only switches the stall reports
+    await LM.Start( threshold=GC.watchdog_threshold, watchdog=GC.watchdog_enabled )
+
+async def monitoring_stop() -> None:
+    await LM.Stop()
+
 async def db_start() -> None:
     await DB.Start()
 
 async def db_stop() -> None:
     await DB.Stop()
 
+async def interconnect_start() -> None:
+    await Interconnect.Start()
+
+async def interconnect_stop() -> None:
+    await Interconnect.Stop()
+
+async def interconnect_warmup() -> None:
+    # a slow or unavailable queue delays startup by warmup_timeout at most
+    if not GC.warmup_timeout:
+        return
+    try:
+        async with asyncio.timeout( GC.warmup_timeout ):
+            await Interconnect.WarmUp()
+    except TimeoutError:
+        logger.warning(f'Interconnect: warm-up did not finish in {GC.warmup_timeout}s, continuing cold')
+    except Exception as e:
+        logger.warning(f'Interconnect: warm-up failed with {e!r}, continuing cold')
+
+async def proxies_start() -> None:
+    await PX.Start( lambda: GC.proxies.instances, GC.proxy_probe_url, interval=GC.proxy_probe_interval )
+
+async def proxies_stop() -> None:
+    await PX.Stop()
+
+async def updates_start() -> None:
+    await UP.Start( workers=GC.updates_workers, queue_size=GC.updates_queue, overload=GC.updates_overload )
+
+async def updates_stop() -> None:
+    await UP.Stop()
+
+async def poller_stop() -> None:
+    # drains the updates pipeline itself before confirming the polling offset
+    await PL.Stop()
+
 async def bot_start() -> None:
     if BOT and GC.url:
         await BOT.set_webhook( GC.url, drop_pending_updates=False )
@@ -68,12 +126,24 @@ async def bot_stop() -> None:
 @asynccontextmanager
 async def lifespan( app: FastAPI ):
     await read_config()
+    await config_start()
+    await monitoring_start()
     await db_start()
+    await interconnect_start()
+    await proxies_start()
+    await updates_start()
+    await interconnect_warmup()
     await bot_start()
     await init(app)
     yield
+    await poller_stop()
+    await updates_stop()
     await bot_stop()
+    await proxies_stop()
+    await interconnect_stop()
     await db_stop()
+    await monitoring_stop()
+    await config_stop()
 
 app = FastAPI( 
     docs_url=None,
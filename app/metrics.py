@@ -0,0 +1,88 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# webhook / polling updates pipeline
+
+UPDATES_QUEUE_DEPTH = Gauge( 'bot_updates_queue_depth', 'Updates waiting for a worker' )
+UPDATES_IN_FLIGHT = Gauge( 'bot_updates_in_flight', 'Updates being processed by workers' )
+UPDATES_WAIT = Histogram( 'bot_updates_wait_seconds', 'Time an update spent queued before processing' )
+UPDATES_LATENCY = Histogram( 'bot_updates_processing_seconds', 'Time spent processing an update' )
+UPDATES_REJECTED = Counter( 'bot_updates_rejected_total', 'Updates rejected by the overload policy', [ 'policy' ] )
+UPDATES_FAILED = Counter( 'bot_updates_failed_total', 'Updates whose processing raised' )
+
+# database entity cache
+
+DB_CACHE_HITS = Counter( 'bot_db_cache_hits_total', 'Entity cache hits', [ 'entity', 'tier' ] )
+DB_CACHE_MISSES = Counter( 'bot_db_cache_misses_total', 'Entity cache misses', [ 'entity' ] )
+
+# daily usage counters
+
+USAGE_LOOKUPS = Counter( 'bot_usage_counter_lookups_total', 'Daily usage counter lookups', [ 'result' ] )
+
+# users_stats write-behind buffer
+
+STATS_PENDING = Gauge( 'bot_stats_pending_rows', 'Merged users_stats rows waiting to be written' )
+STATS_FLUSH_BATCH = Histogram( 'bot_stats_flush_batch_rows', 'Rows written per users_stats flush', buckets=( 1, 5, 10, 25, 50, 100, 250, 500, 1000 ) )
+STATS_FLUSH_LATENCY = Histogram( 'bot_stats_flush_seconds', 'Time spent writing one users_stats batch' )
+STATS_FLUSH_FAILED = Counter( 'bot_stats_flush_failed_total', 'users_stats flushes that failed and were requeued' )
+STATS_FLUSH_DROPPED = Counter( 'bot_stats_flush_dropped_rows_total', 'users_stats rows dropped after a flush that may have been written' )
+
+# circuit breakers and retries
+
+BREAKER_STATE = Gauge( 'bot_breaker_state', 'Circuit breaker state: 0 closed, 1 open, 2 half-open', [ 'breaker' ] )
+BREAKER_TRANSITIONS = Counter( 'bot_breaker_transitions_total', 'Circuit breaker state changes', [ 'breaker', 'state' ] )
+BREAKER_REJECTED = Counter( 'bot_breaker_rejected_total', 'Calls failed fast by an open circuit', [ 'breaker' ] )
+RETRY_ATTEMPTS = Counter( 'bot_retry_attempts_total', 'Retried calls', [ 'operation' ] )
+RETRY_EXHAUSTED = Counter( 'bot_retry_exhausted_total', 'Calls that failed after all retries or the deadline', [ 'operation' ] )
+
+# hot paths
+
+HANDLER_LATENCY = Histogram( 'bot_handler_seconds', 'Router callback latency', [ 'handler', 'status' ] )
+DB_QUERY_LATENCY = Histogram( 'bot_db_query_seconds', 'DataBase method latency including retries', [ 'method', 'status' ] )
+INTERCONNECT_LATENCY = Histogram( 'bot_interconnect_request_seconds', 'Queue service request latency including retries', [ 'endpoint', 'status' ] )
+CACHE_REQUESTS = Counter( 'bot_cache_requests_total', 'Cache lookups by result', [ 'cache', 'result' ] )
+CACHE_HIT_RATIO = Gauge( 'bot_cache_hit_ratio', 'Share of lookups answered from cache since start', [ 'cache' ] )
+MENU_BUILDS = Counter( 'bot_menu_builds_total', 'Shared menus built instead of taken from the menu cache', [ 'menu' ] )
+WARMUP_SECONDS = Gauge( 'bot_cache_warmup_seconds', 'Duration of the startup cache warm-up' )
+CACHE_INVALIDATIONS = Counter( 'bot_cache_invalidations_total', 'Cache invalidations received over the redis channel' )
+CACHE_REFRESH_FAILURES = Counter( 'bot_cache_refresh_failures_total', 'Cache refreshes whose loader failed', [ 'cache' ] )
+CACHE_REDIS_ERRORS = Counter( 'bot_cache_redis_errors_total', 'Redis reads and writes of the caches that failed', [ 'cache', 'operation' ] )
+LOOP_LAG = Gauge( 'bot_event_loop_lag_last_seconds', 'Last measured event loop lag' )
+LOOP_LAG_SECONDS = Histogram( 'bot_event_loop_lag_seconds', 'Event loop lag', buckets=( .001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5 ) )
+LOOP_LAG_QUANTILE = Gauge( 'bot_event_loop_lag_quantile_seconds', 'Event loop lag percentiles over the last samples', [ 'quantile' ] )
+LOOP_STALLS = Counter( 'bot_event_loop_stalls_total', 'Callbacks that blocked the event loop over the watchdog threshold', [ 'handler' ] )
+LOOP_WATCHDOG_ENABLED = Gauge( 'bot_event_loop_watchdog_enabled', 'Whether the event loop watchdog is running' )
+
+# long polling
+
+POLLING_BATCH = Histogram( 'bot_polling_batch_updates', 'Updates returned by one getUpdates call', buckets=( 0, 1, 5, 10, 25, 50, 100 ) )
+POLLING_ERRORS = Counter( 'bot_polling_errors_total', 'Failed getUpdates calls' )
+
+# outbound telegram api calls
+
+OUTBOUND_WAIT = Histogram( 'bot_outbound_wait_seconds', 'Time an api call waited for rate limit tokens', [ 'priority' ] )
+OUTBOUND_RETRY_AFTER = Counter( 'bot_outbound_retry_after_total', 'Api calls answered with RetryAfter' )
+OUTBOUND_COALESCED = Counter( 'bot_outbound_coalesced_total', 'Message edits superseded by a newer edit before being sent' )
+
+# download progress edits
+
+STATUS_COALESCED = Counter( 'bot_status_coalesced_total', 'Download statuses replaced by a newer one before being shown' )
+STATUS_DROPPED = Counter( 'bot_status_dropped_total', 'Download statuses arriving after the terminal one' )
+
+# result delivery
+
+DELIVERY_IN_FLIGHT = Gauge( 'bot_delivery_uploads_in_flight', 'Upload requests to telegram in progress' )
+DELIVERY_FILES = Counter( 'bot_delivery_files_total', 'Files delivered to telegram' )
+DELIVERY_BYTES = Counter( 'bot_delivery_bytes_total', 'Bytes delivered to telegram' )
+DELIVERY_SECONDS = Histogram( 'bot_delivery_request_seconds', 'Duration of one upload request', buckets=( .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900 ) )
+DELIVERY_THROUGHPUT = Histogram( 'bot_delivery_throughput_bytes_per_second', 'Upload throughput per request', buckets=( 1e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7, 5e7, 1e8 ) )
+FILE_ID_LOOKUPS = Counter( 'bot_delivery_file_id_lookups_total', 'Uploaded file_id cache lookups', [ 'result' ] )
+
+# shared downloads
+
+DOWNLOADS_DEDUPLICATED = Counter( 'bot_downloads_deduplicated_total', 'Download requests attached to an identical task already running' )
+DOWNLOADS_FANNED_OUT = Counter( 'bot_downloads_fanned_out_total', 'Extra copies of statuses and results sent to attached requesters', [ 'kind' ] )
+
+# proxies
+
+PROXY_REQUESTS = Counter( 'bot_proxy_requests_total', 'Requests made through a proxy, including health probes', [ 'result' ] )
+PROXY_QUARANTINED = Counter( 'bot_proxy_quarantined_total', 'Times a proxy was put into quarantine' )
@@ -6,12 +6,22 @@ from aiogram.client.telegram import TelegramAPIServer
 from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
 from app.classes.database import DataBase
+from app.classes.updates import UpdatesPipeline
+from app.classes.poller import Poller
+from app.classes.monitoring import LoopMonitor
+from app.classes.outbound import OutboundLimiter
+from app.classes.delivery import Delivery
+from app.classes.file_ids import FileIdCache
+from app.classes.proxies import ProxyPool
+from app.classes.menus import MenuCache
 from app.configs import GC
 
-DB = DataBase()
-
 RD = redis.Redis.from_url( GC.redis_server, protocol=3, decode_responses=True )
 
+DB = DataBase( RD )
+
+PX = ProxyPool( RD )
+
 if os.environ.get('LOCAL_SERVER'):
     local_server = TelegramAPIServer.from_base( GC.local_server, is_local=True )
     session = AiohttpSession( api=local_server )
@@ -19,6 +29,18 @@ if os.environ.get('LOCAL_SERVER'):
 else:
     BOT = Bot(os.environ.get("BOT_TOKEN"))
 
+# the first middleware is the outermost, every request Delivery makes, a re-upload included, is rate limited
+BOT.session.middleware( Delivery( FileIdCache( RD ), uploads=GC.delivery_uploads, chat_uploads=GC.delivery_chat_uploads ) )
+BOT.session.middleware( OutboundLimiter() )
+
 kb = DefaultKeyBuilder(prefix='fsm', with_bot_id=True, with_destiny=True)
 storage = RedisStorage( RD, key_builder=kb )
-DP = Dispatcher(storage=storage)
\ No newline at end of file
+DP = Dispatcher(storage=storage)
+
+UP = UpdatesPipeline( DP, BOT )
+
+PL = Poller( DP, BOT, UP )
+
+LM = LoopMonitor()
+
+KB = MenuCache()
\ No newline at end of file
@@ -2,6 +2,8 @@ import os
 import re
 import json
 import asyncio
+import idna
+from functools import lru_cache
 from typing import Any, Dict
 from aiogram.fsm.context import FSMContext
 
@@ -47,12 +49,17 @@ def humanizeSize(size: int) -> str:
     size = round(float(size),2)
     return f"{size} {ext}"
 
+@lru_cache( maxsize=4096 )
 def punyDecode(string: str) -> str:
     try:
         return string.encode().decode('idna')
     except:
         return string
 
+@lru_cache( maxsize=4096 )
+def idnaDecode(string: str) -> str:
+    return idna.decode(string)
+
 def hideUI(url: str) -> str:
     return re.sub(r"&?ui=\d+", "", url)
 
@@ -2,146 +2,225 @@ from __future__ import annotations
 import os
 import re
 import ujson
-from typing import List, Dict, Any
+import asyncio
+import logging
+import aiofiles
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Literal, Mapping, Tuple
+from pydantic import BaseModel, ConfigDict, field_serializer, field_validator
 
-class GlobalConfig():
-    dev_mode:     bool = False
-    bot_host:     str = 'http://bot:8000/'
-    queue_host:   str = 'http://queue:8010/'
-    redis_server: str = 'redis://redis:6379/1'
-    # ENV based
-    local_server: str | None = None
-    url:          str = ''
-    encrypt_key:  bytes | None = None
-    # global.json based
-    formats:      Dict[str,str] = {}
-    groups:       Dict[str,str] = {}
-    demo:         Dict[str,str] = {}
-    admins:       List[int] = []
-    proxies:      GlobalConfigProxies = None
-    free_limit:   int = 100
-    #
-    mask:         re.Pattern = re.compile("https?:\\/\\/(www\\.|m\\.|ru\\.)*(?P<site>[^\\/]+)\\/.+")
-    proxy:        re.Pattern = re.compile("(https?|socks[4,5]):\\/\\/\\d{1,3}\\.\\d{1,3}\\.\\d{1,3}\\.\\d{1,3}:\\d{2,5}\\/")
+logger = logging.getLogger(__name__)
 
-    def __init__( self ):
 
-        # ENV based settings
+class GlobalConfigProxies():
+    instances: Tuple[ str, ... ]
 
-        dev_mode = os.environ.get('DEV_MODE', False)
-        self.dev_mode = dev_mode != False
+    def __init__(
+        self,
+        instances: Tuple[ str, ... ] = ()
+    ) -> None:
+        self.instances = tuple( instances )
 
-        local_server = os.environ.get('LOCAL_SERVER')
-        if local_server:
-            self.local_server = f'http://{local_server}:8081'
 
+    def Has( self ) -> bool:
+        return len( self.instances ) != 0
 
-        url = os.environ.get('URL')
-        if url:
-            self.url = url
 
+    async def GetInstance(
+        self,
+        site: str,
+        exclude: List[ str ] = []
+    ) -> str:
+        # health state is shared through redis, which is not available at config import
+        from app.objects import PX
+        return await PX.Pick( site, self.instances, exclude )
 
-        encrypt_key = os.environ.get('ENCRYPT_KEY')
-        if encrypt_key:
-            self.encrypt_key = bytes(encrypt_key, encoding='utf-8')
-        else:
-            if url:
-                raise Exception('Set ENCRYPT_KEY environment variable, use https://fernetkeygen.com/ for generating')
 
-        # global.json based settings
+    async def Report(
+        self,
+        site: str,
+        proxy: str,
+        ok: bool,
+        latency: float = 0
+    ) -> None:
+        from app.objects import PX
+        await PX.Report( site, proxy, ok, latency )
 
-        config_file = '/app/configs/global.json'
-        if not os.path.exists(config_file):
-            raise FileNotFoundError(config_file)
 
+class GlobalConfigSnapshot(BaseModel):
+    # one complete, validated state of the config, never changed after loading
+    # settings marked (restart) are read once at startup, a reload changes them only in the snapshot
+    model_config = ConfigDict( frozen=True, extra='ignore', arbitrary_types_allowed=True, validate_default=True )
 
-        config: Dict[str,Any] = {}
-        with open( config_file, 'r', encoding='utf-8' ) as _config_file:
-            _config = _config_file.read()
-            config = ujson.loads( _config )
+    # ENV based
+    dev_mode:     bool = False
+    local_server: str | None = None
+    url:          str = ''
+    encrypt_key:  bytes | None = None
+    # global.json based
+    formats:      Mapping[str,str] = {
+        "fb2": "Fb2 - для книг",
+        "mp3": "mp3 - для аудиокниг",
+        "epub": "Epub - для книг",
+        "cbz": "CBZ - для манги"
+    }
+    groups:       Mapping[str,str] = {}
+    demo:         Mapping[str,str] = {}
+    admins:       Tuple[int, ...] = ()
+    proxies:      GlobalConfigProxies = GlobalConfigProxies()
+    free_limit:   int = 100
+    # updates pipeline
+    # "shed" - drop updates on overload, "retry" - answer 503 so telegram redelivers them
+    updates_workers:  int = 16  # (restart)
+    updates_queue:    int = 1000
+    updates_overload: Literal[ 'shed', 'retry' ] = 'retry'
+    # event loop watchdog, seconds a single callback may hold the loop before it is reported
+    watchdog_enabled:   bool = True  # (restart)
+    watchdog_threshold: float = 0.25
+    # minimal seconds between progress edits of one download message
+    status_interval:    float = 2
+    # concurrent result uploads, in total and into one chat
+    delivery_uploads:      int = 8  # (restart)
+    delivery_chat_uploads: int = 2  # (restart)
+    # seconds startup waits for the site caches to fill, 0 to skip
+    warmup_timeout:        float = 30  # (restart)
+    # redis channel the queue service publishes cache invalidations to
+    cache_channel:         str = 'cache_invalidate'  # (restart)
+    # proxy health probes against a url the proxies can reach without side effects,
+    # e.g. a local stand-in of the sites, disabled without a url
+    proxy_probe_url:       str = ''  # (restart)
+    proxy_probe_interval:  float = 60  # (restart)
+
+
+    @field_validator( 'formats', 'groups', 'demo', mode='after' )
+    @classmethod
+    def readOnly( cls, value: Mapping[str,str] ) -> Mapping[str,str]:
+        # the snapshot is shared by every reader, its mappings can't be changed either
+        return MappingProxyType( dict( value ) )
+
+
+    @field_serializer( 'formats', 'groups', 'demo' )
+    def plainMapping( self, value: Mapping[str,str] ) -> Dict[str,str]:
+        return dict( value )
+
+
+    @field_validator( 'updates_overload', mode='before' )
+    @classmethod
+    def overloadMode( cls, value: Any ) -> str:
+        return value if value in [ 'shed', 'retry' ] else 'retry'
+
+
+    @field_validator( 'proxies', mode='before' )
+    @classmethod
+    def proxyInstances( cls, value: Any ) -> GlobalConfigProxies:
+        if isinstance( value, GlobalConfigProxies ):
+            return value
+        return GlobalConfigProxies( tuple( value or () ) )
 
 
-        if 'formats' in config:
-            self.formats = config['formats']
-        else:
-            self.formats = {
-                "fb2": "Fb2 - для книг",
-                "mp3": "mp3 - для аудиокниг",
-                "epub": "Epub - для книг",
-                "cbz": "CBZ - для манги"
-            }
+class GlobalConfig():
+    # every setting is read from the current snapshot, a reload builds a new one off the loop
+    # and swaps it in with a single assignment, so readers never see a half-updated config
+    # and need no lock; GC.Snapshot() gives several settings of one and the same version
+    bot_host:     str = 'http://bot:8000/'
+    queue_host:   str = 'http://queue:8010/'
+    redis_server: str = 'redis://redis:6379/1'
+    config_file:  str = '/app/configs/global.json'
+    #
+    mask:         re.Pattern = re.compile("https?:\\/\\/(www\\.|m\\.|ru\\.)*(?P<site>[^\\/]+)\\/.+")
+    proxy:        re.Pattern = re.compile("(https?|socks[4,5]):\\/\\/\\d{1,3}\\.\\d{1,3}\\.\\d{1,3}\\.\\d{1,3}:\\d{2,5}\\/")
 
+    def __init__( self ):
+        self._listeners: List[ Callable[ [ GlobalConfigSnapshot ], Any ] ] = []
+        self._watcher: asyncio.Task | None = None
 
-        if 'admins' in config:
-            self.admins = config['admins']
-        else:
-            self.admins = []
+        # the event loop is not running yet at import, a plain read is fine here
+        if not os.path.exists( self.config_file ):
+            raise FileNotFoundError( self.config_file )
+        with open( self.config_file, 'r', encoding='utf-8' ) as _config_file:
+            self._snapshot: GlobalConfigSnapshot = self.parse( _config_file.read() )
 
 
-        if 'groups' in config:
-            self.groups = config['groups']
-        else:
-            self.groups = {}
+    def __getattr__( self, name: str ) -> Any:
+        # only called for names that are not constants of the class
+        snapshot = self.__dict__.get( '_snapshot' )
+        if snapshot is None:
+            raise AttributeError( name )
+        return getattr( snapshot, name )
 
 
-        if 'demo' in config:
-            self.demo = config['demo']
-        else:
-            self.demo = {}
+    def Snapshot( self ) -> GlobalConfigSnapshot:
+        return self._snapshot
 
 
-        if 'free_limit' in config:
-            self.free_limit = config['free_limit']
-        else:
-            self.free_limit = 100
+    def Subscribe( self, listener: Callable[ [ GlobalConfigSnapshot ], Any ] ) -> None:
+        # called with the new snapshot after every reload
+        self._listeners.append( listener )
 
 
-        _proxies = []
-        if 'proxies' in config:
-            _proxies = config['proxies']
-        if self.proxies is None:
-            self.proxies = GlobalConfigProxies()
-            self.proxies.instances = _proxies
+    async def UpdateConfig( self ) -> None:
+        if not os.path.exists( self.config_file ):
+            raise FileNotFoundError( self.config_file )
+        async with aiofiles.open( self.config_file, 'r', encoding='utf-8' ) as _config_file:
+            _config = await _config_file.read()
+        snapshot = self.parse( _config )
 
+        self._snapshot = snapshot
+        for listener in self._listeners:
+            try:
+                listener( snapshot )
+            except Exception:
+                logger.exception('GlobalConfig: reload listener failed')
 
-    async def UpdateConfig( self ):
-        self.__init__()
 
+    async def Watch( self ) -> None:
+        if self._watcher:
+            return
+        self._watcher = asyncio.create_task( self.watch() )
 
-class GlobalConfigProxies():
-    instances: List[ str ]         = []
-    last_by_site: Dict[ str, int ] = {}
 
-    def __init__(
-        self,
-        instances: List[ str ] = [],
-        last_by_site: Dict[ str, int ] = {}
-    ) -> None:
-        self.instances    = instances
-        self.last_by_site = last_by_site
+    async def Unwatch( self ) -> None:
+        if self._watcher:
+            self._watcher.cancel()
+            await asyncio.gather( self._watcher, return_exceptions=True )
+            self._watcher = None
 
+    #
 
-    def Has( self ) -> bool:
-        return len( self.instances ) != 0
+    async def watch( self ) -> None:
+        from watchfiles import awatch
 
+        # the directory is watched, editors and config mounts replace the file instead of writing it
+        directory = os.path.dirname( self.config_file )
+        logger.info(f'GlobalConfig: watching {self.config_file}')
+        async for changes in awatch( directory ):
+            if not any( os.path.basename( path ) == os.path.basename( self.config_file ) for _, path in changes ):
+                continue
+            try:
+                await self.UpdateConfig()
+                logger.info('GlobalConfig: reloaded')
+            except Exception as e:
+                # a broken file keeps the last good config
+                logger.error(f'GlobalConfig: reload failed with {e!r}, keeping the current config')
 
-    async def GetInstance(
-        self,
-        site: str,
-        exclude: List[ str ] = []
-    ) -> str:
-        index = 0
 
-        instances = list( set( self.instances ) - set( exclude ) )
+    @staticmethod
+    def parse( raw: str ) -> GlobalConfigSnapshot:
+        config: Dict[str,Any] = ujson.loads( raw )
 
-        if len( instances ) == 0:
-            return ''
+        # ENV based settings
 
-        if site in self.last_by_site:
-            index = self.last_by_site[ site ]
-            index += 1
-            if index > len( instances ) - 1:
-                index = 0
+        url = os.environ.get('URL') or ''
+        encrypt_key = os.environ.get('ENCRYPT_KEY')
+        if not encrypt_key and url:
+            raise Exception('Set ENCRYPT_KEY environment variable, use https://fernetkeygen.com/ for generating')
+
+        local_server = os.environ.get('LOCAL_SERVER')
 
-        self.last_by_site[ site ] = index
-        return instances[ index ]
\ No newline at end of file
+        config.update(
+            dev_mode = os.environ.get('DEV_MODE', False) != False,
+            local_server = f'http://{local_server}:8081' if local_server else None,
+            url = url,
+            encrypt_key = bytes( encrypt_key, encoding='utf-8' ) if encrypt_key else None
+        )
+        return GlobalConfigSnapshot.model_validate( config )
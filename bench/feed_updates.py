@@ -0,0 +1,187 @@
+# Throughput of DP.feed_raw_update with the DataBase on a sync session driven from the event loop
+# (how DataBase worked before) and on the async engine, both against an sqlite stand-in
+#
+#   pip install aiosqlite
+#   python bench/feed_updates.py --updates 2000 --concurrency 100 --latency 2 > bench_output.txt
+#
+# every synthetic update is a /start of a new user: one select, one insert and a reply
+# through a stubbed bot session, so nothing leaves the process
+# --latency adds milliseconds to every statement inside the driver, standing in for the mysql
+# round trip: the sync session waits for it on the loop, aiosqlite in its own thread
+from __future__ import annotations
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import argparse
+import statistics
+from datetime import datetime
+from typing import Any, Dict, List
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from aiogram import Bot, Dispatcher, Router, types
+from aiogram.filters import Command
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage, TelegramMethod
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+try:
+    from sqlalchemy.util.concurrency import await_
+except ImportError:
+    from sqlalchemy.util.concurrency import await_only as await_
+from app import models
+from app.classes.database import DataBase
+
+TOKEN = '123456:AAEhBP0av18z5rB2tZ_2Tlw1iqP2Bc_0000'
+
+
+class StubSession(BaseSession):
+    # answers every api call at once, replies are built from the request
+
+    async def make_request( self, bot: Bot, method: TelegramMethod, timeout: int | None = None ) -> Any:
+        await asyncio.sleep( 0 )
+        if isinstance( method, SendMessage ):
+            return types.Message(
+                message_id = 1,
+                date = datetime.now(),
+                chat = types.Chat( id=method.chat_id, type='private' ),
+                text = method.text
+            )
+        return True
+
+    async def stream_content( self, *args: Any, **kwargs: Any ) -> Any:
+        raise NotImplementedError
+
+    async def close( self ) -> None:
+        pass
+
+
+class BlockingSession:
+    # a sync orm session behind the async interface DataBase uses, every call blocks the loop
+
+    def __init__( self, session: Any ) -> None:
+        self.session = session
+
+    def add( self, instance: Any ) -> None:
+        self.session.add( instance )
+
+    async def execute( self, *args: Any, **kwargs: Any ) -> Any:
+        return self.session.execute( *args, **kwargs )
+
+    async def commit( self ) -> None:
+        self.session.commit()
+
+    async def close( self ) -> None:
+        self.session.close()
+
+
+def slowStatements( latency: float ):
+    def trace( statement: str ) -> None:
+        time.sleep( latency )
+    return trace
+
+
+async def database( mode: str, path: str, latency: float, pool: int ) -> DataBase:
+    # DataBase as it is, on a session of the chosen kind; only the users table is needed
+    # and the others use mysql types sqlite can't create
+    # both pools fit every concurrent update, a sync checkout waiting for a free
+    # connection would block the loop that has to return it
+    db = DataBase()
+    db._engine = create_async_engine( f'sqlite+aiosqlite:///{path}', pool_size=pool, max_overflow=0 )
+    async with db._engine.begin() as conn:
+        await conn.run_sync( models.Base.metadata.create_all, tables=[ models.User.__table__ ] )
+
+    if mode == 'sync':
+        engine = create_engine( f'sqlite:///{path}', pool_size=pool, max_overflow=0 )
+        if latency:
+            @event.listens_for( engine, 'connect' )
+            def connect( dbapi_connection, record ):
+                dbapi_connection.set_trace_callback( slowStatements( latency ) )
+        maker = sessionmaker( engine, expire_on_commit=False )
+        db._session = lambda: BlockingSession( maker() )
+    else:
+        if latency:
+            # connections made so far have no tracer, start from a clean pool
+            await db._engine.dispose()
+            @event.listens_for( db._engine.sync_engine, 'connect' )
+            def connect( dbapi_connection, record ):
+                await_( record.driver_connection.set_trace_callback( slowStatements( latency ) ) )
+        db._session = async_sessionmaker( db._engine, expire_on_commit=False )
+    return db
+
+
+def dispatcher( db: DataBase ) -> Dispatcher:
+    router = Router()
+
+    async def start( message: types.Message ) -> None:
+        user = await db.GetUser( message.from_user.id )
+        if not user:
+            user = await db.SaveUser( models.User( id=message.from_user.id, username=message.from_user.first_name ) )
+        await message.bot.send_message( chat_id=message.chat.id, text=f'Привет, {user.username}' )
+
+    router.message.register( start, Command( 'start' ) )
+    dp = Dispatcher()
+    dp.include_router( router )
+    return dp
+
+
+def update( update_id: int, user_id: int ) -> Dict[ str, Any ]:
+    user = { 'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}' }
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int( time.time() ),
+            'chat': { 'id': user_id, 'type': 'private' },
+            'from': user,
+            'text': '/start',
+            'entities': [ { 'type': 'bot_command', 'offset': 0, 'length': 6 } ]
+        }
+    }
+
+
+async def run( mode: str, updates: int, concurrency: int, latency: float ) -> Dict[ str, float ]:
+    with tempfile.TemporaryDirectory() as directory:
+        db = await database( mode, os.path.join( directory, 'bench.sqlite' ), latency, concurrency )
+        dp = dispatcher( db )
+        bot = Bot( TOKEN, session=StubSession() )
+        slots = asyncio.Semaphore( concurrency )
+        latencies: List[ float ] = []
+
+        async def feed( i: int ) -> None:
+            async with slots:
+                started = time.monotonic()
+                await dp.feed_raw_update( bot, update( i, 1000000 + i ) )
+                latencies.append( time.monotonic() - started )
+
+        started = time.monotonic()
+        await asyncio.gather( *[ feed( i ) for i in range( updates ) ] )
+        elapsed = time.monotonic() - started
+        await db._engine.dispose()
+
+    latencies.sort()
+    return {
+        'rate': updates / elapsed,
+        'p50':  statistics.median( latencies ) * 1000,
+        'p99':  latencies[ int( len( latencies ) * 0.99 ) - 1 ] * 1000,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser( description='DP.feed_raw_update throughput, sync session vs async engine' )
+    parser.add_argument( '--updates', type=int, default=2000 )
+    parser.add_argument( '--concurrency', type=int, default=100 )
+    parser.add_argument( '--latency', type=float, default=2, help='milliseconds added to every statement' )
+    args = parser.parse_args()
+
+    print(f'{args.updates} updates, {args.concurrency} concurrent, {args.latency}ms per statement')
+    for mode, name in [ ( 'sync', 'before: sync session on the loop' ), ( 'async', 'after: async engine' ) ]:
+        result = await run( mode, args.updates, args.concurrency, args.latency / 1000 )
+        print(f'{name:36} {result["rate"]:9.1f} updates/s   p50 {result["p50"]:8.1f}ms   p99 {result["p99"]:8.1f}ms')
+
+
+if __name__ == '__main__':
+    asyncio.run( main() )
@@ -0,0 +1,14 @@
+import os
+import sys
+import pytest
+
+# the app modules are imported as the service imports them, from the repository root
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+os.environ.setdefault( 'BOT_TOKEN', '123456:AAEhBP0av18z5rB2tZ_2Tlw1iqP2Bc_0000' )
+
+
+@pytest.fixture
+def redis():
+    # an in-process redis for the code that keeps its state there, created inside the test's loop
+    fakeredis = pytest.importorskip( 'fakeredis' )
+    return lambda: fakeredis.FakeAsyncRedis( decode_responses=True )
@@ -0,0 +1,143 @@
+import asyncio
+import pytest
+from typing import Any, List
+from pydantic import BaseModel
+import app.classes.cache as cache
+from app.classes.cache import CacheRegistry, TieredCache
+
+
+class Sites(BaseModel):
+    sites: List[ str ] = []
+
+
+class FailingRedis:
+    async def get( self, *args: Any ) -> Any:
+        raise ConnectionError( 'redis is down' )
+
+    async def setex( self, *args: Any ) -> Any:
+        raise ConnectionError( 'redis is down' )
+
+    async def delete( self, *args: Any ) -> Any:
+        raise ConnectionError( 'redis is down' )
+
+
+def loader( *values: Any ):
+    # answers with the values in turn, an exception value is raised
+    calls = []
+
+    async def load() -> Sites:
+        value = values[ len( calls ) ]
+        calls.append( value )
+        if isinstance( value, Exception ):
+            raise value
+        return Sites( sites=value )
+    return load, calls
+
+
+def test_redis_down_falls_through_to_the_loader( monkeypatch ):
+    monkeypatch.setattr( cache, 'RD', FailingRedis() )
+    sites = TieredCache( Sites, name='test_redis_down' )
+    load, calls = loader( [ 'a' ] )
+
+    async def main():
+        return await sites.Get( '', load ), await sites.Get( '', load )
+
+    first, second = asyncio.run( main() )
+    assert first.sites == [ 'a' ] and second.sites == [ 'a' ]
+    # the value stays in the local tier even though redis could not store it
+    assert len( calls ) == 1
+
+
+def test_redis_down_serves_the_last_good_value( monkeypatch ):
+    monkeypatch.setattr( cache, 'RD', FailingRedis() )
+    sites = TieredCache( Sites, name='test_redis_down_stale', stale_ttl=0, wait=1 )
+    load, calls = loader( [ 'a' ], ConnectionError( 'queue is down' ) )
+
+    async def main():
+        await sites.Get( '', load )
+        sites.expire( '' )
+        return await sites.Get( '', load )
+
+    assert asyncio.run( main() ).sites == [ 'a' ]
+    assert len( calls ) == 2
+    assert sites.Degraded( '' )
+
+
+class Groups(BaseModel):
+    groups: List[ str ] = []
+
+
+def test_registry_rejects_a_taken_name_or_namespace():
+    registry = CacheRegistry()
+    registry.Register( TieredCache( Sites, name='sites' ) )
+    with pytest.raises( ValueError ):
+        registry.Register( TieredCache( Groups, name='sites', namespace='cache:other' ) )
+    with pytest.raises( ValueError ):
+        registry.Register( TieredCache( Groups, name='groups', namespace='cache:sites' ) )
+    registry.Register( TieredCache( Groups, name='groups' ) )
+    assert [ x.name for x in registry.Caches() ] == [ 'sites', 'groups' ]
+
+
+def test_entry_of_another_schema_is_a_miss( redis, monkeypatch ):
+    async def main():
+        monkeypatch.setattr( cache, 'RD', redis() )
+        # two caches that ended up on one namespace, e.g. before and after a model change
+        await TieredCache( Groups, name='old', namespace='cache:shared' ).Set( '', Groups( groups=[ 'x' ] ) )
+        sites = TieredCache( Sites, name='new', namespace='cache:shared' )
+        load, calls = loader( [ 'a' ] )
+        return await sites.Get( '', load ), calls
+
+    value, calls = asyncio.run( main() )
+    assert value.sites == [ 'a' ]
+    assert len( calls ) == 1
+
+
+def test_refresh_started_before_an_invalidation_is_not_stored( redis, monkeypatch ):
+    async def main():
+        client = redis()
+        monkeypatch.setattr( cache, 'RD', client )
+        sites = TieredCache( Sites, name='test_fence' )
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def slow() -> Sites:
+            started.set()
+            await release.wait()
+            return Sites( sites=[ 'old' ] )
+
+        pending = asyncio.create_task( sites.Get( '', slow ) )
+        await started.wait()
+        sites.Invalidate()
+        release.set()
+        value = await pending
+        load, calls = loader( [ 'new' ] )
+        return value, await client.get( sites.redisKey( '' ) ), await sites.Get( '', load ), calls
+
+    value, stored, after, calls = asyncio.run( main() )
+    # the caller that asked still gets its answer, but nobody else is served it
+    assert value.sites == [ 'old' ]
+    assert stored is None
+    assert after.sites == [ 'new' ] and len( calls ) == 1
+
+
+def test_values_in_redis_before_an_invalidation_are_stale( redis, monkeypatch ):
+    async def main():
+        monkeypatch.setattr( cache, 'RD', redis() )
+        registry = CacheRegistry()
+        sites = registry.Register( TieredCache( Sites, name='test_stale' ) )
+        await sites.Set( '', Sites( sites=[ 'old' ] ) )
+        before = await sites.readRemote( '' )
+        await registry.received( '{"caches": ["test_stale"]}' )
+        # the local copy is gone, the one in redis is kept but read back as stale
+        sites._local.clear()
+        after = await sites.readRemote( '' )
+        load, calls = loader( ConnectionError( 'queue is down' ), [ 'new' ] )
+        fallback = await sites.Get( '', load )
+        sites._failed.clear()
+        return before, after, fallback, await sites.Get( '', load ), calls
+
+    before, after, fallback, refreshed, calls = asyncio.run( main() )
+    assert before[0] > 0 and after[0] == 0
+    assert after[1].sites == [ 'old' ]
+    # a stale value is refreshed first, and still there to fall back on when that fails
+    assert fallback.sites == [ 'old' ]
+    assert refreshed.sites == [ 'new' ] and len( calls ) == 2
@@ -0,0 +1,48 @@
+import asyncio
+import pytest
+from typing import Any, List
+from sqlalchemy.exc import OperationalError
+from app import models
+from app.classes.database import DataBase
+
+
+def mysqlError( code: int ) -> OperationalError:
+    return OperationalError( 'INSERT', {}, Exception( code, 'error' ) )
+
+
+class Session:
+    # fails every commit with the given error
+    def __init__( self, error: Exception, commits: List[ int ] ) -> None:
+        self.error = error
+        self.commits = commits
+
+    def add( self, instance: Any ) -> None:
+        pass
+
+    async def commit( self ) -> None:
+        self.commits.append( 1 )
+        raise self.error
+
+    async def close( self ) -> None:
+        pass
+
+
+def saveUser( code: int ) -> int:
+    commits: List[ int ] = []
+    db = DataBase()
+    db._session = lambda: Session( mysqlError( code ), commits )
+    db._write_retries.base = db._write_retries.cap = 0.001
+
+    with pytest.raises( OperationalError ):
+        asyncio.run( db.SaveUser( models.User( id=1, username='user' ) ) )
+    return len( commits )
+
+
+def test_save_user_is_not_repeated_after_a_lost_connection():
+    # 2013: the connection dropped mid-query, the row may already be committed
+    assert saveUser( 2013 ) == 1
+
+
+def test_save_user_is_repeated_when_the_server_was_not_reached():
+    # 2003: no connection at all, nothing was written
+    assert saveUser( 2003 ) == DataBase.retry_attempts
@@ -0,0 +1,39 @@
+import asyncio
+from typing import List
+from app import dto
+from app import variables
+from app.classes.debounce import StatusDebouncer
+
+
+def status( text: str, step: int = variables.DownloaderStep.RUNNING ) -> dto.DownloadStatus:
+    return dto.DownloadStatus( task_id=1, user_id=1, chat_id=1, message_id=1, text=text, status=step )
+
+
+def run( *statuses: dto.DownloadStatus, wait: float = 0.1 ) -> List[ str ]:
+    async def main():
+        delivered: List[ str ] = []
+
+        async def deliver( status: dto.DownloadStatus ) -> bool:
+            delivered.append( status.text )
+            return True
+
+        debouncer = StatusDebouncer( deliver, interval=0.05 )
+        for x in statuses:
+            await debouncer.Push( x )
+        await asyncio.sleep( wait )
+        return delivered
+    return asyncio.run( main() )
+
+
+def test_intermediate_statuses_are_coalesced():
+    assert run( status( '1' ), status( '2' ), status( '3' ) ) == [ '1', '3' ]
+
+
+def test_terminal_status_goes_out_at_once():
+    done = status( 'done', variables.DownloaderStep.DONE )
+    assert run( status( '1' ), status( '2' ), done, wait=0 ) == [ '1', 'done' ]
+
+
+def test_statuses_after_terminal_are_dropped():
+    done = status( 'done', variables.DownloaderStep.DONE )
+    assert run( done, status( 'late' ) ) == [ 'done' ]
@@ -0,0 +1,141 @@
+import asyncio
+from datetime import datetime
+from typing import Any, List, Tuple
+from aiogram.client.session.middlewares.manager import RequestMiddlewareManager
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendDocument, SendMediaGroup
+from aiogram.types import Chat, Document, FSInputFile, InputMediaDocument, Message
+from app.classes.delivery import Delivery
+from app.classes.file_ids import FileIdCache
+from app.classes.outbound import OutboundLimiter
+
+
+class Telegram:
+    # counts uploads on the wire, in total and per chat
+    def __init__( self ) -> None:
+        self.active: List[ int ] = []
+        self.peak: int = 0
+        self.chat_peak: int = 0
+        self.groups: List[ int ] = []
+
+    async def __call__( self, bot: Any, method: Any ) -> Any:
+        self.active.append( method.chat_id )
+        self.peak = max( self.peak, len( self.active ) )
+        self.chat_peak = max( self.chat_peak, max( self.active.count( x ) for x in self.active ) )
+        await asyncio.sleep( 0.01 )
+        self.active.remove( method.chat_id )
+        if isinstance( method, SendMediaGroup ):
+            self.groups.append( len( method.media ) )
+            return [ None ] * len( method.media )
+        return None
+
+
+def test_uploads_are_limited_in_total_and_per_chat( tmp_path ):
+    path = tmp_path / 'book.fb2'
+    path.write_bytes( b'x' * 100 )
+
+    async def main():
+        telegram = Telegram()
+        delivery = Delivery( uploads=3, chat_uploads=1 )
+        await asyncio.gather( *[
+            delivery( telegram, None, SendDocument( chat_id=chat_id, document=FSInputFile( path ) ) )
+            for chat_id in [ 1, 1, 1, 2, 3, 4, 5 ]
+        ] )
+        return telegram
+
+    telegram = asyncio.run( main() )
+    assert telegram.peak == 3
+    assert telegram.chat_peak == 1
+
+
+def test_large_media_group_is_split_in_order( tmp_path ):
+    paths = []
+    for i in range( 23 ):
+        path = tmp_path / f'{i}.fb2'
+        path.write_bytes( b'x' )
+        paths.append( path )
+
+    async def main():
+        telegram = Telegram()
+        media = [ InputMediaDocument( media=FSInputFile( path ) ) for path in paths ]
+        messages = await Delivery()( telegram, None, SendMediaGroup( chat_id=1, media=media ) )
+        return telegram, messages
+
+    telegram, messages = asyncio.run( main() )
+    assert telegram.groups == [ 10, 10, 3 ]
+    assert len( messages ) == 23
+
+
+class Uploads:
+    # answers uploads with a new file_id, a file_id listed in rejected is refused
+    def __init__( self, rejected: Tuple[ str, ... ] = () ) -> None:
+        self.rejected = rejected
+        self.sent: List[ Any ] = []
+
+    async def __call__( self, bot: Any, method: Any ) -> Any:
+        self.sent.append( method )
+        if method.document in self.rejected:
+            raise TelegramBadRequest( method, 'Bad Request: wrong file identifier' )
+        return Message(
+            message_id=len( self.sent ), date=datetime.now(), chat=Chat( id=method.chat_id, type='private' ),
+            document=Document( file_id=f'id{len( self.sent )}', file_unique_id=f'u{len( self.sent )}' )
+        )
+
+
+class Limiter(OutboundLimiter):
+    # the limiter as registered on the bot session, remembering what it let through
+    def __init__( self ) -> None:
+        super().__init__()
+        self.passed: List[ Any ] = []
+
+    async def __call__( self, make_request: Any, bot: Any, method: Any ) -> Any:
+        self.passed.append( method )
+        return await super().__call__( make_request, bot, method )
+
+
+def test_uploaded_file_is_resent_by_file_id( tmp_path, redis ):
+    path = tmp_path / 'book.fb2'
+    path.write_bytes( b'x' * 100 )
+    thumb = tmp_path / 'cover.jpg'
+    thumb.write_bytes( b'c' * 100 )
+
+    async def main():
+        telegram = Uploads()
+        delivery = Delivery( FileIdCache( redis(), min_size=0 ) )
+        for _ in range( 2 ):
+            await delivery( telegram, None, SendDocument( chat_id=1, document=FSInputFile( path ), thumbnail=FSInputFile( thumb ) ) )
+        return telegram
+
+    first, second = asyncio.run( main() ).sent
+    assert isinstance( first.document, FSInputFile )
+    assert second.document == 'id1' and second.thumbnail is None
+
+
+def test_rejected_file_id_is_forgotten_and_reuploaded_through_the_limiter( tmp_path, redis ):
+    path = tmp_path / 'book.fb2'
+    path.write_bytes( b'x' * 100 )
+
+    async def main():
+        file_ids = FileIdCache( redis(), min_size=0 )
+        key = await file_ids.Key( str( path ) )
+        await file_ids.Set( key, 'expired' )
+
+        # registered as app.objects registers them, the first middleware is the outermost
+        telegram = Uploads( rejected=( 'expired', ) )
+        limiter = Limiter()
+        middlewares = RequestMiddlewareManager()
+        middlewares( Delivery( file_ids ) )
+        middlewares( limiter )
+        await middlewares.wrap_middlewares( telegram )( None, SendDocument( chat_id=1, document=FSInputFile( path ) ) )
+        return telegram, limiter, await file_ids.Get( [ key ] )
+
+    telegram, limiter, stored = asyncio.run( main() )
+    assert telegram.sent[0].document == 'expired'
+    assert isinstance( telegram.sent[1].document, FSInputFile )
+    assert limiter.passed == telegram.sent
+    assert list( stored.values() ) == [ 'id2' ]
+
+
+def test_bot_session_limits_the_requests_of_delivery():
+    from app.objects import BOT
+    assert [ type( m ).__name__ for m in BOT.session.middleware ] == [ 'Delivery', 'OutboundLimiter' ]
@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime
+from sqlalchemy import inspect
+from app import models
+from app.classes.entity_cache import EntityCache
+
+
+def user( username: str = 'user' ) -> models.User:
+    return models.User( id=1, username=username, setuped=True, format='epub' )
+
+
+def test_rows_come_back_as_detached_copies():
+    async def main():
+        cache = EntityCache( 'test_user', models.User )
+        await cache.Set( 1, user() )
+        found, first = await cache.Get( 1 )
+        _, second = await cache.Get( 1 )
+        return found, first, second
+
+    found, first, second = asyncio.run( main() )
+    assert found and first.username == 'user' and first.format == 'epub'
+    assert inspect( first ).detached
+    # every caller gets its own instance, changing one does not change the cache
+    assert first is not second
+    first.username = 'changed'
+    assert second.username == 'user'
+
+
+def test_redis_round_trip_restores_dates( redis ):
+    until = datetime( 2030, 1, 2, 3, 4, 5 )
+
+    async def main():
+        cache = EntityCache( 'test_acl', models.ACL, redis() )
+        await cache.Set( 7, models.ACL( user_id=7, premium=True, p_until=until ) )
+        # another replica has only the redis tier
+        cache._local.clear()
+        return await cache.Get( 7 )
+
+    found, acl = asyncio.run( main() )
+    assert found and acl.premium and acl.p_until == until
+    assert inspect( acl ).detached
+
+
+def test_missing_rows_are_cached_too():
+    async def main():
+        cache = EntityCache( 'test_none', models.User )
+        await cache.Fill( 1, None, cache.Version() )
+        return await cache.Get( 1 )
+
+    assert asyncio.run( main() ) == ( True, None )
+
+
+def test_fill_started_before_a_write_is_dropped():
+    async def main():
+        cache = EntityCache( 'test_version', models.User )
+        version = cache.Version()
+        # the row is read, meanwhile it is saved with a new name
+        await cache.Set( 1, user( 'new' ) )
+        await cache.Fill( 1, user( 'old' ), version )
+        _, cached = await cache.Get( 1 )
+        version = cache.Version()
+        await cache.Delete( 1 )
+        await cache.Fill( 1, user( 'old' ), version )
+        return cached, await cache.Get( 1 )
+
+    cached, after_delete = asyncio.run( main() )
+    assert cached.username == 'new'
+    assert after_delete == ( False, None )
+
+
+def test_entries_expire( redis ):
+    async def main():
+        client = redis()
+        cache = EntityCache( 'test_ttl', models.User, client, ttl=30, local_ttl=0.05 )
+        await cache.Set( 1, user() )
+        ttl = await client.ttl( cache.redisKey( 1 ) )
+        await asyncio.sleep( 0.1 )
+        local = cache._local.get( 1 )
+        await client.delete( cache.redisKey( 1 ) )
+        return ttl, local, await cache.Get( 1 )
+
+    ttl, local, found = asyncio.run( main() )
+    assert 0 < ttl <= 30
+    assert local is None
+    assert found == ( False, None )
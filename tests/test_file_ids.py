@@ -0,0 +1,52 @@
+import asyncio
+from app.classes.file_ids import FileIdCache
+
+
+def test_key_follows_content_name_and_thumbnail( tmp_path ):
+    for name, content in [ ( 'a.fb2', b'a' ), ( 'b.fb2', b'a' ), ( 'c.fb2', b'c' ), ( 'thumb.jpg', b't' ), ( 'other.jpg', b'o' ) ]:
+        ( tmp_path / name ).write_bytes( content * 1000 )
+    ( tmp_path / 'copy' ).mkdir()
+    ( tmp_path / 'copy' / 'a.fb2' ).write_bytes( b'a' * 1000 )
+    path = lambda name: str( tmp_path / name )
+
+    async def main():
+        file_ids = FileIdCache( None, min_size=0 )
+        return {
+            'same':      await file_ids.Key( path( 'a.fb2' ) ),
+            'copy':      await file_ids.Key( path( 'copy/a.fb2' ) ),
+            'renamed':   await file_ids.Key( path( 'b.fb2' ) ),
+            'changed':   await file_ids.Key( path( 'c.fb2' ) ),
+            'thumb':     await file_ids.Key( path( 'a.fb2' ), path( 'thumb.jpg' ) ),
+            'new_thumb': await file_ids.Key( path( 'a.fb2' ), path( 'other.jpg' ) ),
+        }
+
+    keys = asyncio.run( main() )
+    # the same file under the same name is the same upload wherever it was built
+    assert keys['same'] == keys['copy']
+    assert len( set( keys.values() ) ) == len( keys ) - 1
+
+
+def test_small_files_are_not_cached( tmp_path ):
+    ( tmp_path / 'small.fb2' ).write_bytes( b'x' * 100 )
+    ( tmp_path / 'large.fb2' ).write_bytes( b'x' * 1000 )
+
+    async def main():
+        file_ids = FileIdCache( None, min_size=1000 )
+        return await file_ids.Key( str( tmp_path / 'small.fb2' ) ), await file_ids.Key( str( tmp_path / 'large.fb2' ) )
+
+    small, large = asyncio.run( main() )
+    assert small is None and large is not None
+
+
+def test_ids_are_stored_and_forgotten( redis ):
+    async def main():
+        file_ids = FileIdCache( redis(), min_size=0 )
+        await file_ids.Set( 'file_id_a', 'AAA' )
+        found = await file_ids.Get( [ 'file_id_a', 'file_id_b', None ] )
+        # another replica only has redis
+        file_ids._local.clear()
+        shared = await file_ids.Get( [ 'file_id_a' ] )
+        await file_ids.Forget( [ 'file_id_a' ] )
+        return found, shared, await file_ids.Get( [ 'file_id_a' ] )
+
+    assert asyncio.run( main() ) == ( { 'file_id_a': 'AAA' }, { 'file_id_a': 'AAA' }, {} )
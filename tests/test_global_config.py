@@ -0,0 +1,20 @@
+import pytest
+from app.variables import GlobalConfig, GlobalConfigSnapshot
+
+
+def test_snapshot_mappings_are_read_only():
+    snapshot = GlobalConfigSnapshot.model_validate( { 'groups': { 'books': 'Книги' } } )
+    assert snapshot.groups['books'] == 'Книги'
+    for mapping in ( snapshot.groups, snapshot.formats, snapshot.demo ):
+        with pytest.raises( TypeError ):
+            mapping['x'] = 'y'
+    assert snapshot.model_dump()['groups'] == { 'books': 'Книги' }
+
+
+def test_unknown_overload_falls_back_to_retry():
+    assert GlobalConfigSnapshot.model_validate( { 'updates_overload': 'drop' } ).updates_overload == 'retry'
+
+
+def test_attribute_before_loading():
+    config = GlobalConfig.__new__( GlobalConfig )
+    assert not hasattr( config, 'formats' )
@@ -0,0 +1,8 @@
+from app.classes.inflight import InFlightDownloads
+
+
+def test_normalize_url():
+    normalize = InFlightDownloads.normalizeUrl
+    assert normalize( ' HTTPS://WWW.Ranobelib.me/ru/book/1/?utm_source=tg&b=2&a=1#top ' ) == 'https://ranobelib.me/ru/book/1?a=1&b=2'
+    assert normalize( 'https://ranobelib.me/ru/book/1/' ) == normalize( 'https://ranobelib.me/ru/book/1' )
+    assert normalize( 'https://ranobelib.me/ru/book/1' ) != normalize( 'https://ranobelib.me/ru/book/2' )
@@ -0,0 +1,40 @@
+import asyncio
+from app.classes.interconnect import Interconnect
+
+
+def test_parse_lib_me_links():
+    parse = Interconnect.parseLink
+    assert parse( 'https://ranobelib.me/ru/book/7965--chainsaw-man' ) == ( 'ranobelib.me_7965', 'ranobelib.me', '7965--chainsaw-man' )
+    assert parse( 'https://www.mangalib.me/ru/manga/7965--chainsaw-man/read/v1/c1' )[0] == 'mangalib.me_7965'
+    assert parse( 'https://m.ranobelib.me:443/ru/book/12' )[0] == 'ranobelib.me_12'
+
+
+def test_parse_rulate_links():
+    parse = Interconnect.parseLink
+    assert parse( 'https://tl.rulate.ru/book/123/456' ) == ( 'tl.rulate.ru_123', 'tl.rulate.ru', '123' )
+    # every rulate link is allowed as before, pages other than books get a key of their own
+    users = parse( 'https://tl.rulate.ru/users/1' )
+    assert users[1] == 'tl.rulate.ru' and users[0] != parse( 'https://tl.rulate.ru/users/2' )[0]
+    assert parse( 'https://tl.rulate.ru/' ) is not None
+
+
+def test_parse_links_without_scheme():
+    assert Interconnect.parseLink( 'tl.rulate.ru/book/123' )[0] == 'tl.rulate.ru_123'
+    assert Interconnect.parseLink( 'ranobelib.me/ru/book/12' )[0] == 'ranobelib.me_12'
+
+
+def test_parse_other_links():
+    assert Interconnect.parseLink( 'https://example.com/book/1' ) is None
+    assert Interconnect.parseLink( 'not a link' ) is None
+    assert Interconnect.parseLink( 'https://example.com/?next=tl.rulate.ru/book/1' ) is None
+
+
+def test_check_links_allows_every_rulate_page( redis, monkeypatch ):
+    import app.classes.interconnect as interconnect
+    from app import variables
+
+    async def main():
+        monkeypatch.setattr( interconnect, 'RD', redis() )
+        return await Interconnect.CheckLinks( [ 'https://tl.rulate.ru/book/1', 'https://tl.rulate.ru/search?t=x', 'https://example.com/' ] )
+
+    assert list( asyncio.run( main() ).values() ) == [ variables.SiteAllowed.YES, variables.SiteAllowed.YES, variables.SiteAllowed.NO ]
@@ -0,0 +1,41 @@
+from typing import Any, Callable, List
+from app.classes.menus import MenuCache
+
+
+def builder( value: Any ) -> tuple[ Callable[ [], Any ], List[ int ] ]:
+    calls = []
+    def build():
+        calls.append( 1 )
+        return value
+    return build, calls
+
+
+def test_menu_is_built_once_per_inputs():
+    menus = MenuCache()
+    build, calls = builder( [ 'a', 'b' ] )
+
+    first = menus.Get( 'sites', ( 'a', 'b' ), build )
+    assert menus.Get( 'sites', ( 'a', 'b' ), build ) is first
+    assert len( calls ) == 1
+
+    # a changed site list or another menu with the same inputs is a new entry
+    menus.Get( 'sites', ( 'a', ), build )
+    menus.Get( 'auth', ( 'a', 'b' ), build )
+    assert len( calls ) == 3
+
+
+def test_none_is_a_built_menu():
+    menus = MenuCache()
+    build, calls = builder( None )
+    menus.Get( 'setup_global', None, build )
+    menus.Get( 'setup_global', None, build )
+    assert len( calls ) == 1
+
+
+def test_clear_drops_built_menus():
+    menus = MenuCache()
+    build, calls = builder( 'text' )
+    menus.Get( 'sites', ( 'a', ), build )
+    menus.Clear()
+    menus.Get( 'sites', ( 'a', ), build )
+    assert len( calls ) == 2
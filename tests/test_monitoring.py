@@ -0,0 +1,30 @@
+import asyncio
+from app.classes.monitoring import LoopMonitor
+
+
+async def handler() -> None:
+    await asyncio.sleep( 0 )
+
+
+def test_stall_label_is_the_coroutine():
+    async def main():
+        task = asyncio.create_task( handler(), name='Task-12345' )
+        name = LoopMonitor.coroutineName( task )
+        await task
+        return name
+
+    assert asyncio.run( main() ) == 'handler'
+
+
+def test_lag_is_sampled_without_the_watchdog():
+    async def main():
+        monitor = LoopMonitor()
+        await monitor.Start( interval=0.01, watchdog=False )
+        await asyncio.sleep( 0.1 )
+        sampled, enabled = bool( monitor.Percentiles() ), monitor.Enabled()
+        monitor.StartWatchdog()
+        switched = monitor.Enabled()
+        await monitor.Stop()
+        return sampled, enabled, switched, monitor.Enabled()
+
+    assert asyncio.run( main() ) == ( True, False, True, False )
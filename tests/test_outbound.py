@@ -0,0 +1,60 @@
+import time
+import asyncio
+from typing import Any, List
+from aiogram.methods import EditMessageText
+from app.classes.outbound import OutboundLimiter, TokenBucket
+
+
+def test_bucket_burst_then_rate():
+    bucket = TokenBucket( rate=10, capacity=2 )
+    assert bucket.Wait() == 0
+    bucket.Take()
+    bucket.Take()
+    assert 0.05 < bucket.Wait() <= 0.1
+
+
+def test_bucket_reserve():
+    bucket = TokenBucket( rate=10, capacity=5 )
+    assert bucket.Wait( reserve=3 ) == 0
+    assert bucket.Wait( reserve=5 ) > 0
+
+
+def test_bucket_pause():
+    bucket = TokenBucket( rate=10, capacity=2 )
+    bucket.Pause( 1 )
+    assert 0.9 < bucket.Wait() <= 1
+
+
+def test_bucket_refill_is_capped():
+    bucket = TokenBucket( rate=1000, capacity=2 )
+    bucket._updated = time.monotonic() - 10
+    bucket.Wait()
+    assert bucket._tokens == 2
+
+
+def test_edits_are_coalesced_while_waiting():
+    async def main():
+        sent: List[ str ] = []
+        wire = asyncio.Event()
+
+        async def make_request( bot: Any, method: EditMessageText ) -> str:
+            sent.append( method.text )
+            if method.text == 'a':
+                await wire.wait()
+            return method.text
+
+        limiter = OutboundLimiter()
+        edit = lambda text: limiter( make_request, None, EditMessageText( chat_id=1, message_id=2, text=text ) )
+        first = asyncio.create_task( edit( 'a' ) )
+        await asyncio.sleep( 0.01 )
+        # 'a' is on the wire, 'b' waits for it and is replaced by 'c'
+        second = asyncio.create_task( edit( 'b' ) )
+        await asyncio.sleep( 0.01 )
+        third = asyncio.create_task( edit( 'c' ) )
+        await asyncio.sleep( 0.01 )
+        wire.set()
+        return sent, await asyncio.gather( first, second, third )
+
+    sent, results = asyncio.run( main() )
+    assert sent == [ 'a', 'c' ]
+    assert results == [ 'a', 'c', 'c' ]
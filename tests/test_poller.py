@@ -0,0 +1,62 @@
+import asyncio
+from typing import Any, Dict, List
+from app.classes.poller import Poller
+from app.classes.updates import UpdatesPipeline
+
+
+class Bot:
+    def __init__( self ) -> None:
+        self.confirmed: List[ int ] = []
+
+    async def get_updates( self, offset: int, **kwargs: Any ) -> List[ Any ]:
+        self.confirmed.append( offset )
+        return []
+
+
+class Updates:
+    def __init__( self, unfinished: List[ int ] ) -> None:
+        self.unfinished = unfinished
+
+    async def Stop( self ) -> None:
+        pass
+
+    def Unfinished( self ) -> List[ int ]:
+        return self.unfinished
+
+
+def stop( offset: int, unfinished: List[ int ] ) -> List[ int ]:
+    async def main():
+        bot = Bot()
+        poller = Poller( None, bot, Updates( unfinished ) )
+        poller.offset = offset
+        poller._task = asyncio.create_task( asyncio.sleep( 10 ) )
+        await poller.Stop()
+        return bot.confirmed
+    return asyncio.run( main() )
+
+
+def test_stop_confirms_everything_processed():
+    assert stop( 8, [] ) == [ 8 ]
+
+
+def test_stop_keeps_unprocessed_updates():
+    # 5 is still in the pipeline, it and everything after it comes again
+    assert stop( 8, [ 5, 7 ] ) == [ 5 ]
+
+
+class SlowDispatcher:
+    async def feed_raw_update( self, bot: Any, update: Dict[ str, Any ] ) -> None:
+        await asyncio.sleep( 10 )
+
+
+def test_pipeline_keeps_unfinished_updates():
+    async def main():
+        pipeline = UpdatesPipeline( SlowDispatcher(), None )
+        await pipeline.Start( workers=1 )
+        for update_id in ( 5, 6 ):
+            pipeline.Put( { 'update_id': update_id, 'message': { 'chat': { 'id': 100 } } } )
+        await asyncio.sleep( 0 )
+        await pipeline.Stop( timeout=0.05 )
+        return pipeline.Unfinished()
+
+    assert asyncio.run( main() ) == [ 5, 6 ]
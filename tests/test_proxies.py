@@ -0,0 +1,106 @@
+import random
+import asyncio
+from collections import Counter
+from typing import Any
+from app.classes.proxies import ProxyPool
+
+A = 'http://10.0.0.1:3128/'
+B = 'http://10.0.0.2:3128/'
+
+
+def test_weight_prefers_successful_and_fast_proxies():
+    weight = ProxyPool.weight
+    unknown = weight( 0, 0, 0 )
+    assert weight( 20, 0, 2 ) > unknown > weight( 0, 5, 0 )
+    assert weight( 20, 0, 2 ) > weight( 20, 0, 40 )
+
+
+def test_failures_in_a_row_quarantine_a_proxy( redis ):
+    async def main():
+        client = redis()
+        pool = ProxyPool( client )
+        for _ in range( ProxyPool.failures ):
+            await pool.Report( 'ranobelib.me', A, False )
+        first = await client.ttl( f'proxy_quarantine_ranobelib.me_{pool.proxyId( A )}' )
+        for _ in range( ProxyPool.failures ):
+            await pool.Report( 'ranobelib.me', A, False )
+        second = await client.ttl( f'proxy_quarantine_ranobelib.me_{pool.proxyId( A )}' )
+        picks = { await pool.Pick( 'ranobelib.me', [ A, B ] ) for _ in range( 20 ) }
+        elsewhere = { await pool.Pick( 'tl.rulate.ru', [ A, B ] ) for _ in range( 300 ) }
+        return first, second, picks, elsewhere
+
+    first, second, picks, elsewhere = asyncio.run( main() )
+    # every new quarantine lasts twice as long
+    base = ProxyPool.quarantine_base
+    assert base - 5 < first <= base and base * 2 - 5 < second <= base * 2
+    assert picks == { B }
+    # the quarantine is for the site only
+    assert elsewhere == { A, B }
+
+
+def test_a_success_resets_the_failures( redis ):
+    async def main():
+        client = redis()
+        pool = ProxyPool( client )
+        for _ in range( ProxyPool.failures - 1 ):
+            await pool.Report( 'ranobelib.me', A, False )
+        await pool.Report( 'ranobelib.me', A, True, 0.1 )
+        await pool.Report( 'ranobelib.me', A, False )
+        return await client.exists( f'proxy_quarantine_ranobelib.me_{pool.proxyId( A )}' )
+
+    assert asyncio.run( main() ) == 0
+
+
+def test_failed_probes_quarantine_everywhere( redis ):
+    async def main():
+        pool = ProxyPool( redis() )
+        for _ in range( ProxyPool.failures ):
+            await pool.Report( '', A, False )
+        return { await pool.Pick( 'ranobelib.me', [ A, B ] ) for _ in range( 20 ) }
+
+    assert asyncio.run( main() ) == { B }
+
+
+def test_everything_quarantined_still_picks( redis ):
+    async def main():
+        pool = ProxyPool( redis() )
+        for proxy in ( A, B ):
+            for _ in range( ProxyPool.failures ):
+                await pool.Report( 'ranobelib.me', proxy, False )
+        return { await pool.Pick( 'ranobelib.me', [ A, B ] ) for _ in range( 50 ) }
+
+    assert asyncio.run( main() ) == { A, B }
+
+
+def test_reports_shift_the_picks( redis ):
+    async def main():
+        pool = ProxyPool( redis() )
+        for _ in range( 20 ):
+            await pool.Report( 'ranobelib.me', A, True, 0.2 )
+            await pool.Report( 'ranobelib.me', B, True, 3 )
+        return Counter( [ await pool.Pick( 'ranobelib.me', [ A, B ] ) for _ in range( 300 ) ] )
+
+    random.seed( 1 )
+    picks = asyncio.run( main() )
+    # the slow proxy still gets some of the traffic
+    assert picks[ A ] > picks[ B ] * 3 and picks[ B ] > 0
+
+
+def test_exclude_and_single_candidates():
+    pool = ProxyPool( None )
+    assert asyncio.run( pool.Pick( 'ranobelib.me', [ A, B ], exclude=[ A ] ) ) == B
+    assert asyncio.run( pool.Pick( 'ranobelib.me', [ A ], exclude=[ A ] ) ) == ''
+
+
+class FailingRedis:
+    def pipeline( self, *args: Any, **kwargs: Any ) -> Any:
+        raise ConnectionError( 'redis is down' )
+
+
+def test_redis_down_picks_at_random():
+    async def main():
+        pool = ProxyPool( FailingRedis() )
+        await pool.Report( 'ranobelib.me', A, False )
+        return { await pool.Pick( 'ranobelib.me', [ A, B ] ) for _ in range( 50 ) }
+
+    assert asyncio.run( main() ) == { A, B }
@@ -0,0 +1,97 @@
+import asyncio
+import pytest
+from app.classes.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker( 'test_open', failure_threshold=2, reset_timeout=60 )
+    breaker.Failure()
+    assert breaker.Allow()
+    breaker.Failure()
+    assert breaker.State() == CircuitBreaker.OPEN
+    assert not breaker.Allow()
+
+
+def test_breaker_half_open_lets_one_probe():
+    breaker = CircuitBreaker( 'test_probe', failure_threshold=1, reset_timeout=0.01 )
+    breaker.Failure()
+    asyncio.run( asyncio.sleep( 0.02 ) )
+    assert breaker.State() == CircuitBreaker.HALF_OPEN
+    assert breaker.Allow()
+    assert not breaker.Allow()
+    breaker.Success()
+    assert breaker.State() == CircuitBreaker.CLOSED
+
+
+def test_breaker_failed_probe_reopens():
+    breaker = CircuitBreaker( 'test_reopen', failure_threshold=3, reset_timeout=0.01 )
+    for _ in range( 3 ):
+        breaker.Failure()
+    asyncio.run( asyncio.sleep( 0.02 ) )
+    assert breaker.Allow()
+    breaker.Failure()
+    assert breaker.State() == CircuitBreaker.OPEN
+
+
+def test_retry_transient_until_success():
+    calls = []
+
+    async def call():
+        calls.append( 1 )
+        if len( calls ) < 3:
+            raise ConnectionError()
+        return 'ok'
+
+    policy = RetryPolicy( 'test_retry', base=0.001, cap=0.001, attempts=5, transient=lambda e: isinstance( e, ConnectionError ) )
+    assert asyncio.run( policy.Run( call ) ) == 'ok'
+    assert len( calls ) == 3
+
+
+def test_retry_gives_up():
+    calls = []
+
+    async def call():
+        calls.append( 1 )
+        raise ConnectionError()
+
+    policy = RetryPolicy( 'test_exhausted', base=0.001, cap=0.001, attempts=3, transient=lambda e: True )
+    with pytest.raises( ConnectionError ):
+        asyncio.run( policy.Run( call ) )
+    assert len( calls ) == 3
+
+
+def test_retry_not_transient_is_raised_at_once():
+    calls = []
+
+    async def call():
+        calls.append( 1 )
+        raise ValueError()
+
+    breaker = CircuitBreaker( 'test_answer', failure_threshold=1 )
+    policy = RetryPolicy( 'test_answer', base=0.001, attempts=3, transient=lambda e: False )
+    with pytest.raises( ValueError ):
+        asyncio.run( policy.Run( call, breaker=breaker ) )
+    assert len( calls ) == 1
+    # an error answer still means the other side is alive
+    assert breaker.State() == CircuitBreaker.CLOSED
+
+
+def test_retry_timeouts_off():
+    calls = []
+
+    async def call():
+        calls.append( 1 )
+        raise TimeoutError()
+
+    policy = RetryPolicy( 'test_timeouts', base=0.001, attempts=3, transient=lambda e: False, retry_timeouts=False )
+    with pytest.raises( TimeoutError ):
+        asyncio.run( policy.Run( call ) )
+    assert len( calls ) == 1
+
+
+def test_open_breaker_fails_fast():
+    breaker = CircuitBreaker( 'test_fast', failure_threshold=1, reset_timeout=60 )
+    breaker.Failure()
+    policy = RetryPolicy( 'test_fast', base=0.001 )
+    with pytest.raises( CircuitOpenError ):
+        asyncio.run( policy.Run( lambda: asyncio.sleep( 0 ), breaker=breaker ) )
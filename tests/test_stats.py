@@ -0,0 +1,62 @@
+import asyncio
+from datetime import date
+from typing import Any, Dict, List
+from app.classes.stats import StatsBuffer
+
+DAY = date( 2024, 1, 1 )
+
+
+def deltas( success: int = 0, failure: int = 0, orig_size: int = 0, oper_size: int = 0 ) -> Dict[ str, int ]:
+    return { 'success': success, 'failure': failure, 'orig_size': orig_size, 'oper_size': oper_size }
+
+
+def test_merge_adds_deltas_per_key():
+    rows = {}
+    StatsBuffer.merge( rows, ( 1, 'a', DAY ), deltas( success=1, orig_size=10 ) )
+    StatsBuffer.merge( rows, ( 1, 'a', DAY ), deltas( failure=1, orig_size=5, oper_size=3 ) )
+    StatsBuffer.merge( rows, ( 2, 'a', DAY ), deltas( success=1 ) )
+    assert rows == {
+        ( 1, 'a', DAY ): deltas( success=1, failure=1, orig_size=15, oper_size=3 ),
+        ( 2, 'a', DAY ): deltas( success=1 ),
+    }
+
+
+def test_merge_copies_the_first_deltas():
+    rows = {}
+    first = deltas( success=1 )
+    StatsBuffer.merge( rows, ( 1, 'a', DAY ), first )
+    StatsBuffer.merge( rows, ( 1, 'a', DAY ), deltas( success=1 ) )
+    assert first['success'] == 1
+
+
+def flush( error: Exception | None, retryable: bool ) -> StatsBuffer:
+    async def main():
+        batches: List[ List[ Dict[ str, Any ] ] ] = []
+
+        async def writer( rows: List[ Dict[ str, Any ] ] ) -> None:
+            batches.append( rows )
+            if error:
+                raise error
+
+        buffer = StatsBuffer( writer, retryable=lambda e: retryable )
+        buffer.Add( 1, 'a', DAY, success=1 )
+        buffer.Add( 1, 'a', DAY, success=1, orig_size=7 )
+        await buffer.Flush()
+        return buffer, batches
+    return asyncio.run( main() )
+
+
+def test_flush_writes_one_row_per_key():
+    buffer, batches = flush( None, True )
+    assert batches == [ [ { 'user_id': 1, 'site': 'a', 'day': DAY, **deltas( success=2, orig_size=7 ) } ] ]
+    assert buffer.Pending( 1, DAY ) == 0
+
+
+def test_retryable_failure_is_kept():
+    buffer, _ = flush( ConnectionError(), True )
+    assert buffer.Pending( 1, DAY ) == 2
+
+
+def test_other_failure_is_dropped():
+    buffer, _ = flush( ValueError(), False )
+    assert buffer.Pending( 1, DAY ) == 0
@@ -0,0 +1,71 @@
+import asyncio
+from typing import Any, Dict, List
+from app.classes.updates import UpdatesPipeline
+
+
+class Dispatcher:
+    # records when every update starts and ends, the handler of a chat takes its time
+    def __init__( self, delay: float = 0.02 ) -> None:
+        self.delay = delay
+        self.events: List[ tuple ] = []
+
+    async def feed_raw_update( self, bot: Any, update: Dict[ str, Any ] ) -> None:
+        self.events.append( ( 'start', update['update_id'] ) )
+        await asyncio.sleep( self.delay )
+        self.events.append( ( 'end', update['update_id'] ) )
+
+
+def message( update_id: int, chat_id: int ) -> Dict[ str, Any ]:
+    return {
+        'update_id': update_id,
+        'message': { 'message_id': update_id, 'chat': { 'id': chat_id }, 'from': { 'id': chat_id } }
+    }
+
+
+def test_chat_updates_are_processed_in_order():
+    async def main():
+        dispatcher = Dispatcher()
+        pipeline = UpdatesPipeline( dispatcher, None )
+        await pipeline.Start( workers=4 )
+        for update_id in range( 1, 5 ):
+            assert pipeline.Put( message( update_id, 100 ) )
+        await pipeline.Stop()
+        return dispatcher.events
+
+    events = asyncio.run( main() )
+    # never two updates of the chat at once, and in the order they came
+    assert events == [ ( kind, i ) for i in range( 1, 5 ) for kind in ( 'start', 'end' ) ]
+
+
+def test_chats_run_in_parallel():
+    async def main():
+        dispatcher = Dispatcher()
+        pipeline = UpdatesPipeline( dispatcher, None )
+        await pipeline.Start( workers=4 )
+        for update_id, chat_id in enumerate( [ 1, 2, 3 ], 1 ):
+            pipeline.Put( message( update_id, chat_id ) )
+        await pipeline.Stop()
+        return dispatcher.events
+
+    events = asyncio.run( main() )
+    assert [ kind for kind, _ in events[:3] ] == [ 'start', 'start', 'start' ]
+
+
+def test_full_queue_rejects():
+    async def main():
+        pipeline = UpdatesPipeline( Dispatcher(), None )
+        await pipeline.Start( workers=1, queue_size=2, overload='shed' )
+        accepted = [ pipeline.Put( message( i, 100 ) ) for i in range( 1, 4 ) ]
+        await pipeline.Stop()
+        return accepted, pipeline.overload
+
+    accepted, overload = asyncio.run( main() )
+    assert accepted == [ True, True, False ]
+    assert overload == 'shed'
+
+
+def test_chat_key():
+    assert UpdatesPipeline.chatKey( message( 1, 42 ) ) == 42
+    assert UpdatesPipeline.chatKey( { 'update_id': 7, 'callback_query': { 'from': { 'id': 9 }, 'message': { 'chat': { 'id': 11 } } } } ) == 11
+    assert UpdatesPipeline.chatKey( { 'update_id': 7, 'inline_query': { 'from': { 'id': 9 } } } ) == 9
+    assert UpdatesPipeline.chatKey( { 'update_id': 7 } ) == 7
@@ -0,0 +1,107 @@
+import asyncio
+from typing import Any
+from app import dto
+from app import variables
+from app.classes.database import DataBase
+from app.classes.usage import UsageCounter
+
+
+def test_incr_never_creates_a_counter( redis ):
+    async def main():
+        client = redis()
+        usage = UsageCounter( client )
+        await usage.Incr( 1, 2 )
+        missing = await usage.Get( 1 )
+        await usage.Seed( 1, 3 )
+        await usage.Incr( 1, 2 )
+        return missing, await usage.Get( 1 ), await client.ttl( usage.key( 1 ) )
+
+    missing, counted, ttl = asyncio.run( main() )
+    assert missing is None
+    assert counted == 5
+    assert ttl > 0
+
+
+def test_seed_keeps_a_counter_already_there( redis ):
+    async def main():
+        usage = UsageCounter( redis() )
+        await usage.Seed( 1, 3 )
+        await usage.Incr( 1 )
+        # a slower reader seeds what it counted before the increment
+        await usage.Seed( 1, 3 )
+        return await usage.Get( 1 )
+
+    assert asyncio.run( main() ) == 4
+
+
+def test_reconcile_only_raises_counters( redis ):
+    async def main():
+        client = redis()
+        usage = UsageCounter( client )
+        await usage.Seed( 1, 5 )
+        await usage.Seed( 2, 5 )
+        await usage.Reconcile( { 1: 3, 2: 8, 3: 1 } )
+        return [ await usage.Get( user_id ) for user_id in ( 1, 2, 3 ) ], await client.ttl( usage.key( 3 ) )
+
+    counters, ttl = asyncio.run( main() )
+    assert counters == [ 5, 8, 1 ]
+    assert ttl > 0
+
+
+class FailingRedis:
+    def register_script( self, script: str ) -> Any:
+        async def call( *args: Any, **kwargs: Any ) -> Any:
+            raise ConnectionError( 'redis is down' )
+        return call
+
+    async def get( self, *args: Any ) -> Any:
+        raise ConnectionError( 'redis is down' )
+
+    async def set( self, *args: Any, **kwargs: Any ) -> Any:
+        raise ConnectionError( 'redis is down' )
+
+
+def database( client: Any, usage: int ) -> DataBase:
+    # the day's usage in the database is usage, reads of it are counted
+    db = DataBase( client )
+    db.reads = []
+
+    async def fromDB( user_id: int ) -> int:
+        db.reads.append( user_id )
+        return usage
+    db.getUserUsageFromDB = fromDB
+    return db
+
+
+def result( user_id: int ) -> dto.DownloadResult:
+    return dto.DownloadResult(
+        task_id=1, user_id=user_id, chat_id=user_id, message_id=1, site='ranobelib.me', status=variables.DownloaderStep.DONE,
+        text='', cover='', thumb='', files=[], orig_size=0, oper_size=0
+    )
+
+
+def test_usage_is_seeded_from_the_database_once( redis ):
+    async def main():
+        db = database( redis(), 4 )
+        # a download finished but not flushed yet counts as well
+        db._stats.Add( 1, 'ranobelib.me', UsageCounter.today(), success=1 )
+        first = await db.GetUserUsage( 1 )
+        await db.UpdateUserStat( result( 1 ) )
+        return first, await db.GetUserUsage( 1 ), db.reads
+
+    first, second, reads = asyncio.run( main() )
+    assert first == 5
+    assert second == 6
+    assert reads == [ 1 ]
+
+
+def test_usage_falls_back_to_the_database_without_redis():
+    async def main():
+        db = database( FailingRedis(), 4 )
+        await db.UpdateUserStat( result( 1 ) )
+        return await db.GetUserUsage( 1 ), await db.GetUserUsage( 1 ), db.reads
+
+    first, second, reads = asyncio.run( main() )
+    # the buffered download is counted from the stats buffer, the database is asked every time
+    assert first == second == 5
+    assert reads == [ 1, 1 ]